@@ -0,0 +1,441 @@
+"""
+Offline load test for the parseldeğer.com backend.
+
+Runs the FastAPI app in-process and replaces every upstream with a local
+stand-in with configurable latency, error rate and 429 injection:
+
+- Brave Search and Emergent auth through a fake httpx transport
+- Gemini through a fake google-genai client
+- MongoDB through a local mongod (--mongo-url) or mongomock-motor (--mongomock)
+
+A mixed workload of anonymous, authenticated, webhook and bulk traffic is
+driven by concurrent virtual users. Latency percentiles and throughput are
+printed and saved as JSON so runs can be compared (--baseline).
+
+    cd backend
+    python bench/load_test.py --duration 30 --concurrency 50
+    python bench/load_test.py --mix anonymous=1 --gemini-latency-ms 4000 --rate-limit-rate 0.2
+    python bench/load_test.py --baseline bench/results/previous.json
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import hmac
+import json
+import os
+import random
+import statistics
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import httpx
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+
+SCENARIOS = ["anonymous", "authenticated", "webhook", "bulk"]
+
+ILLER = [
+    ("İstanbul", "Kadıköy", "Moda"),
+    ("İstanbul", "Beşiktaş", "Levent"),
+    ("Ankara", "Çankaya", "Kızılay"),
+    ("İzmir", "Karşıyaka", "Bostanlı"),
+    ("Antalya", "Muratpaşa", "Lara"),
+]
+
+
+class FakeUpstream:
+    """Latency / failure profile of one fake upstream"""
+
+    def __init__(self, latency_ms: float, jitter_ms: float, error_rate: float, rate_limit_rate: float):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.calls = 0
+
+    async def delay(self):
+        self.calls += 1
+        latency = max(0.0, random.gauss(self.latency_ms, self.jitter_ms)) / 1000
+        await asyncio.sleep(latency)
+
+    def failure(self) -> int:
+        """HTTP status to fail with (429/500), or 0 for success"""
+        roll = random.random()
+        if roll < self.rate_limit_rate:
+            return 429
+        if roll < self.rate_limit_rate + self.error_rate:
+            return 500
+        return 0
+
+
+class FakeUpstreamTransport(httpx.AsyncBaseTransport):
+    """Answers Brave Search and Emergent auth requests locally"""
+
+    def __init__(self, brave: FakeUpstream, auth: FakeUpstream, sessions: dict):
+        self.brave = brave
+        self.auth = auth
+        self.sessions = sessions
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        if request.url.host == "api.search.brave.com":
+            return await self._brave(request)
+        if request.url.host == "demobackend.emergentagent.com":
+            return await self._auth(request)
+        return httpx.Response(404, request=request)
+
+    async def _brave(self, request: httpx.Request) -> httpx.Response:
+        await self.brave.delay()
+        status = self.brave.failure()
+        if status:
+            return httpx.Response(status, json={"error": "fake"}, request=request)
+
+        query = request.url.params.get("q", "")
+        results = [
+            {
+                "url": f"https://example.com/{hashlib.md5(query.encode()).hexdigest()}/{i}",
+                "title": f"{query} sonuç {i}",
+                "description": f"{query} imar durumu KAK 1.{i} TAKS 0.{i} emsal 1.{i} yapılaşma koşulları",
+            }
+            for i in range(10)
+        ]
+        return httpx.Response(200, json={"web": {"results": results}}, request=request)
+
+    async def _auth(self, request: httpx.Request) -> httpx.Response:
+        await self.auth.delay()
+        status = self.auth.failure()
+        if status:
+            return httpx.Response(status, json={"error": "fake"}, request=request)
+
+        session_id = request.headers.get("X-Session-ID", "")
+        email = self.sessions.get(session_id, f"{session_id}@bench.local")
+        return httpx.Response(200, json={
+            "email": email,
+            "name": "Bench User",
+            "picture": None,
+            "session_token": f"bench_{uuid.uuid4().hex}",
+        }, request=request)
+
+
+def fake_analysis_text() -> str:
+    return "İMAR DURUMU\nKonut alanı.\n\nYAPILAŞMA KOŞULLARI\nKAK: 1.50\nTAKS: 0.30\nEmsal: 1.50\nMaksimum Kat Sayısı: 5\nYapı Yüksekliği: 15.50 m\n" * 10
+
+
+def make_fake_gemini(gemini: FakeUpstream):
+    """Fake google-genai module backed by the `gemini` profile"""
+
+    def raise_failure():
+        status = gemini.failure()
+        if status == 429:
+            raise Exception("429 RESOURCE_EXHAUSTED: quota exceeded (fake)")
+        if status:
+            raise Exception("500 fake Gemini error")
+
+    class FakeUsage:
+        def __init__(self, contents):
+            self.prompt_token_count = len(contents) // 4
+
+    class FakeChunk:
+        def __init__(self, text, usage=None):
+            self.text = text
+            self.usage_metadata = usage
+
+    class FakeModels:
+        async def generate_content(self, model, contents, config=None):
+            await gemini.delay()
+            raise_failure()
+            return FakeChunk(fake_analysis_text(), FakeUsage(contents))
+
+        async def generate_content_stream(self, model, contents, config=None):
+            raise_failure()
+            text = fake_analysis_text()
+            pieces = [text[i:i + 200] for i in range(0, len(text), 200)]
+
+            async def chunks():
+                for piece in pieces:
+                    await asyncio.sleep(gemini.latency_ms / 1000 / len(pieces))
+                    yield FakeChunk(piece, FakeUsage(contents))
+
+            gemini.calls += 1
+            return chunks()
+
+    class FakeAio:
+        def __init__(self):
+            self.models = FakeModels()
+
+        async def aclose(self):
+            pass
+
+    class FakeGenaiClient:
+        def __init__(self, api_key=None, **kwargs):
+            self.aio = FakeAio()
+
+    class FakeGenai:
+        Client = FakeGenaiClient
+
+    return FakeGenai
+
+
+def percentile(values, pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(samples: list, elapsed: float) -> dict:
+    latencies = [sample["latency"] for sample in samples]
+    statuses = {}
+    for sample in samples:
+        statuses[str(sample["status"])] = statuses.get(str(sample["status"]), 0) + 1
+    return {
+        "requests": len(samples),
+        "throughput_rps": round(len(samples) / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 1) if latencies else 0.0,
+        "max_ms": round(max(latencies) * 1000, 1) if latencies else 0.0,
+        "statuses": statuses,
+    }
+
+
+class LoadTest:
+    def __init__(self, server, args):
+        self.server = server
+        self.args = args
+        self.samples = {scenario: [] for scenario in SCENARIOS}
+        self.users = []
+        self.parcels = []
+        for i in range(args.parcels):
+            il, ilce, mahalle = ILLER[i % len(ILLER)]
+            self.parcels.append({"il": il, "ilce": ilce, "mahalle": mahalle, "ada": str(100 + i), "parsel": str(i % 40 + 1)})
+
+    async def seed_users(self):
+        """Create bench users with plenty of credits and a valid session each"""
+        db = self.server.db
+        now = datetime.now(timezone.utc)
+        for i in range(self.args.users):
+            user_id = f"user_bench_{uuid.uuid4().hex[:12]}"
+            token = f"bench_session_{uuid.uuid4().hex}"
+            email = f"{user_id}@bench.local"
+            await db.users.insert_one({
+                "user_id": user_id,
+                "email": email,
+                "name": f"Bench User {i}",
+                "picture": None,
+                "credits": 1_000_000,
+                "created_at": now.isoformat(),
+            })
+            await db.user_sessions.insert_one({
+                "user_id": user_id,
+                "session_token": token,
+                "expires_at": now + timedelta(days=1),
+                "created_at": now.isoformat(),
+            })
+            self.users.append({"user_id": user_id, "token": token, "email": email})
+
+    async def timed(self, scenario: str, call):
+        started = time.perf_counter()
+        try:
+            status = await call()
+        except Exception as e:
+            status = type(e).__name__
+        self.samples[scenario].append({"latency": time.perf_counter() - started, "status": status})
+
+    async def anonymous(self, http: httpx.AsyncClient):
+        ip = f"10.{random.randint(0, 255)}.{random.randint(0, 255)}.{random.randint(1, 254)}"
+        response = await http.post(
+            "/api/analyze-property",
+            json=random.choice(self.parcels),
+            headers={"X-Forwarded-For": ip},
+        )
+        return response.status_code
+
+    async def authenticated(self, http: httpx.AsyncClient):
+        user = random.choice(self.users)
+        headers = {"Authorization": f"Bearer {user['token']}"}
+        if random.random() < 0.5:
+            response = await http.get("/api/credits", headers=headers)
+        else:
+            response = await http.post("/api/analyze-property", json=random.choice(self.parcels), headers=headers)
+        return response.status_code
+
+    async def webhook(self, http: httpx.AsyncClient):
+        user = random.choice(self.users)
+        order = {
+            "email": user["email"],
+            "orderid": f"bench_{uuid.uuid4().hex}",
+            "price": random.choice(["50", "75", "100"]),
+            "buyername": "Bench",
+            "buyersurname": "User",
+            "istest": 1,
+            "currency": 0,
+        }
+        res = base64.b64encode(json.dumps(order).encode()).decode()
+        signature = hmac.new(
+            self.server.SHOPIER_OSB_KEY.encode(),
+            (res + self.server.SHOPIER_OSB_USERNAME).encode(),
+            hashlib.sha256,
+        ).hexdigest()
+        response = await http.post("/api/payment/webhook", data={"res": res, "hash": signature})
+        return response.status_code if response.text == "success" else f"{response.status_code}:{response.text}"
+
+    async def bulk(self, http: httpx.AsyncClient):
+        user = random.choice(self.users)
+        rows = random.sample(self.parcels, min(self.args.bulk_size, len(self.parcels)))
+        async with http.stream(
+            "POST",
+            "/api/analyze-property/bulk",
+            json=rows,
+            headers={"Authorization": f"Bearer {user['token']}"},
+        ) as response:
+            async for _ in response.aiter_lines():
+                pass
+        return response.status_code
+
+    async def virtual_user(self, http: httpx.AsyncClient, deadline: float, scenarios: list, weights: list):
+        while time.perf_counter() < deadline:
+            scenario = random.choices(scenarios, weights)[0]
+            await self.timed(scenario, lambda: getattr(self, scenario)(http))
+
+    async def run(self) -> dict:
+        mix = parse_mix(self.args.mix)
+        scenarios = [name for name in SCENARIOS if mix.get(name)]
+        weights = [mix[name] for name in scenarios]
+
+        await self.seed_users()
+        transport = httpx.ASGITransport(app=self.server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as http:
+            started = time.perf_counter()
+            deadline = started + self.args.duration
+            await asyncio.gather(*[
+                self.virtual_user(http, deadline, scenarios, weights) for _ in range(self.args.concurrency)
+            ])
+            elapsed = time.perf_counter() - started
+
+        all_samples = [sample for samples in self.samples.values() for sample in samples]
+        return {
+            "started_at": datetime.now(timezone.utc).isoformat(),
+            "config": vars(self.args),
+            "elapsed_s": round(elapsed, 2),
+            "overall": summarize(all_samples, elapsed),
+            "scenarios": {name: summarize(samples, elapsed) for name, samples in self.samples.items() if samples},
+        }
+
+
+def parse_mix(mix: str) -> dict:
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        if name not in SCENARIOS:
+            raise SystemExit(f"Unknown scenario '{name}', expected one of {SCENARIOS}")
+        weights[name] = float(weight or 1)
+    return weights
+
+
+def print_report(report: dict, baseline: dict = None):
+    print(f"\n📊 {report['overall']['requests']} requests in {report['elapsed_s']}s")
+    header = f"{'scenario':<15}{'reqs':>8}{'rps':>9}{'p50':>9}{'p95':>9}{'p99':>9}  statuses"
+    print(header)
+    print("-" * len(header))
+    rows = [("overall", report["overall"])] + list(report["scenarios"].items())
+    for name, stats in rows:
+        print(f"{name:<15}{stats['requests']:>8}{stats['throughput_rps']:>9}{stats['p50_ms']:>9}{stats['p95_ms']:>9}{stats['p99_ms']:>9}  {stats['statuses']}")
+        if baseline:
+            before = baseline["overall"] if name == "overall" else baseline.get("scenarios", {}).get(name)
+            if before:
+                deltas = [
+                    f"{key}: {before[key]} → {stats[key]} ({(stats[key] - before[key]) / before[key] * 100:+.1f}%)"
+                    for key in ("throughput_rps", "p50_ms", "p95_ms", "p99_ms") if before[key]
+                ]
+                print(f"{'':<15}  vs baseline: " + ", ".join(deltas))
+
+
+def import_server(args):
+    """Import server.py with bench settings and fake upstreams"""
+    os.environ.setdefault("MONGO_URL", args.mongo_url)
+    os.environ.setdefault("DB_NAME", args.db_name)
+    os.environ.setdefault("BRAVE_API_KEY", "bench")
+    os.environ.setdefault("GEMINI_API_KEYS", ",".join(f"bench-key-{i:08d}" for i in range(args.gemini_keys)))
+    # The bench drives a handful of users/IPs far past production budgets
+    os.environ.setdefault("RATE_LIMIT_ANONYMOUS", "1000000/60")
+    os.environ.setdefault("RATE_LIMIT_AUTHENTICATED", "1000000/60")
+    os.environ.setdefault("RATE_LIMIT_BULK", "1000000/60")
+    # Measure the server, not the per-key Gemini throttle
+    os.environ.setdefault("GEMINI_KEY_RPM", "0")
+    os.environ.setdefault("GEMINI_KEY_TPM", "0")
+    # Warm-up would reach the real upstreams before the fakes are swapped in
+    os.environ.setdefault("WARMUP_ENABLED", "false")
+    sys.path.insert(0, str(BACKEND_DIR))
+
+    import server
+
+    if args.mongomock:
+        from mongomock_motor import AsyncMongoMockClient
+        server.client = AsyncMongoMockClient()
+        server.db = server.client[args.db_name]
+    return server
+
+
+async def main(args):
+    server = import_server(args)
+
+    brave = FakeUpstream(args.brave_latency_ms, args.brave_latency_ms / 4, args.error_rate, args.rate_limit_rate)
+    auth = FakeUpstream(args.auth_latency_ms, args.auth_latency_ms / 4, args.error_rate, 0.0)
+    gemini = FakeUpstream(args.gemini_latency_ms, args.gemini_latency_ms / 4, args.error_rate, args.rate_limit_rate)
+    server.genai = make_fake_gemini(gemini)
+
+    async with server.app.router.lifespan_context(server.app):
+        # Swap the real upstream pool for the fakes once startup created it
+        await server.http_client.aclose()
+        server.http_client = httpx.AsyncClient(transport=FakeUpstreamTransport(brave, auth, {}))
+
+        report = await LoadTest(server, args).run()
+        report["upstream_calls"] = {"brave": brave.calls, "auth": auth.calls, "gemini": gemini.calls}
+
+        if not args.keep_data:
+            await server.client.drop_database(args.db_name)
+
+    baseline = json.loads(Path(args.baseline).read_text()) if args.baseline else None
+    print_report(report, baseline)
+
+    output = Path(args.output) if args.output else RESULTS_DIR / f"{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2, ensure_ascii=False))
+    print(f"\n💾 Results saved to {output}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline load test with local upstream stand-ins")
+    parser.add_argument("--duration", type=float, default=30, help="seconds to run")
+    parser.add_argument("--concurrency", type=int, default=20, help="virtual users")
+    parser.add_argument("--mix", default="anonymous=4,authenticated=4,webhook=1,bulk=1", help="scenario weights")
+    parser.add_argument("--users", type=int, default=50, help="seeded authenticated users")
+    parser.add_argument("--parcels", type=int, default=200, help="distinct parcels to draw from")
+    parser.add_argument("--bulk-size", type=int, default=20, help="rows per bulk request")
+    parser.add_argument("--gemini-keys", type=int, default=4, help="fake Gemini API keys")
+    parser.add_argument("--brave-latency-ms", type=float, default=300)
+    parser.add_argument("--gemini-latency-ms", type=float, default=2000)
+    parser.add_argument("--auth-latency-ms", type=float, default=100)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of upstream calls failing with 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="fraction of Brave/Gemini calls failing with 429")
+    parser.add_argument("--mongo-url", default="mongodb://localhost:27017")
+    parser.add_argument("--db-name", default=f"parseldeger_bench_{uuid.uuid4().hex[:8]}")
+    parser.add_argument("--mongomock", action="store_true", help="use mongomock-motor instead of a local mongod")
+    parser.add_argument("--keep-data", action="store_true", help="don't drop the bench database afterwards")
+    parser.add_argument("--output", help="JSON results file (default: bench/results/<timestamp>.json)")
+    parser.add_argument("--baseline", help="previous results JSON to compare against")
+    parser.add_argument("--seed", type=int, default=None, help="random seed")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    random.seed(arguments.seed)
+    asyncio.run(main(arguments))
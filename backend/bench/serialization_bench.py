@@ -0,0 +1,93 @@
+"""
+Serialization and compression micro-benchmark for the hot JSON routes.
+
+Compares, per route, the cost of building the response body the old way
+(pydantic response model + jsonable_encoder + stdlib json, FastAPI's default
+path) with the current orjson path, and shows the body size after gzip and
+brotli at the server's configured levels.
+
+    cd backend
+    python bench/serialization_bench.py --number 2000
+"""
+import argparse
+import os
+import timeit
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, ORJSONResponse
+
+from load_test import fake_analysis_text, import_server
+
+
+def route_payloads(server) -> dict:
+    """Representative response bodies keyed by route"""
+    now = datetime.now(timezone.utc)
+    analysis = {
+        "analysis": fake_analysis_text(),
+        "remaining_credits": 4,
+        "search_query": "İstanbul Kadıköy Moda ada 101 parsel 7 imar durumu KAK TAKS emsal yapılaşma koşulları"
+    }
+    summary = {
+        "analysis_id": "0b7f8a2c-1d2e-4f3a-9b8c-7d6e5f4a3b2c",
+        "property_info": "İl: İstanbul, İlçe: Kadıköy, Mahalle: Moda, Ada: 101, Parsel: 7",
+        "search_query": analysis["search_query"],
+        "cached": False,
+        "timestamp": now
+    }
+    return {
+        "POST /api/analyze-property": (analysis, server.PropertyAnalysisResponse),
+        "GET /api/analyses": ({
+            "items": [dict(summary, timestamp=now - timedelta(hours=i)) for i in range(server.HISTORY_DEFAULT_LIMIT)],
+            "next_cursor": "eyJ0IjogIjIwMjYtMDEtMDFUMDA6MDA6MDAiLCAiaWQiOiAiNjVhYmMxMjMifQ"
+        }, None),
+        "GET /api/analyses/{id}": ({**summary, "status": "done", "analysis": analysis["analysis"]}, None),
+        "GET /api/credits": ({"remaining_credits": 18, "is_authenticated": True}, None),
+        "GET /api/payment/packages": (server.PAYMENT_PACKAGES, None),
+    }
+
+
+def before(content, model):
+    if model is not None:
+        content = model(**content)
+    return JSONResponse(jsonable_encoder(content)).body
+
+
+def after(content, model):
+    return ORJSONResponse(content).body
+
+
+def main(args):
+    server = import_server(SimpleNamespace(
+        mongo_url=os.environ.get("MONGO_URL", "mongodb://localhost:27017"),
+        db_name="parseldeger_bench",
+        gemini_keys=1,
+        mongomock=False
+    ))
+
+    header = f"{'route':<28} {'before µs':>10} {'after µs':>10} {'speedup':>8} {'bytes':>7} {'gzip':>7} {'br':>7}"
+    print(header)
+    print("-" * len(header))
+    for route, (content, model) in route_payloads(server).items():
+        timings = {}
+        for name, build in (("before", before), ("after", after)):
+            best = min(timeit.repeat(lambda: build(content, model), number=args.number, repeat=args.repeat))
+            timings[name] = best / args.number * 1_000_000
+
+        body = after(content, model)
+        gzipped = server.compress_body(body, "gzip")
+        brotli = server.compress_body(body, "br")
+        print(f"{route:<28} {timings['before']:>10.1f} {timings['after']:>10.1f} "
+              f"{timings['before'] / timings['after']:>7.1f}x {len(body):>7} {len(gzipped):>7} {len(brotli):>7}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Per-route serialization cost and compressed size")
+    parser.add_argument("--number", type=int, default=1000, help="serializations per timing run")
+    parser.add_argument("--repeat", type=int, default=5, help="timing runs (the best one is reported)")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    main(parse_args())
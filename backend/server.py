@@ -1,32 +1,132 @@
 
-from fastapi import FastAPI, APIRouter, HTTPException, Request, Response, Cookie
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, APIRouter, BackgroundTasks, HTTPException, Request, Response, Cookie
+from fastapi.responses import JSONResponse, ORJSONResponse, StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
+from starlette.datastructures import Headers, MutableHeaders
 from motor.motor_asyncio import AsyncIOMotorClient
 import os
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field, ConfigDict
-from typing import List, Optional
+from pydantic import BaseModel, Field, ConfigDict, ValidationError
+from bson import ObjectId
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional
 import uuid
 from datetime import datetime, timezone, timedelta
-import requests
-from emergentintegrations.llm.chat import LlmChat, UserMessage
+import asyncio
+import time
+import httpx
+from cachetools import TTLCache
+from collections import deque
+from contextlib import asynccontextmanager
+import importlib
 import hashlib
 import hmac
 import json
+import orjson
+import gzip
+import brotli
+import argparse
+import base64
+import re
+import string
+import unicodedata
+import csv
+import io
+from pymongo import ReturnDocument, UpdateOne, monitoring
+from pymongo.errors import DuplicateKeyError, OperationFailure
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
+# Prometheus metrics
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+STAGE_LATENCY = Histogram(
+    "parseldeger_analysis_stage_seconds", "Latency of each analyze_property stage", ["stage"], buckets=LATENCY_BUCKETS
+)
+HTTP_LATENCY = Histogram(
+    "parseldeger_http_request_seconds", "HTTP request latency", ["route", "method", "status"], buckets=LATENCY_BUCKETS
+)
+HTTP_IN_FLIGHT = Gauge("parseldeger_http_requests_in_flight", "HTTP requests being served", ["route"])
+GEMINI_KEY_OUTCOMES = Counter("parseldeger_gemini_key_outcomes_total", "Gemini calls per API key and outcome", ["key", "outcome"])
+BRAVE_QUERIES = Counter("parseldeger_brave_queries_total", "Brave queries per strategy and source", ["strategy", "source"])
+BRAVE_STRATEGY_RESULTS = Counter("parseldeger_brave_strategy_results_total", "Brave results returned per strategy", ["strategy"])
+ANALYSIS_CACHE_LOOKUPS = Counter("parseldeger_analysis_cache_lookups_total", "Analysis cache lookups", ["result"])
+MONGO_LATENCY = Histogram(
+    "parseldeger_mongo_operation_seconds", "MongoDB command latency", ["collection", "command"], buckets=LATENCY_BUCKETS
+)
+RATE_LIMITED = Counter("parseldeger_rate_limited_total", "Requests rejected by the rate limiter", ["kind"])
+CIRCUIT_STATE = Gauge("parseldeger_circuit_state", "Upstream circuit breaker state (0=closed, 1=open, 2=half-open)", ["upstream"])
+BRAVE_HEDGES = Counter("parseldeger_brave_hedges_total", "Hedged Brave requests sent and won", ["outcome"])
+EVENT_LOOP_LAG = Gauge("parseldeger_event_loop_lag_seconds", "Event loop scheduling delay")
+EVENT_LOOP_LAG_INTERVAL_SECONDS = 0.5
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """Feeds per-collection MongoDB command timings into MONGO_LATENCY"""
+
+    def __init__(self):
+        self._collections = {}
+
+    def started(self, event):
+        target = event.command.get("collection") if event.command_name == "getMore" else event.command.get(event.command_name)
+        self._collections[(event.connection_id, event.request_id)] = target if isinstance(target, str) else "-"
+
+    def succeeded(self, event):
+        self._observe(event)
+
+    def failed(self, event):
+        self._observe(event)
+
+    def _observe(self, event):
+        collection = self._collections.pop((event.connection_id, event.request_id), "-")
+        MONGO_LATENCY.labels(collection, event.command_name).observe(event.duration_micros / 1_000_000)
+
+# MongoDB connection (the pool is opened and warmed by the app lifespan)
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+MONGO_MIN_POOL_SIZE = int(os.environ.get('MONGO_MIN_POOL_SIZE', '5'))
+client = AsyncIOMotorClient(mongo_url, minPoolSize=MONGO_MIN_POOL_SIZE, event_listeners=[MongoCommandMetrics()])
 db = client[os.environ['DB_NAME']]
 
-# Create the main app without a prefix
-app = FastAPI()
+# Free analyses per anonymous (IP-based) session
+ANONYMOUS_CREDIT_LIMIT = 5
+
+# Anonymous sessions expire after this much inactivity (0 disables the TTL index)
+ANONYMOUS_SESSION_TTL_DAYS = int(os.environ.get('ANONYMOUS_SESSION_TTL_DAYS', '90'))
+
+# Analysis history pagination
+HISTORY_DEFAULT_LIMIT = 20
+HISTORY_MAX_LIMIT = 100
+HISTORY_SUMMARY_FIELDS = {"_id": 1, "analysis_id": 1, "property_info": 1, "search_query": 1, "cached": 1, "timestamp": 1}
+
+# Sliding-window rate limits for analysis endpoints, as "<requests>/<seconds>"
+RATE_LIMIT_ANONYMOUS = os.environ.get('RATE_LIMIT_ANONYMOUS', '10/60')
+RATE_LIMIT_AUTHENTICATED = os.environ.get('RATE_LIMIT_AUTHENTICATED', '60/60')
+# Bulk batches spend one unit per unique parcel from a separate per-user budget
+RATE_LIMIT_BULK = os.environ.get('RATE_LIMIT_BULK', '1000/3600')
+RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND', 'memory')  # "mongo" shares counters between workers
+
+# Zoning attribute queries
+ZONING_DEFAULT_LIMIT = 50
+ZONING_MAX_LIMIT = 500
+ZONING_FIELDS = ["kak", "taks", "emsal", "max_floors", "height_m"]
+# Accounts that may list individual analyzed parcels (comma-separated emails); everyone else gets area stats
+STAFF_EMAILS = {email.strip().lower() for email in os.environ.get('STAFF_EMAILS', '').split(',') if email.strip()}
+
+# Bulk analysis
+BULK_MAX_ROWS = int(os.environ.get('BULK_MAX_ROWS', '500'))
+BULK_CONCURRENCY = int(os.environ.get('BULK_CONCURRENCY', '8'))
+
+# Background analysis jobs (Mongo-backed queue drained by in-process workers)
+ANALYSIS_WORKERS = int(os.environ.get('ANALYSIS_WORKERS', '4'))
+JOB_LEASE_SECONDS = int(os.environ.get('JOB_LEASE_SECONDS', '120'))
+JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', '3'))
+JOB_RETRY_BACKOFF_SECONDS = float(os.environ.get('JOB_RETRY_BACKOFF_SECONDS', '5'))
+JOB_POLL_INTERVAL_SECONDS = float(os.environ.get('JOB_POLL_INTERVAL_SECONDS', '1'))
+JOB_RETENTION_DAYS = int(os.environ.get('JOB_RETENTION_DAYS', '7'))
+# Fields returned when polling a job, present (possibly null) in every state
+JOB_STATUS_FIELDS = {"job_id": 1, "status": 1, "attempts": 1, "result": 1, "error": 1, "created_at": 1, "updated_at": 1}
+job_wakeup = asyncio.Event()
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
@@ -34,16 +134,95 @@ api_router = APIRouter(prefix="/api")
 # Configuration
 BRAVE_API_KEY = os.environ.get('BRAVE_API_KEY')
 BRAVE_SEARCH_URL = "https://api.search.brave.com/res/v1/web/search"
+EMERGENT_AUTH_URL = "https://demobackend.emergentagent.com/auth/v1/env/oauth/session-data"
+
+# Shared async HTTP client (created by the app lifespan, closed on shutdown)
+HTTP_TIMEOUT_SECONDS = float(os.environ.get('HTTP_TIMEOUT_SECONDS', '10'))
+HTTP_MAX_CONNECTIONS = int(os.environ.get('HTTP_MAX_CONNECTIONS', '100'))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get('HTTP_MAX_KEEPALIVE_CONNECTIONS', '20'))
+http_client: Optional[httpx.AsyncClient] = None
+
+# Analysis result cache: in-process LRU in front of a Mongo TTL collection
+ANALYSIS_CACHE_TTL_SECONDS = int(os.environ.get('ANALYSIS_CACHE_TTL_SECONDS', str(7 * 24 * 60 * 60)))
+ANALYSIS_CACHE_MEMORY_TTL_SECONDS = int(os.environ.get('ANALYSIS_CACHE_MEMORY_TTL_SECONDS', '600'))
+ANALYSIS_CACHE_MAX_ENTRIES = int(os.environ.get('ANALYSIS_CACHE_MAX_ENTRIES', '1024'))
+analysis_memory_cache = TTLCache(
+    maxsize=ANALYSIS_CACHE_MAX_ENTRIES,
+    ttl=min(ANALYSIS_CACHE_MEMORY_TTL_SECONDS, ANALYSIS_CACHE_TTL_SECONDS)
+)
+
+# Content-addressed analysis bodies (analysis_bodies, keyed by SHA-256 of the text):
+# recently seen digests skip the write, recently read bodies skip the query
+analysis_body_cache = TTLCache(maxsize=ANALYSIS_CACHE_MAX_ENTRIES, ttl=ANALYSIS_CACHE_MEMORY_TTL_SECONDS)
+stored_analysis_digests = TTLCache(maxsize=ANALYSIS_CACHE_MAX_ENTRIES * 4, ttl=ANALYSIS_CACHE_MEMORY_TTL_SECONDS)
+
+# Short-lived session/user cache used by get_current_user
+SESSION_CACHE_TTL_SECONDS = float(os.environ.get('SESSION_CACHE_TTL_SECONDS', '30'))
+SESSION_CACHE_MAX_ENTRIES = int(os.environ.get('SESSION_CACHE_MAX_ENTRIES', '10000'))
+session_cache = TTLCache(maxsize=SESSION_CACHE_MAX_ENTRIES, ttl=SESSION_CACHE_TTL_SECONDS)
+user_cache = TTLCache(maxsize=SESSION_CACHE_MAX_ENTRIES, ttl=SESSION_CACHE_TTL_SECONDS)
+
+# In-flight analyses by parcel cache key (single-flight coalescing)
+analysis_inflight: Dict[str, asyncio.Task] = {}
+
+BRAVE_ERROR_PREFIX = "Arama hatası"
+BRAVE_NO_RESULTS_TEXT = "Arama sonucu bulunamadı. Farklı bir bölge veya ada-parsel numarası deneyebilirsiniz."
+
+# Token budget for the search results section of the Gemini prompt
+GEMINI_CONTEXT_TOKEN_BUDGET = int(os.environ.get('GEMINI_CONTEXT_TOKEN_BUDGET', '1500'))
+SNIPPET_DUPLICATE_THRESHOLD = float(os.environ.get('SNIPPET_DUPLICATE_THRESHOLD', '0.8'))
+ZONING_TERMS = ["imar", "kak", "taks", "emsal", "yapılaşma", "kat", "plan", "yükseklik"]
+
+# Brave query cache: raw `web.results` payloads keyed by query parameters
+BRAVE_CACHE_TTL_SECONDS = int(os.environ.get('BRAVE_CACHE_TTL_SECONDS', str(6 * 60 * 60)))
+BRAVE_CACHE_MAX_ENTRIES = int(os.environ.get('BRAVE_CACHE_MAX_ENTRIES', '2048'))
+brave_results_cache = TTLCache(maxsize=BRAVE_CACHE_MAX_ENTRIES, ttl=BRAVE_CACHE_TTL_SECONDS)
+
+# Startup warm-up: pre-connect Mongo, the HTTP pool and the Gemini clients before /api/ready reports ready
+WARMUP_ENABLED = os.environ.get('WARMUP_ENABLED', 'true').lower() == 'true'
+WARMUP_TIMEOUT_SECONDS = float(os.environ.get('WARMUP_TIMEOUT_SECONDS', '10'))
+WARMUP_HTTP_URLS = [BRAVE_SEARCH_URL, EMERGENT_AUTH_URL]
+# Imported lazily on the first HTTP/2 connection otherwise
+WARMUP_IMPORTS = ["httpcore._async.http2", "h2.connection"]
+
+# Upstream circuit breakers: open after N consecutive failures, probe again after the recovery time
+CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get('CIRCUIT_FAILURE_THRESHOLD', '5'))
+CIRCUIT_RECOVERY_SECONDS = float(os.environ.get('CIRCUIT_RECOVERY_SECONDS', '30'))
+
+# Brave tail latency: hedge the required query past this latency percentile, and
+# time out at a multiple of the observed p99 (bounded by HTTP_TIMEOUT_SECONDS)
+BRAVE_HEDGE_ENABLED = os.environ.get('BRAVE_HEDGE_ENABLED', 'true').lower() == 'true'
+BRAVE_HEDGE_PERCENTILE = float(os.environ.get('BRAVE_HEDGE_PERCENTILE', '0.95'))
+BRAVE_TIMEOUT_MULTIPLIER = float(os.environ.get('BRAVE_TIMEOUT_MULTIPLIER', '3'))
+BRAVE_TIMEOUT_MIN_SECONDS = float(os.environ.get('BRAVE_TIMEOUT_MIN_SECONDS', '2'))
+BRAVE_LATENCY_MIN_SAMPLES = 20  # below this, no hedging and the static timeout
 
 # Gemini API Keys - Multiple keys for rotation
 GEMINI_API_KEYS_STR = os.environ.get('GEMINI_API_KEYS', '')
 GEMINI_API_KEYS = [key.strip() for key in GEMINI_API_KEYS_STR.split(',') if key.strip()]
-CURRENT_GEMINI_KEY_INDEX = 0
+GEMINI_MODEL = "gemini-3-flash-preview"
+# Optional per-key budgets for the Gemini key pool, set to the keys' quota tier to pace calls locally
+# (0 = unlimited: only Gemini's own 429s put a key on cooldown)
+GEMINI_KEY_RPM = int(os.environ.get('GEMINI_KEY_RPM', '0'))
+GEMINI_KEY_TPM = int(os.environ.get('GEMINI_KEY_TPM', '0'))
+GEMINI_KEY_COOLDOWN_SECONDS = float(os.environ.get('GEMINI_KEY_COOLDOWN_SECONDS', '30'))
+GEMINI_KEY_MAX_COOLDOWN_SECONDS = float(os.environ.get('GEMINI_KEY_MAX_COOLDOWN_SECONDS', '600'))
+GEMINI_KEY_MAX_WAIT_SECONDS = float(os.environ.get('GEMINI_KEY_MAX_WAIT_SECONDS', '5'))
+GEMINI_OUTPUT_TOKEN_ESTIMATE = int(os.environ.get('GEMINI_OUTPUT_TOKEN_ESTIMATE', '2048'))
+GEMINI_SYSTEM_MESSAGE = "Sen bir arsa ve gayrimenkul uzmanısın. Verilen bilgilere dayanarak detaylı imar durumu analizi yapıyorsun. Türkçe ve profesyonel bir dille cevap veriyorsun. Yanıtlarını markdown formatında değil, düz metin olarak ver. ** veya # gibi işaretler kullanma, sadece başlıkları büyük harfle yaz. Teknik detayları (KAK, TAKS, emsal, kat yüksekliği vb.) mutlaka belirt."
 
 SHOPIER_API_KEY = os.environ.get('SHOPIER_API_KEY')
 SHOPIER_CLIENT_SECRET = os.environ.get('SHOPIER_CLIENT_SECRET')
 SHOPIER_API_TOKEN = os.environ.get('SHOPIER_API_TOKEN')
 
+# Shopier OSB credentials
+SHOPIER_OSB_USERNAME = os.environ.get('SHOPIER_OSB_USERNAME', "778002c5c84cec73b28e5dc61252b7c7")
+SHOPIER_OSB_KEY = os.environ.get('SHOPIER_OSB_KEY', "8464992188fb72b30d314d7087bf1538")
+
+# Payment processing
+PAYMENT_SWEEP_INTERVAL_SECONDS = int(os.environ.get('PAYMENT_SWEEP_INTERVAL_SECONDS', '60'))
+PAYMENT_APPLIED_ORDERS_KEPT = 50  # recent order ids kept on the user to make credit grants idempotent
+
 # Shopier product mappings
 SHOPIER_PRODUCTS = {
     "package_20": {"url": "https://shopier.com/39003278", "product_id": "39003278"},
@@ -51,6 +230,53 @@ SHOPIER_PRODUCTS = {
     "package_100": {"url": "https://shopier.com/42901899", "product_id": "42901899"}
 }
 
+# Static package catalog served by /payment/packages
+PAYMENT_PACKAGES = [
+    {
+        "id": "package_20",
+        "name": "Standart Plan",
+        "credits": 20,
+        "price": 50.0,
+        "description": "Küçük projeler için"
+    },
+    {
+        "id": "package_50",
+        "name": "Pro Plan",
+        "credits": 50,
+        "price": 75.0,
+        "description": "Orta ölçekli projeler için",
+        "popular": True
+    },
+    {
+        "id": "package_100",
+        "name": "Uzman Plan",
+        "credits": 100,
+        "price": 100.0,
+        "description": "Büyük projeler için"
+    }
+]
+PAYMENT_PACKAGES_JSON = orjson.dumps(PAYMENT_PACKAGES)
+
+# Cache-Control per GET route (a trailing "/" matches the prefix); JSON responses on these routes also get an ETag.
+# "no-cache" lets browsers keep the body but revalidate with If-None-Match, answered by a 304.
+HTTP_CACHE_POLICIES = {
+    "/api/payment/packages": f"public, max-age={int(os.environ.get('PACKAGES_MAX_AGE_SECONDS', '86400'))}",
+    "/api/credits": "private, no-cache",
+    "/api/auth/me": "private, no-cache",
+    "/api/analyses": "private, no-cache",
+    "/api/analyses/": "private, no-cache",
+    "/api/analyses/jobs/": "private, no-cache",
+    "/api/zoning/parcels": "private, max-age=300",
+    "/api/zoning/stats": "private, max-age=300",
+}
+
+# Response compression: bodies below the threshold aren't worth the CPU or the extra headers
+COMPRESSION_MIN_SIZE = int(os.environ.get('COMPRESSION_MIN_SIZE', '500'))
+COMPRESSION_GZIP_LEVEL = int(os.environ.get('COMPRESSION_GZIP_LEVEL', '6'))
+COMPRESSION_BROTLI_QUALITY = int(os.environ.get('COMPRESSION_BROTLI_QUALITY', '5'))
+# Streamed bodies are flushed event by event and never compressed
+UNCOMPRESSED_MEDIA_TYPES = {"text/event-stream", "application/x-ndjson"}
+
 # Define Models
 class User(BaseModel):
     model_config = ConfigDict(extra="ignore")
@@ -74,6 +300,7 @@ class PropertyAnalysisRequest(BaseModel):
     mahalle: str
     ada: str
     parsel: str
+    force_refresh: bool = False
 
 class PropertyAnalysisResponse(BaseModel):
     model_config = ConfigDict(extra="ignore")
@@ -90,6 +317,291 @@ class PaymentPackage(BaseModel):
     price: float
     description: str
 
+class CircuitOpenError(Exception):
+    """Raised instead of calling an upstream whose circuit breaker is open"""
+
+class AnalysisError(Exception):
+    """Raised when the AI analysis could not be produced"""
+    pass
+
+# Mongo indexes: (collection, keys, options). TTL fields must hold real datetimes.
+# Unique indexes the credit checks depend on: /api/ready waits for these, the others only degrade
+CREDIT_INDEXES = [
+    ("users", [("user_id", 1)], {"unique": True}),
+    ("anonymous_sessions", [("ip_hash", 1)], {"unique": True}),
+]
+MONGO_INDEXES = [
+    *CREDIT_INDEXES,
+    ("user_sessions", [("session_token", 1)], {"unique": True}),
+    ("user_sessions", [("expires_at", 1)], {"expireAfterSeconds": 0}),
+    ("users", [("email", 1)], {"unique": True}),
+    ("payments", [("order_id", 1)], {"unique": True}),
+    ("payments", [("status", 1), ("created_at", 1)], {}),
+    ("rate_limits", [("expires_at", 1)], {"expireAfterSeconds": 0}),
+    ("analyses", [("user_id", 1), ("timestamp", -1), ("_id", -1)], {}),
+    ("analyses", [("analysis_id", 1)], {"unique": True, "sparse": True}),
+    ("analyses", [("parcel.il", 1), ("parcel.ilce", 1), ("parcel.mahalle", 1), ("parcel.ada", 1), ("parcel.parsel", 1)], {}),
+    # Location prefix + attribute: range filters and median sorts within an area stay in the index
+    *[("parcel_zoning", [("parcel.il", 1), ("parcel.ilce", 1), ("parcel.mahalle", 1), (f"zoning.{field}", 1)], {})
+      for field in ZONING_FIELDS],
+    # Nationwide range filters
+    *[("parcel_zoning", [(f"zoning.{field}", 1)], {}) for field in ZONING_FIELDS],
+    ("analysis_cache", [("created_at", 1)], {"expireAfterSeconds": ANALYSIS_CACHE_TTL_SECONDS}),
+    ("anonymous_analyses", [("ip_hash", 1), ("timestamp", -1)], {}),
+    ("analysis_jobs", [("job_id", 1)], {"unique": True}),
+    ("analysis_jobs", [("status", 1), ("available_at", 1)], {}),
+    ("analysis_jobs", [("status", 1), ("lease_until", 1)], {}),
+    ("analysis_jobs", [("finished_at", 1)], {"expireAfterSeconds": JOB_RETENTION_DAYS * 24 * 60 * 60}),
+]
+if ANONYMOUS_SESSION_TTL_DAYS > 0:
+    MONGO_INDEXES += [
+        ("anonymous_sessions", [("last_used", 1)], {"expireAfterSeconds": ANONYMOUS_SESSION_TTL_DAYS * 24 * 60 * 60}),
+        ("anonymous_analyses", [("timestamp", 1)], {"expireAfterSeconds": ANONYMOUS_SESSION_TTL_DAYS * 24 * 60 * 60}),
+    ]
+
+# Fields that older documents store as ISO strings but TTL indexes need as datetimes
+DATETIME_MIGRATIONS = [
+    ("user_sessions", "expires_at"),
+    ("anonymous_sessions", "last_used"),
+    ("anonymous_sessions", "created_at"),
+]
+
+async def migrate_datetime_fields(database) -> Dict[str, int]:
+    """Convert ISO string timestamps to datetimes; returns converted counts"""
+    converted = {}
+    for collection_name, field in DATETIME_MIGRATIONS:
+        collection = database[collection_name]
+        operations = []
+        count = 0
+        
+        async for doc in collection.find({field: {"$type": "string"}}, {field: 1}):
+            value = datetime.fromisoformat(doc[field])
+            if value.tzinfo is None:
+                value = value.replace(tzinfo=timezone.utc)
+            operations.append(UpdateOne({"_id": doc["_id"], field: doc[field]}, {"$set": {field: value}}))
+            
+            if len(operations) >= 1000:
+                count += (await collection.bulk_write(operations, ordered=False)).modified_count
+                operations = []
+        
+        if operations:
+            count += (await collection.bulk_write(operations, ordered=False)).modified_count
+        
+        converted[f"{collection_name}.{field}"] = count
+        if count:
+            logging.info(f"Migrated {count} {collection_name}.{field} values to datetime")
+    
+    return converted
+
+async def migrate_anonymous_analyses(database) -> int:
+    """Move legacy `analyses` arrays out of anonymous_sessions into anonymous_analyses"""
+    moved = 0
+    async for session in database.anonymous_sessions.find({"analyses": {"$exists": True}}, {"ip_hash": 1, "analyses": 1}):
+        records = []
+        for entry in session.get("analyses") or []:
+            timestamp = entry.get("timestamp")
+            if isinstance(timestamp, str):
+                timestamp = datetime.fromisoformat(timestamp)
+            if timestamp is not None and timestamp.tzinfo is None:
+                timestamp = timestamp.replace(tzinfo=timezone.utc)
+            records.append({**entry, "ip_hash": session["ip_hash"], "timestamp": timestamp})
+        
+        if records:
+            await database.anonymous_analyses.insert_many(records, ordered=False)
+        await database.anonymous_sessions.update_one({"_id": session["_id"]}, {"$unset": {"analyses": ""}})
+        moved += len(records)
+    
+    if moved:
+        logging.info(f"Moved {moved} anonymous analyses to their own collection")
+    return moved
+
+async def migrate_analysis_bodies(database) -> int:
+    """Move inline analysis texts into analysis_bodies and add the canonical parcel; returns migrated count"""
+    migrated = 0
+    operations = []
+    async for doc in database.analyses.find({"analysis": {"$exists": True}}, {"analysis": 1, "property_info": 1}):
+        digest = await store_analysis_body(doc["analysis"] or "", database)
+        update = {"$set": {"analysis_hash": digest}, "$unset": {"analysis": ""}}
+        parcel = parse_property_info(doc.get("property_info") or "")
+        if parcel:
+            update["$set"]["parcel"] = parcel
+        operations.append(UpdateOne({"_id": doc["_id"]}, update))
+        
+        if len(operations) >= 1000:
+            migrated += (await database.analyses.bulk_write(operations, ordered=False)).modified_count
+            operations = []
+    
+    if operations:
+        migrated += (await database.analyses.bulk_write(operations, ordered=False)).modified_count
+    if migrated:
+        logging.info(f"Moved {migrated} analysis texts to the content-addressed store")
+    return migrated
+
+async def migrate_zoning_attributes(database) -> int:
+    """(Re-)extract zoning attributes for analyses recorded with older or no extraction rules; returns updated count"""
+    updated = 0
+    async for doc in database.analyses.find(
+        {"zoning_version": {"$ne": ZONING_EXTRACTION_VERSION}},
+        {"analysis": 1, "analysis_hash": 1, "parcel": 1, "timestamp": 1}
+    ).sort("timestamp", 1):
+        text = doc.get("analysis")
+        if text is None and doc.get("analysis_hash"):
+            body = await database.analysis_bodies.find_one({"_id": doc["analysis_hash"]}, {"analysis": 1})
+            text = body["analysis"] if body else None
+        if text is None:
+            continue
+        
+        zoning = extract_zoning_attributes(text)
+        await database.analyses.update_one(
+            {"_id": doc["_id"]},
+            {"$set": {"zoning": zoning, "zoning_version": ZONING_EXTRACTION_VERSION}}
+        )
+        if doc.get("parcel"):
+            # Oldest first, and only rows this analysis produced (or none): newer analyses keep their values
+            key = "|".join(doc["parcel"][field] for field in PARCEL_FIELDS)
+            row = await database.parcel_zoning.find_one({"_id": key}, {"analysis_hash": 1})
+            if row is None or row.get("analysis_hash") == doc.get("analysis_hash"):
+                if any(value is not None for value in zoning.values()):
+                    await record_parcel_zoning(doc["parcel"], zoning, doc.get("analysis_hash"), database)
+                elif row is not None:
+                    await database.parcel_zoning.delete_one({"_id": key})
+        updated += 1
+    
+    if updated:
+        logging.info(f"Extracted zoning attributes for {updated} analyses")
+    return updated
+
+async def migrate_parcel_identity(database) -> int:
+    """Re-key parcels stored before ı was folded to i in the canonical identity; returns updated count"""
+    updated = 0
+    dotless = {"$or": [{f"parcel.{field}": {"$regex": "ı"}} for field in PARCEL_FIELDS]}
+    
+    async for doc in database.analyses.find(dotless, {"parcel": 1}):
+        parcel = {field: value.replace("ı", "i") for field, value in doc["parcel"].items()}
+        await database.analyses.update_one({"_id": doc["_id"]}, {"$set": {"parcel": parcel}})
+        updated += 1
+    
+    # parcel_zoning is keyed by the identity: move each row to its new key, newest wins
+    async for doc in database.parcel_zoning.find(dotless):
+        parcel = {field: value.replace("ı", "i") for field, value in doc["parcel"].items()}
+        key = "|".join(parcel[field] for field in PARCEL_FIELDS)
+        existing = await database.parcel_zoning.find_one({"_id": key}, {"updated_at": 1})
+        if existing is None or existing["updated_at"] < doc["updated_at"]:
+            await database.parcel_zoning.replace_one({"_id": key}, {**doc, "_id": key, "parcel": parcel}, upsert=True)
+        await database.parcel_zoning.delete_one({"_id": doc["_id"]})
+        updated += 1
+    
+    if updated:
+        logging.info(f"Re-keyed {updated} parcels to the dotless-i folded identity")
+    return updated
+
+async def ensure_indexes(database, indexes: List[tuple] = MONGO_INDEXES) -> List[dict]:
+    """Idempotently create the indexes (all of MONGO_INDEXES by default), updating TTLs of existing indexes in place"""
+    results = []
+    for collection_name, keys, options in indexes:
+        collection = database[collection_name]
+        entry = {"collection": collection_name, "keys": keys}
+        
+        try:
+            existing = await collection.index_information()
+            current = next((info for info in existing.items() if info[1]["key"] == keys), None)
+            
+            if current is None:
+                entry["name"] = await collection.create_index(keys, **options)
+                entry["status"] = "created"
+            elif "expireAfterSeconds" in options and current[1].get("expireAfterSeconds") != options["expireAfterSeconds"]:
+                await database.command(
+                    "collMod", collection_name,
+                    index={"name": current[0], "expireAfterSeconds": options["expireAfterSeconds"]}
+                )
+                entry["name"] = current[0]
+                entry["status"] = "ttl_updated"
+            else:
+                entry["name"] = current[0]
+                entry["status"] = "exists"
+        
+        except OperationFailure as e:
+            # E.g. duplicate values blocking a unique index; keep going with the others
+            logging.error(f"❌ Index {collection_name} {keys} failed: {str(e)}")
+            entry["status"] = "failed"
+            entry["error"] = str(e)
+        
+        results.append(entry)
+    
+    return results
+
+async def index_usage_report(database) -> List[dict]:
+    """Per-index usage counters from $indexStats"""
+    report = []
+    for collection_name in sorted({spec[0] for spec in MONGO_INDEXES}):
+        async for stats in database[collection_name].aggregate([{"$indexStats": {}}]):
+            report.append({
+                "collection": collection_name,
+                "index": stats["name"],
+                "ops": stats["accesses"]["ops"],
+                "since": stats["accesses"]["since"].isoformat()
+            })
+    return report
+
+async def dedupe_anonymous_sessions(database) -> int:
+    """Merge duplicate ip_hash sessions (left by the old find-then-insert) so the unique index can be built"""
+    removed = 0
+    async for group in database.anonymous_sessions.aggregate([
+        {"$group": {
+            "_id": "$ip_hash",
+            "ids": {"$push": "$_id"},
+            "credits_used": {"$sum": {"$ifNull": ["$credits_used", 0]}},
+            "count": {"$sum": 1}
+        }},
+        {"$match": {"count": {"$gt": 1}}}
+    ], allowDiskUse=True):
+        keep, *duplicates = group["ids"]
+        await database.anonymous_sessions.update_one(
+            {"_id": keep},
+            {"$set": {"credits_used": min(group["credits_used"], ANONYMOUS_CREDIT_LIMIT)}}
+        )
+        removed += (await database.anonymous_sessions.delete_many({"_id": {"$in": duplicates}})).deleted_count
+    
+    if removed:
+        logging.info(f"Removed {removed} duplicate anonymous sessions")
+    return removed
+
+async def build_indexes(database, indexes: List[tuple]) -> List[str]:
+    """ensure_indexes with logging; returns the indexes that could not be built"""
+    failed = []
+    for entry in await ensure_indexes(database, indexes):
+        if entry["status"] != "exists":
+            logging.info(f"Index {entry['collection']}.{entry.get('name', entry['keys'])}: {entry['status']}")
+        if entry["status"] == "failed":
+            failed.append(f"{entry['collection']} {entry['keys']}")
+    return failed
+
+async def prepare_credit_indexes(database):
+    """Dedupe anonymous sessions, then build CREDIT_INDEXES; raises while one is missing (readiness waits for them)"""
+    await dedupe_anonymous_sessions(database)
+    failed = await build_indexes(database, CREDIT_INDEXES)
+    if failed:
+        raise RuntimeError(f"credit indexes missing: {', '.join(failed)}")
+
+async def prepare_secondary_indexes(database, status: Dict[str, str]):
+    """Build the remaining indexes; failures (e.g. duplicates blocking a unique index) are reported as degraded"""
+    status["secondary_indexes"] = "building"
+    failed = await build_indexes(database, [index for index in MONGO_INDEXES if index not in CREDIT_INDEXES])
+    if failed:
+        logging.warning(f"⚠ Indexes not built, serving without them: {', '.join(failed)}")
+    status["secondary_indexes"] = "degraded" if failed else "ready"
+
+async def bootstrap_database(database):
+    """Run the data migrations (indexes are built separately at startup)"""
+    try:
+        await migrate_datetime_fields(database)
+        await migrate_anonymous_analyses(database)
+        await migrate_analysis_bodies(database)
+        await migrate_parcel_identity(database)
+        await migrate_zoning_attributes(database)
+    except Exception as e:
+        logging.error(f"❌ Database bootstrap failed: {str(e)}")
+
 # Helper Functions
 def get_client_ip(request: Request) -> str:
     """Get client IP address"""
@@ -111,122 +623,363 @@ async def get_current_user(request: Request, session_token: Optional[str] = Cook
     if not token:
         return None
     
-    session_doc = await db.user_sessions.find_one({"session_token": token}, {"_id": 0})
-    if not session_doc:
-        return None
+    return await resolve_session_user(token)
+
+def invalidate_session_cache(session_token: str):
+    """Drop a cached session (e.g. on logout)"""
+    session_cache.pop(session_token, None)
+
+def invalidate_user_cache(user_id: str):
+    """Drop a cached user document (e.g. after a credit change)"""
+    user_cache.pop(user_id, None)
+
+async def resolve_session_user(token: str) -> Optional[dict]:
+    """Resolve a session token to its user, from cache or with a single $lookup query"""
+    session = session_cache.get(token)
+    user_doc = user_cache.get(session["user_id"]) if session else None
     
-    expires_at = session_doc["expires_at"]
-    if isinstance(expires_at, str):
-        expires_at = datetime.fromisoformat(expires_at)
-    if expires_at.tzinfo is None:
-        expires_at = expires_at.replace(tzinfo=timezone.utc)
+    if not session or not user_doc:
+        docs = await db.user_sessions.aggregate([
+            {"$match": {"session_token": token}},
+            {"$limit": 1},
+            {"$lookup": {
+                "from": "users",
+                "localField": "user_id",
+                "foreignField": "user_id",
+                "as": "user"
+            }},
+            {"$project": {"_id": 0, "user_id": 1, "expires_at": 1, "user": {"$arrayElemAt": ["$user", 0]}}},
+            {"$project": {"user._id": 0, "user.applied_orders": 0}}
+        ]).to_list(1)
+        if not docs:
+            return None
+        
+        expires_at = docs[0]["expires_at"]
+        if isinstance(expires_at, str):
+            expires_at = datetime.fromisoformat(expires_at)
+        if expires_at.tzinfo is None:
+            expires_at = expires_at.replace(tzinfo=timezone.utc)
+        
+        session = {"user_id": docs[0]["user_id"], "expires_at": expires_at}
+        user_doc = docs[0].get("user")
+        session_cache[token] = session
+        if user_doc:
+            user_cache[session["user_id"]] = user_doc
     
-    if expires_at < datetime.now(timezone.utc):
+    if session["expires_at"] < datetime.now(timezone.utc):
+        invalidate_session_cache(token)
         return None
     
-    user_doc = await db.users.find_one({"user_id": session_doc["user_id"]}, {"_id": 0})
-    return user_doc
-
-async def get_or_create_anonymous_session(ip: str) -> dict:
-    """Get or create anonymous session based on IP"""
-    ip_hash = hashlib.sha256(ip.encode()).hexdigest()
-    session = await db.anonymous_sessions.find_one({"ip_hash": ip_hash}, {"_id": 0})
-    
-    if not session:
-        session = {
-            "ip_hash": ip_hash,
-            "credits_used": 0,
-            "analyses": [],
-            "created_at": datetime.now(timezone.utc).isoformat(),
-            "last_used": datetime.now(timezone.utc).isoformat()
-        }
-        await db.anonymous_sessions.insert_one(session.copy())
+    # Callers may modify the returned document
+    return dict(user_doc) if user_doc else None
+
+def hash_ip(ip: str) -> str:
+    return hashlib.sha256(ip.encode()).hexdigest()
+
+async def get_anonymous_session(ip: str) -> dict:
+    """Get the anonymous session for an IP without creating it (sessions are upserted on first use)"""
+    ip_hash = hash_ip(ip)
+    session = await db.anonymous_sessions.find_one({"ip_hash": ip_hash}, {"_id": 0, "ip_hash": 1, "credits_used": 1})
+    return session or {"ip_hash": ip_hash, "credits_used": 0}
+
+def create_http_client() -> httpx.AsyncClient:
+    """Create the pooled HTTP/2 client shared by all upstream calls"""
+    return httpx.AsyncClient(
+        http2=True,
+        timeout=httpx.Timeout(HTTP_TIMEOUT_SECONDS),
+        limits=httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS
+        )
+    )
+
+CIRCUIT_STATES = ["closed", "open", "half_open"]
+
+class CircuitBreaker:
+    """Closed/open/half-open circuit breaker for one upstream.
+
+    Opens after CIRCUIT_FAILURE_THRESHOLD consecutive failures and fails fast
+    for CIRCUIT_RECOVERY_SECONDS, then lets a single probe call through; the
+    probe's outcome closes or re-opens the circuit.
+    """
+
+    def __init__(self, name: str, clock: Callable[[], float] = time.monotonic):
+        self.name = name
+        self.clock = clock
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        CIRCUIT_STATE.labels(name).set(0)
+
+    def _set_state(self, state: str):
+        if state != self.state:
+            log = logging.info if state == "closed" else logging.warning
+            log(f"⚡ {self.name} circuit {self.state} → {state}")
+        self.state = state
+        CIRCUIT_STATE.labels(self.name).set(CIRCUIT_STATES.index(state))
+
+    def allow(self) -> bool:
+        """Whether a call may go to the upstream now"""
+        if self.state == "open":
+            if self.clock() - self.opened_at < CIRCUIT_RECOVERY_SECONDS:
+                return False
+            self._set_state("half_open")
+        
+        if self.state == "half_open":
+            if self.probing:
+                return False
+            self.probing = True
+        return True
+
+    def check(self):
+        if not self.allow():
+            raise CircuitOpenError(f"{self.name} circuit is open")
+
+    def record(self, failed: Optional[bool]):
+        """Record a call outcome; None means it says nothing about upstream health (e.g. cancelled)"""
+        self.probing = False
+        if failed is None:
+            return
+        
+        if not failed:
+            self.failures = 0
+            self._set_state("closed")
+            return
+        
+        self.failures += 1
+        if self.state == "half_open" or self.failures >= CIRCUIT_FAILURE_THRESHOLD:
+            self.opened_at = self.clock()
+            self._set_state("open")
+
+class LatencyTracker:
+    """Rolling window of recent upstream latencies"""
+
+    def __init__(self, size: int = 200):
+        self.samples = deque(maxlen=size)
+
+    def observe(self, seconds: float):
+        self.samples.append(seconds)
+
+    def percentile(self, q: float) -> Optional[float]:
+        """Latency at quantile q, or None until enough samples were observed"""
+        if len(self.samples) < BRAVE_LATENCY_MIN_SAMPLES:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+brave_breaker = CircuitBreaker("brave")
+brave_latency = LatencyTracker()
+
+def brave_timeout() -> float:
+    """Adaptive Brave timeout from the observed p99 latency"""
+    p99 = brave_latency.percentile(0.99)
+    if p99 is None:
+        return HTTP_TIMEOUT_SECONDS
+    return min(HTTP_TIMEOUT_SECONDS, max(BRAVE_TIMEOUT_MIN_SECONDS, p99 * BRAVE_TIMEOUT_MULTIPLIER))
+
+def is_upstream_failure(error: Exception) -> bool:
+    """Timeouts, connection errors, 5xx and 429 count against the circuit; other 4xx don't"""
+    if isinstance(error, httpx.HTTPStatusError):
+        status = error.response.status_code
+        return status >= 500 or status == 429
+    return True
+
+async def brave_request(params: dict) -> List[dict]:
+    """A single Brave API call through the circuit breaker, with an adaptive timeout"""
+    brave_breaker.check()
+    headers = {
+        "X-Subscription-Token": BRAVE_API_KEY,
+        "Accept": "application/json",
+        "Accept-Encoding": "gzip"
+    }
+    # The half-open probe gets the full timeout: Brave may have settled above the adaptive one
+    timeout = HTTP_TIMEOUT_SECONDS if brave_breaker.state == "half_open" else brave_timeout()
+    started = time.monotonic()
+    try:
+        response = await http_client.get(BRAVE_SEARCH_URL, headers=headers, params=params, timeout=timeout)
+        response.raise_for_status()
+        data = response.json()
+    except asyncio.CancelledError:
+        brave_breaker.record(None)
+        raise
+    except httpx.TimeoutException:
+        # A timed-out call took at least this long; without the sample the timeout could only shrink
+        brave_latency.observe(timeout)
+        brave_breaker.record(True)
+        raise
+    except Exception as e:
+        brave_breaker.record(is_upstream_failure(e))
+        raise
     
-    return session
+    brave_breaker.record(False)
+    brave_latency.observe(time.monotonic() - started)
+    return data.get('web', {}).get('results', [])
 
-async def search_brave(query: str) -> str:
-    """Search using Brave Search API with multiple strategies"""
+async def hedged_brave_request(params: dict) -> List[dict]:
+    """Brave call that sends a second identical request if the first is slower than usual.
+
+    The hedge fires once the first request exceeds the BRAVE_HEDGE_PERCENTILE
+    latency; the first successful response wins and the other is cancelled.
+    """
+    hedge_after = brave_latency.percentile(BRAVE_HEDGE_PERCENTILE) if BRAVE_HEDGE_ENABLED else None
+    if hedge_after is None:
+        return await brave_request(params)
+    
+    tasks = [asyncio.ensure_future(brave_request(params))]
     try:
-        headers = {
-            "X-Subscription-Token": BRAVE_API_KEY,
-            "Accept": "application/json",
-            "Accept-Encoding": "gzip"
-        }
-        
-        all_results = []
+        done, _ = await asyncio.wait(tasks, timeout=hedge_after)
+        # No hedging while the circuit is probing or open
+        if not done and brave_breaker.state == "closed":
+            BRAVE_HEDGES.labels("sent").inc()
+            tasks.append(asyncio.ensure_future(brave_request(params)))
         
-        # Strategy 1: Direct query with technical terms
-        params1 = {
-            "q": query,
+        pending = set(tasks)
+        last_error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is not tasks[0]:
+                        BRAVE_HEDGES.labels("won").inc()
+                    return task.result()
+                last_error = task.exception()
+        raise last_error
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+            elif not task.cancelled():
+                task.exception()  # mark as retrieved
+
+def brave_cache_key(params: dict) -> str:
+    """Cache key for a Brave query (query text is case and whitespace insensitive)"""
+    normalized = dict(params, q=" ".join(params["q"].split()).casefold())
+    return json.dumps(normalized, sort_keys=True, ensure_ascii=False)
+
+async def fetch_brave_results(params: dict, strategy: str = "1", hedge: bool = False) -> List[dict]:
+    """Run a single Brave Search query and return the raw web results"""
+    cache_key = brave_cache_key(params)
+    cached = brave_results_cache.get(cache_key)
+    if cached is not None:
+        BRAVE_QUERIES.labels(strategy, "cache").inc()
+        BRAVE_STRATEGY_RESULTS.labels(strategy).inc(len(cached))
+        return cached
+    
+    BRAVE_QUERIES.labels(strategy, "api").inc()
+    results = await (hedged_brave_request(params) if hedge else brave_request(params))
+    BRAVE_STRATEGY_RESULTS.labels(strategy).inc(len(results))
+    
+    brave_results_cache[cache_key] = results
+    return results
+
+async def search_brave(query: str) -> List[dict]:
+    """Search using Brave Search API with multiple strategies; returns raw web results"""
+    # Strategy 1: Direct query with technical terms
+    params1 = {
+        "q": query,
+        "count": 10,
+        "search_lang": "tr",
+        "country": "tr"
+    }
+    # Only the required strategy is worth paying for a hedge
+    strategies = [fetch_brave_results(params1, strategy="1", hedge=True)]
+    
+    # Strategy 2: Search for belediye imar durum (municipality zoning)
+    query_parts = query.split()
+    if len(query_parts) >= 5:  # il ilce mahalle ada parsel
+        il, ilce, mahalle = query_parts[0], query_parts[1], query_parts[2]
+        params2 = {
+            "q": f"{il} {ilce} belediyesi imar durumu {mahalle}",
             "count": 10,
             "search_lang": "tr",
             "country": "tr"
         }
-        
-        response1 = requests.get(BRAVE_SEARCH_URL, headers=headers, params=params1, timeout=10)
-        response1.raise_for_status()
-        data1 = response1.json()
-        
-        if 'web' in data1 and 'results' in data1['web']:
-            all_results.extend(data1['web']['results'][:5])
-        
-        # Strategy 2: Search for belediye imar durum (municipality zoning)
-        query_parts = query.split()
-        if len(query_parts) >= 5:  # il ilce mahalle ada parsel
-            il, ilce, mahalle = query_parts[0], query_parts[1], query_parts[2]
-            params2 = {
-                "q": f"{il} {ilce} belediyesi imar durumu {mahalle}",
-                "count": 10,
-                "search_lang": "tr",
-                "country": "tr"
-            }
-            
-            response2 = requests.get(BRAVE_SEARCH_URL, headers=headers, params=params2, timeout=10)
-            if response2.status_code == 200:
-                data2 = response2.json()
-                if 'web' in data2 and 'results' in data2['web']:
-                    all_results.extend(data2['web']['results'][:5])
-        
-        # Format results
-        results_text = []
-        seen_urls = set()
-        
-        for result in all_results:
-            url = result.get('url', '')
-            if url not in seen_urls:
-                seen_urls.add(url)
-                title = result.get('title', '')
-                description = result.get('description', '')
-                results_text.append(f"Başlık: {title}\nAçıklama: {description}\nURL: {url}\n")
-        
-        return "\n\n".join(results_text[:10]) if results_text else "Arama sonucu bulunamadı. Farklı bir bölge veya ada-parsel numarası deneyebilirsiniz."
+        strategies.append(fetch_brave_results(params2, strategy="2"))
     
-    except Exception as e:
-        logging.error(f"Brave Search error: {str(e)}")
-        return f"Arama hatası: {str(e)}"
+    # Both strategies run concurrently on the shared connection pool
+    responses = await asyncio.gather(*strategies, return_exceptions=True)
+    
+    # Strategy 1 is required, strategy 2 is best-effort
+    if isinstance(responses[0], Exception):
+        raise responses[0]
+    
+    all_results = list(responses[0])
+    if len(responses) > 1:
+        if isinstance(responses[1], Exception):
+            logging.warning(f"Brave Search strategy 2 failed: {str(responses[1])}")
+        else:
+            all_results.extend(responses[1])
+    
+    return all_results
 
-async def analyze_with_gemini(property_info: str, search_results: str) -> str:
-    """Analyze property using Gemini AI with automatic API key rotation"""
-    global CURRENT_GEMINI_KEY_INDEX
+def _snippet_words(text: str) -> set:
+    return set(re.findall(r"\w+", text.casefold()))
+
+def score_snippet(words: set, text: str, request_data: PropertyAnalysisRequest, rank: int) -> float:
+    """Relevance of a search snippet to the parcel and the zoning terms we ask Gemini about"""
+    score = 0.0
     
-    if not GEMINI_API_KEYS:
-        return "Gemini API anahtarları yapılandırılmamış."
+    # Exact ada/parsel numbers are the strongest signal
+    for number in (request_data.ada, request_data.parsel):
+        if re.search(rf"(?<!\d){re.escape(number.strip())}(?!\d)", text):
+            score += 5
+    if "ada" in words and "parsel" in words:
+        score += 2
     
-    # Try all API keys
-    for attempt in range(len(GEMINI_API_KEYS)):
-        try:
-            current_key = GEMINI_API_KEYS[CURRENT_GEMINI_KEY_INDEX]
-            
-            logging.info(f"Using Gemini API key #{CURRENT_GEMINI_KEY_INDEX + 1} (Key: ...{current_key[-8:]})")
-            
-            chat = LlmChat(
-                api_key=current_key,
-                session_id="property-analysis",
-                system_message="Sen bir arsa ve gayrimenkul uzmanısın. Verilen bilgilere dayanarak detaylı imar durumu analizi yapıyorsun. Türkçe ve profesyonel bir dille cevap veriyorsun. Yanıtlarını markdown formatında değil, düz metin olarak ver. ** veya # gibi işaretler kullanma, sadece başlıkları büyük harfle yaz. Teknik detayları (KAK, TAKS, emsal, kat yüksekliği vb.) mutlaka belirt."
-            ).with_model("gemini", "gemini-3-flash-preview")
-            
-            user_message = UserMessage(
-                text=f"""Aşağıdaki arsa için DETAYLI imar durumu analizi yap:
+    score += 2 * sum(1 for term in ZONING_TERMS if term in words)
+    score += sum(1 for place in (request_data.mahalle, request_data.ilce) if _snippet_words(place) <= words)
+    
+    # Keep Brave's own ordering as a tie-breaker
+    return score + 1 / (1 + rank)
+
+def build_search_context(results: List[dict], request_data: PropertyAnalysisRequest, token_budget: int = GEMINI_CONTEXT_TOKEN_BUDGET) -> str:
+    """Deduplicate, rank and pack search results into the prompt token budget"""
+    candidates = []
+    seen_urls = set()
+    
+    for rank, result in enumerate(results):
+        url = result.get('url', '')
+        if url in seen_urls:
+            continue
+        seen_urls.add(url)
+        
+        title = result.get('title', '')
+        description = result.get('description', '')
+        words = _snippet_words(f"{title} {description}")
+        
+        # Drop near-duplicates (same snippet syndicated on several sites)
+        if any(len(words & other) / max(len(words | other), 1) >= SNIPPET_DUPLICATE_THRESHOLD for other, _, _ in candidates):
+            continue
+        
+        entry = f"Başlık: {title}\nAçıklama: {description}\nURL: {url}\n"
+        candidates.append((words, score_snippet(words, entry, request_data, rank), entry))
+    
+    packed = []
+    remaining = token_budget
+    for _, _, entry in sorted(candidates, key=lambda candidate: candidate[1], reverse=True):
+        cost = estimate_tokens(entry)
+        if cost <= remaining:
+            packed.append(entry)
+            remaining -= cost
+    
+    return "\n\n".join(packed) if packed else BRAVE_NO_RESULTS_TEXT
+
+class PromptTemplate:
+    """str.format-style template parsed once, rendered by concatenation"""
+
+    def __init__(self, template: str):
+        self._parts = [(literal, field) for literal, field, _, _ in string.Formatter().parse(template)]
+
+    def render(self, **values: str) -> str:
+        rendered = []
+        for literal, field in self._parts:
+            rendered.append(literal)
+            if field is not None:
+                rendered.append(values[field])
+        return "".join(rendered)
+
+ANALYSIS_PROMPT = PromptTemplate("""Aşağıdaki arsa için DETAYLI imar durumu analizi yap:
 
 Arsa Bilgileri:
 {property_info}
@@ -266,61 +1019,634 @@ Arsa Bilgileri:
 ÖNEMLİ NOTLAR:
 - Eğer KAK, TAKS gibi teknik bilgileri bulamazsan, "Bu bilgiler internette bulunamadı, kesin bilgi için ilgili belediyenin İmar ve Şehircilik Müdürlüğü'ne başvurulmalıdır" şeklinde belirt.
 - Yanıtını düz metin olarak ver. Markdown formatı kullanma (**, ##, ### gibi). Başlıkları sadece büyük harfle yaz.
-- Temiz ve okunakli bir format kullan."""
-            )
+- Temiz ve okunakli bir format kullan.""")
+
+def clean_markdown(text: str) -> str:
+    """Strip markdown emphasis/heading markers Gemini sometimes emits"""
+    return text.replace('**', '').replace('##', '').replace('###', '')
+
+# Zoning attributes parsed out of the analysis text. The number must follow its label on the
+# same line with no other attribute's label in between ("KAK ve TAKS 0.40" names neither), and
+# a range ("0.40 ile 1.20") or a plan scale ("1/1000") is not a value; "1,50" and "%30" are accepted.
+ZONING_LABELS = {
+    "kak": r"\bkak\b",
+    "taks": r"\btaks\b",
+    "emsal": r"\bemsal\b",
+    "max_floors": r"kat (?:sayısı|adedi)",
+    "height_m": r"(?:(?:yapı|bina) yüksekliği|\bh\s?max\b)",
+}
+# KAK and emsal are the same ratio ("Emsal (KAK): 1.50")
+ZONING_SYNONYMS = {"kak": "emsal", "emsal": "kak"}
+
+def zoning_pattern(field: str) -> re.Pattern:
+    others = "|".join(
+        label for other, label in ZONING_LABELS.items() if other not in (field, ZONING_SYNONYMS.get(field))
+    )
+    return re.compile(
+        ZONING_LABELS[field]
+        + rf"(?:(?!{others})[^\d\n%]|\b1\s*/\s*\d+(?!\d)){{0,40}}?(%\s*)?(\d+(?:[.,]\d+)?)(?!\d|[.,]\d|\s*/)"
+        + r"(?!\s*(?:-|–|ile)\s*%?\s*\d)"
+    )
+
+# Bumped when the extraction rules change; migrate_zoning_attributes re-extracts older analyses
+ZONING_EXTRACTION_VERSION = 2
+
+# (field, pattern, type, plausible range)
+ZONING_ATTRIBUTES = [
+    ("kak", zoning_pattern("kak"), float, (0.01, 20)),
+    ("taks", zoning_pattern("taks"), float, (0.01, 1)),
+    ("emsal", zoning_pattern("emsal"), float, (0.01, 20)),
+    ("max_floors", zoning_pattern("max_floors"), int, (1, 100)),
+    ("height_m", zoning_pattern("height_m"), float, (1, 300)),
+]
+
+def extract_zoning_attributes(text: str) -> Dict[str, Optional[float]]:
+    """Typed KAK/TAKS/emsal/floor/height values from an analysis (None where not stated)"""
+    text = unicodedata.normalize("NFC", text).translate(TURKISH_LOWER).lower()
+    attributes = {}
+    for field, pattern, kind, (low, high) in ZONING_ATTRIBUTES:
+        value = None
+        for match in pattern.finditer(text):
+            number = float(match.group(2).replace(",", "."))
+            if match.group(1) and number > 1:
+                number /= 100  # "TAKS: %30"
+            if low <= number <= high:
+                value = kind(number)
+                break
+        attributes[field] = value
+    return attributes
+
+class MarkdownStreamCleaner:
+    """Incremental clean_markdown for streamed text.
+
+    A trailing run of '*'/'#' is held back until the next chunk so markers
+    split across chunk boundaries are removed like in the non-streamed path.
+    """
+
+    def __init__(self):
+        self._pending = ""
+
+    def feed(self, chunk: str) -> str:
+        text = self._pending + chunk
+        cut = len(text.rstrip('*#'))
+        self._pending = text[cut:]
+        return clean_markdown(text[:cut])
+
+    def flush(self) -> str:
+        text, self._pending = self._pending, ""
+        return clean_markdown(text)
+
+class TokenBucket:
+    """Token bucket refilled continuously at `per_minute` tokens per minute (0 = unlimited)"""
+
+    def __init__(self, per_minute: float):
+        self.unlimited = per_minute <= 0
+        self.capacity = per_minute
+        self.tokens = per_minute
+        self.rate = per_minute / 60.0
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until `amount` tokens are available (0 if available now)"""
+        if self.unlimited:
+            return 0.0
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def consume(self, amount: float, now: float):
+        if self.unlimited:
+            return
+        self._refill(now)
+        self.tokens -= min(amount, self.capacity)
+
+class GeminiKeyState:
+    """Health and budget of a single Gemini API key"""
+
+    def __init__(self, index: int, key: str):
+        self.index = index
+        self.key = key
+        self.requests = TokenBucket(GEMINI_KEY_RPM)
+        self.tokens = TokenBucket(GEMINI_KEY_TPM)
+        self.in_flight = 0
+        self.cooldown_until = 0.0
+        self.quota_errors = 0  # consecutive, drives the backoff
+        self.error_rate = 0.0  # exponentially weighted
+        self.successes = 0
+        self.failures = 0
+        self._client = None
+
+    @property
+    def client(self) -> "genai.Client":
+        """Long-lived client for this key; its connection pool stays warm across requests.
+
+        Calls carry no conversation state, so one client safely serves
+        concurrent analyses.
+        """
+        if self._client is None:
+            self._client = load_genai().Client(api_key=self.key)
+        return self._client
+
+    async def aclose(self):
+        if self._client is not None:
+            client, self._client = self._client, None
+            await client.aio.aclose()
+
+    @property
+    def label(self) -> str:
+        return f"#{self.index + 1} (Key: ...{self.key[-8:]})"
+
+    def wait_time(self, estimated_tokens: int, now: float) -> float:
+        cooldown = max(0.0, self.cooldown_until - now)
+        return max(cooldown, self.requests.wait_time(1, now), self.tokens.wait_time(estimated_tokens, now))
+
+class GeminiKeyPool:
+    """Leases Gemini API keys to concurrent requests.
+
+    Each call leases the least-loaded healthy key that has RPM/TPM budget
+    left. Quota errors put a key on an exponentially growing cooldown
+    instead of moving every request to the next key.
+    """
+
+    def __init__(self, keys: List[str]):
+        self.keys = [GeminiKeyState(index, key) for index, key in enumerate(keys)]
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def _try_acquire(self, estimated_tokens: int, exclude: set) -> Optional[GeminiKeyState]:
+        now = time.monotonic()
+        ready = [state for state in self.keys
+                 if state.index not in exclude and state.wait_time(estimated_tokens, now) == 0]
+        if not ready:
+            return None
+        
+        state = min(ready, key=lambda s: (s.in_flight, s.error_rate, s.index))
+        state.requests.consume(1, now)
+        state.tokens.consume(estimated_tokens, now)
+        state.in_flight += 1
+        return state
+
+    def cooling_down(self, exclude: set) -> bool:
+        """Every remaining key is on a quota cooldown (as opposed to out of local RPM/TPM budget)"""
+        now = time.monotonic()
+        return all(state.cooldown_until > now for state in self.keys if state.index not in exclude)
+
+    async def lease(self, estimated_tokens: int, exclude: set) -> Optional[GeminiKeyState]:
+        """Lease a key, waiting up to GEMINI_KEY_MAX_WAIT_SECONDS for budget; None if none is usable"""
+        deadline = time.monotonic() + GEMINI_KEY_MAX_WAIT_SECONDS
+        while True:
+            state = self._try_acquire(estimated_tokens, exclude)
+            if state:
+                return state
+            
+            now = time.monotonic()
+            candidates = [s.wait_time(estimated_tokens, now) for s in self.keys if s.index not in exclude]
+            if not candidates or now + min(candidates) > deadline:
+                return None
+            await asyncio.sleep(min(candidates))
+
+    def release(self, state: GeminiKeyState, outcome: str):
+        """Return a leased key; outcome is 'success', 'quota', 'error' or 'cancelled'"""
+        state.in_flight -= 1
+        GEMINI_KEY_OUTCOMES.labels(str(state.index + 1), outcome).inc()
+        if outcome == "cancelled":
+            return
+        
+        failed = outcome != "success"
+        state.error_rate = state.error_rate * 0.8 + (0.2 if failed else 0.0)
+        
+        if outcome == "success":
+            state.successes += 1
+            state.quota_errors = 0
+        elif outcome == "quota":
+            state.failures += 1
+            state.quota_errors += 1
+            cooldown = min(GEMINI_KEY_COOLDOWN_SECONDS * 2 ** (state.quota_errors - 1), GEMINI_KEY_MAX_COOLDOWN_SECONDS)
+            state.cooldown_until = time.monotonic() + cooldown
+            logging.warning(f"⚠ Gemini API key {state.label} quota exceeded. Cooling down for {cooldown:.0f}s")
+        else:
+            state.failures += 1
+
+    async def aclose(self):
+        """Close every key's client (on shutdown)"""
+        for state in self.keys:
+            try:
+                await state.aclose()
+            except Exception as e:
+                logging.warning(f"Closing Gemini client {state.label} failed: {str(e)}")
+
+gemini_key_pool = GeminiKeyPool(GEMINI_API_KEYS)
+
+# google-genai takes a while to import (it builds its pydantic models on import): warm_imports
+# loads it in a thread at startup, otherwise the first Gemini call does
+genai = None
+gemini_generate_config_cache = None
+
+def load_genai():
+    global genai
+    if genai is None:
+        from google import genai as genai_module
+        genai = genai_module
+    return genai
+
+def gemini_generate_config():
+    """Shared by every call: the system prompt is sent per request, no chat session is kept"""
+    global gemini_generate_config_cache
+    if gemini_generate_config_cache is None:
+        from google.genai import types as genai_types
+        gemini_generate_config_cache = genai_types.GenerateContentConfig(system_instruction=GEMINI_SYSTEM_MESSAGE)
+    return gemini_generate_config_cache
+
+def estimate_tokens(text: str) -> int:
+    """Rough token estimate (~4 characters per token)"""
+    return len(text) // 4 + 1
+
+def is_quota_error(error: Exception) -> bool:
+    """Check if it's a quota/rate limit error"""
+    error_str = str(error).lower()
+    return any(keyword in error_str for keyword in ['quota', 'rate limit', 'resource exhausted', '429', 'quota exceeded'])
+
+gemini_breaker = CircuitBreaker("gemini")
+
+def gemini_outcome_failed(outcome: str) -> Optional[bool]:
+    """Circuit breaker view of a key outcome: quota errors are per key, not an upstream failure"""
+    return {"success": False, "error": True}.get(outcome)
+
+def gemini_failure(last_error: Optional[Exception], quota_only: bool, circuit_open: bool = False,
+                   budget_exhausted: bool = False) -> AnalysisError:
+    """Build the user-facing error once no key could produce an analysis"""
+    if circuit_open and last_error is None:
+        return AnalysisError("Yapay zeka servisi geçici olarak kullanılamıyor. Lütfen biraz sonra tekrar deneyin.")
+    if budget_exhausted and last_error is None:
+        logging.warning("⚠ Gemini key pool out of local budget (GEMINI_KEY_RPM/GEMINI_KEY_TPM)")
+        return AnalysisError("Yapay zeka servisi şu anda çok yoğun. Lütfen biraz sonra tekrar deneyin.")
+    if last_error is None or quota_only:
+        logging.error("❌ All Gemini API keys exhausted!")
+        return AnalysisError("Tüm Gemini API anahtarlarının kotası doldu. Lütfen daha sonra tekrar deneyin.")
+    return AnalysisError(f"Analiz hatası: {str(last_error)}")
+
+def prompt_token_count(response) -> Optional[int]:
+    """Prompt tokens Gemini counted for a response or stream chunk (None without usage metadata)"""
+    return getattr(getattr(response, "usage_metadata", None), "prompt_token_count", None)
+
+async def analyze_with_gemini(prompt: str) -> tuple:
+    """Analyze property using Gemini AI with keys leased from the key pool.
+
+    Returns the cleaned analysis and the prompt tokens Gemini reported.
+    """
+    if not GEMINI_API_KEYS:
+        raise AnalysisError("Gemini API anahtarları yapılandırılmamış.")
+    
+    estimated_tokens = estimate_tokens(prompt) + GEMINI_OUTPUT_TOKEN_ESTIMATE
+    tried = set()
+    last_error = None
+    quota_only = True
+    circuit_open = False
+    budget_exhausted = False
+    
+    # Try each healthy key at most once, unless the upstream circuit opens meanwhile
+    for _ in range(len(gemini_key_pool)):
+        if not gemini_breaker.allow():
+            circuit_open = True
+            break
+        key_state = await gemini_key_pool.lease(estimated_tokens, exclude=tried)
+        if key_state is None:
+            gemini_breaker.record(None)
+            budget_exhausted = not gemini_key_pool.cooling_down(tried)
+            break
+        tried.add(key_state.index)
+        outcome = "cancelled"
+        
+        try:
+            logging.info(f"Using Gemini API key {key_state.label}")
             
-            response = await chat.send_message(user_message)
+            response = await key_state.client.aio.models.generate_content(
+                model=GEMINI_MODEL,
+                contents=prompt,
+                config=gemini_generate_config()
+            )
+            if not response.text:
+                raise Exception("Gemini returned an empty response")
+            outcome = "success"
             
+            logging.info(f"✓ Gemini API key {key_state.label} successful")
             # Clean up any remaining markdown symbols
-            cleaned_response = response.replace('**', '').replace('##', '').replace('###', '')
-            
-            logging.info(f"✓ Gemini API key #{CURRENT_GEMINI_KEY_INDEX + 1} successful")
-            return cleaned_response
+            return clean_markdown(response.text), prompt_token_count(response)
         
         except Exception as e:
-            error_str = str(e).lower()
+            outcome = "quota" if is_quota_error(e) else "error"
+            if outcome == "error":
+                quota_only = False
+                logging.error(f"❌ Gemini API error with key {key_state.label}: {str(e)}")
+            last_error = e
+        
+        finally:
+            gemini_key_pool.release(key_state, outcome)
+            gemini_breaker.record(gemini_outcome_failed(outcome))
+    
+    raise gemini_failure(last_error, quota_only, circuit_open, budget_exhausted)
+
+async def stream_gemini(prompt: str, usage: Optional[dict] = None) -> AsyncIterator[str]:
+    """Stream the Gemini analysis as raw text chunks, switching keys until the first chunk arrives.
+
+    The prompt tokens Gemini reports are stored in `usage["prompt_tokens"]`.
+    """
+    if not GEMINI_API_KEYS:
+        raise AnalysisError("Gemini API anahtarları yapılandırılmamış.")
+    
+    estimated_tokens = estimate_tokens(prompt) + GEMINI_OUTPUT_TOKEN_ESTIMATE
+    tried = set()
+    last_error = None
+    quota_only = True
+    circuit_open = False
+    budget_exhausted = False
+    
+    for _ in range(len(gemini_key_pool)):
+        if not gemini_breaker.allow():
+            circuit_open = True
+            break
+        key_state = await gemini_key_pool.lease(estimated_tokens, exclude=tried)
+        if key_state is None:
+            gemini_breaker.record(None)
+            budget_exhausted = not gemini_key_pool.cooling_down(tried)
+            break
+        tried.add(key_state.index)
+        outcome = "cancelled"
+        started = False
+        
+        try:
+            logging.info(f"Streaming with Gemini API key {key_state.label}")
             
-            # Check if it's a quota/rate limit error
-            if any(keyword in error_str for keyword in ['quota', 'rate limit', 'resource exhausted', '429', 'quota exceeded']):
-                logging.warning(f"⚠ Gemini API key #{CURRENT_GEMINI_KEY_INDEX + 1} quota exceeded. Trying next key...")
-                
-                # Move to next key
-                CURRENT_GEMINI_KEY_INDEX = (CURRENT_GEMINI_KEY_INDEX + 1) % len(GEMINI_API_KEYS)
-                
-                # If we've tried all keys, return error
-                if attempt == len(GEMINI_API_KEYS) - 1:
-                    logging.error("❌ All Gemini API keys exhausted!")
-                    return "Tüm Gemini API anahtarlarının kotası doldu. Lütfen daha sonra tekrar deneyin."
-                
-                # Try next key
-                continue
-            else:
-                # Other error, log and try next key
-                logging.error(f"❌ Gemini API error with key #{CURRENT_GEMINI_KEY_INDEX + 1}: {str(e)}")
-                CURRENT_GEMINI_KEY_INDEX = (CURRENT_GEMINI_KEY_INDEX + 1) % len(GEMINI_API_KEYS)
-                
-                if attempt == len(GEMINI_API_KEYS) - 1:
-                    return f"Analiz hatası: {str(e)}"
-                
-                continue
+            stream = await key_state.client.aio.models.generate_content_stream(
+                model=GEMINI_MODEL,
+                contents=prompt,
+                config=gemini_generate_config()
+            )
+            async for chunk in stream:
+                tokens = prompt_token_count(chunk)
+                if usage is not None and tokens is not None:
+                    usage["prompt_tokens"] = tokens
+                if chunk.text:
+                    started = True
+                    yield chunk.text
+            outcome = "success"
+            return
+        
+        except Exception as e:
+            outcome = "quota" if is_quota_error(e) else "error"
+            # Once text reached the client we can't transparently switch keys
+            if started:
+                raise AnalysisError(f"Analiz hatası: {str(e)}")
+            if outcome == "error":
+                quota_only = False
+            logging.warning(f"⚠ Gemini streaming failed with key {key_state.label}: {str(e)}")
+            last_error = e
+        
+        finally:
+            gemini_key_pool.release(key_state, outcome)
+            gemini_breaker.record(gemini_outcome_failed(outcome))
     
-    return "Analiz yapılamadı. Lütfen tekrar deneyin."
+    raise gemini_failure(last_error, quota_only, circuit_open, budget_exhausted)
 
-# Auth Routes
-@api_router.post("/auth/session")
-async def exchange_session(request: SessionExchangeRequest, response: Response):
-    """Exchange session_id for user data and session_token"""
+PARCEL_FIELDS = ["il", "ilce", "mahalle", "ada", "parsel"]
+TURKISH_LOWER = str.maketrans({"I": "ı", "İ": "i"})
+MAHALLE_SUFFIX = re.compile(r"\s+(mahallesi|mahalle|mah|mh)\.?$")
+PROPERTY_INFO_PATTERN = re.compile(r"İl: (.*), İlçe: (.*), Mahalle: (.*), Ada: (.*), Parsel: (.*)")
+
+def turkish_lower(text: str) -> str:
+    """Lowercase with Turkish dotted/dotless i (İ→i, I→ı) and collapsed whitespace"""
+    text = unicodedata.normalize("NFC", text).translate(TURKISH_LOWER).lower()
+    return " ".join(text.split())
+
+def canonical_parcel(il: str, ilce: str, mahalle: str, ada: str, parsel: str) -> dict:
+    """Canonical parcel identity: "Moda Mah." and "MODA MAHALLESİ" or parsel "007" and "7" are the same parcel"""
+    def name(value: str) -> str:
+        # ı folds to i so "Istanbul" typed without Turkish letters matches "İstanbul"
+        return turkish_lower(value).replace("ı", "i")
+    
+    def number(value: str) -> str:
+        value = "".join(value.split())
+        return (value.lstrip("0") or "0") if value.isdigit() else name(value)
+    
+    return {
+        "il": name(il),
+        "ilce": name(ilce),
+        "mahalle": MAHALLE_SUFFIX.sub("", name(mahalle)),
+        "ada": number(ada),
+        "parsel": number(parsel)
+    }
+
+def request_parcel(request_data: PropertyAnalysisRequest) -> dict:
+    return canonical_parcel(*(getattr(request_data, field) for field in PARCEL_FIELDS))
+
+def parse_property_info(property_info: str) -> Optional[dict]:
+    """Canonical parcel of a stored property_info string (for records that predate `parcel`)"""
+    match = PROPERTY_INFO_PATTERN.fullmatch(property_info)
+    return canonical_parcel(*match.groups()) if match else None
+
+def parcel_cache_key(request_data: PropertyAnalysisRequest) -> str:
+    """Cache key for a parcel, built from its canonical identity"""
+    parcel = request_parcel(request_data)
+    return "|".join(parcel[field] for field in PARCEL_FIELDS)
+
+def analysis_digest(text: str) -> str:
+    return hashlib.sha256(text.encode()).hexdigest()
+
+async def store_analysis_body(text: str, database=None) -> str:
+    """Store an analysis text once, addressed by its SHA-256; returns the digest"""
+    digest = analysis_digest(text)
+    if digest in stored_analysis_digests:
+        return digest
+    
     try:
-        # Call Emergent Auth API
-        auth_response = requests.get(
-            "https://demobackend.emergentagent.com/auth/v1/env/oauth/session-data",
-            headers={"X-Session-ID": request.session_id},
-            timeout=10
+        await (database if database is not None else db).analysis_bodies.update_one(
+            {"_id": digest},
+            {"$setOnInsert": {"analysis": text, "size": len(text), "created_at": datetime.now(timezone.utc)}},
+            upsert=True
         )
-        auth_response.raise_for_status()
-        auth_data = auth_response.json()
-        
-        # Check if user exists
+    except DuplicateKeyError:
+        pass  # a concurrent upsert stored the same text
+    stored_analysis_digests[digest] = True
+    analysis_body_cache[digest] = text
+    return digest
+
+async def record_parcel_zoning(parcel: dict, zoning: dict, analysis_hash: Optional[str], database=None):
+    """Keep the latest extracted zoning values per canonical parcel (one document per parcel for stats)"""
+    if not any(value is not None for value in zoning.values()):
+        return
+    await (database if database is not None else db).parcel_zoning.update_one(
+        {"_id": "|".join(parcel[field] for field in PARCEL_FIELDS)},
+        {"$set": {
+            "parcel": parcel,
+            "zoning": zoning,
+            "analysis_hash": analysis_hash,
+            "updated_at": datetime.now(timezone.utc)
+        }},
+        upsert=True
+    )
+
+async def load_analysis_body(digest: str) -> Optional[str]:
+    text = analysis_body_cache.get(digest)
+    if text is None:
+        doc = await db.analysis_bodies.find_one({"_id": digest}, {"analysis": 1})
+        if doc is None:
+            return None
+        text = analysis_body_cache[digest] = doc["analysis"]
+    return text
+
+async def get_cached_analysis(cache_key: str) -> Optional[dict]:
+    """Look up a fresh analysis in the memory cache, then in Mongo"""
+    fresh_after = datetime.now(timezone.utc) - timedelta(seconds=ANALYSIS_CACHE_TTL_SECONDS)
+    
+    cached = analysis_memory_cache.get(cache_key)
+    if cached and cached["created_at"] >= fresh_after:
+        return cached
+    
+    cached = await db.analysis_cache.find_one(
+        {"_id": cache_key, "created_at": {"$gte": fresh_after}},
+        {"_id": 0}
+    )
+    if not cached:
+        return None
+    
+    # Entries written before the content-addressed store hold the text inline
+    if "analysis" not in cached:
+        cached["analysis"] = await load_analysis_body(cached.pop("analysis_hash"))
+        if cached["analysis"] is None:
+            return None
+    
+    if cached["created_at"].tzinfo is None:
+        cached["created_at"] = cached["created_at"].replace(tzinfo=timezone.utc)
+    analysis_memory_cache[cache_key] = cached
+    return cached
+
+async def store_cached_analysis(cache_key: str, result: dict):
+    """Store an analysis result in both cache tiers"""
+    entry = {
+        "parcel": result["parcel"],
+        "zoning": result["zoning"],
+        "property_info": result["property_info"],
+        "search_query": result["search_query"],
+        "prompt_tokens": result["prompt_tokens"],
+        "created_at": datetime.now(timezone.utc)
+    }
+    analysis_memory_cache[cache_key] = {**entry, "analysis": result["analysis"]}
+    try:
+        digest = await store_analysis_body(result["analysis"])
+        await db.analysis_cache.replace_one({"_id": cache_key}, {**entry, "analysis_hash": digest}, upsert=True)
+    except Exception as e:
+        logging.warning(f"Analysis cache write failed: {str(e)}")
+
+def build_search_query(request_data: PropertyAnalysisRequest) -> str:
+    return f"{request_data.il} {request_data.ilce} {request_data.mahalle} ada {request_data.ada} parsel {request_data.parsel} imar durumu KAK TAKS emsal yapılaşma koşulları"
+
+def build_property_info(request_data: PropertyAnalysisRequest) -> str:
+    return f"İl: {request_data.il}, İlçe: {request_data.ilce}, Mahalle: {request_data.mahalle}, Ada: {request_data.ada}, Parsel: {request_data.parsel}"
+
+async def prepare_analysis(request_data: PropertyAnalysisRequest) -> dict:
+    """Search and build the Gemini prompt for a parcel"""
+    search_query = build_search_query(request_data)
+    property_info = build_property_info(request_data)
+    
+    try:
+        with STAGE_LATENCY.labels("brave_search").time():
+            results = await search_brave(search_query)
+        with STAGE_LATENCY.labels("context_build").time():
+            search_context = build_search_context(results, request_data)
+        search_failed = False
+    except Exception as e:
+        logging.error(f"Brave Search error: {str(e)}")
+        search_context = f"{BRAVE_ERROR_PREFIX}: {str(e)}"
+        search_failed = True
+    
+    prompt = ANALYSIS_PROMPT.render(property_info=property_info, search_results=search_context)
+    return {
+        "parcel": request_parcel(request_data),
+        "property_info": property_info,
+        "search_query": search_query,
+        "prompt": prompt,
+        "search_failed": search_failed
+    }
+
+async def run_property_analysis(request_data: PropertyAnalysisRequest) -> dict:
+    """Run the Brave Search + Gemini pipeline for a parcel"""
+    prepared = await prepare_analysis(request_data)
+    with STAGE_LATENCY.labels("gemini").time():
+        analysis, prompt_tokens = await analyze_with_gemini(prepared.pop("prompt"))
+    with STAGE_LATENCY.labels("zoning_extraction").time():
+        zoning = extract_zoning_attributes(analysis)
+    return {**prepared, "analysis": analysis, "prompt_tokens": prompt_tokens, "zoning": zoning}
+
+def track_inflight(key: str, future: asyncio.Future) -> asyncio.Future:
+    """Publish an in-flight analysis under its key until it finishes"""
+    analysis_inflight[key] = future
+    
+    def _release(finished: asyncio.Future):
+        if analysis_inflight.get(key) is finished:
+            del analysis_inflight[key]
+        if not finished.cancelled():
+            finished.exception()  # mark as retrieved even if every caller went away
+    
+    future.add_done_callback(_release)
+    return future
+
+async def run_single_flight(key: str, factory: Callable[[], Awaitable[dict]]) -> dict:
+    """Run factory() once per key; concurrent callers share the in-flight result"""
+    task = analysis_inflight.get(key)
+    if task is None:
+        task = track_inflight(key, asyncio.ensure_future(factory()))
+    else:
+        logging.info(f"Joining in-flight analysis: {key}")
+    
+    # Shield so a disconnecting caller doesn't cancel the pipeline for the others
+    return await asyncio.shield(task)
+
+async def _analyze_and_cache(cache_key: str, request_data: PropertyAnalysisRequest) -> dict:
+    """Run the pipeline and store successful results in the cache"""
+    result = await run_property_analysis(request_data)
+    
+    # Don't keep analyses built without search results
+    if not result.pop("search_failed"):
+        await store_cached_analysis(cache_key, result)
+    
+    return result
+
+async def get_property_analysis(request_data: PropertyAnalysisRequest) -> dict:
+    """Return a cached analysis for the parcel or run the pipeline"""
+    cache_key = parcel_cache_key(request_data)
+    
+    if not request_data.force_refresh:
+        with STAGE_LATENCY.labels("cache_lookup").time():
+            cached = await get_cached_analysis(cache_key)
+        ANALYSIS_CACHE_LOOKUPS.labels("hit" if cached else "miss").inc()
+        if cached:
+            logging.info(f"Analysis cache hit: {cache_key}")
+            return {**cached, "cached": True}
+    
+    result = await run_single_flight(cache_key, lambda: _analyze_and_cache(cache_key, request_data))
+    return {**result, "cached": False}
+
+# Auth Routes
+@api_router.post("/auth/session")
+async def exchange_session(request: SessionExchangeRequest, response: Response):
+    """Exchange session_id for user data and session_token"""
+    try:
+        # Call Emergent Auth API
+        auth_response = await http_client.get(
+            EMERGENT_AUTH_URL,
+            headers={"X-Session-ID": request.session_id}
+        )
+        auth_response.raise_for_status()
+        auth_data = auth_response.json()
+        
+        # Check if user exists
         user_doc = await db.users.find_one({"email": auth_data["email"]}, {"_id": 0})
         
         if user_doc:
@@ -333,6 +1659,7 @@ async def exchange_session(request: SessionExchangeRequest, response: Response):
                     "picture": auth_data.get("picture")
                 }}
             )
+            invalidate_user_cache(user_id)
         else:
             # Create new user with 10 credits (5 anonymous + 5 login bonus)
             user_id = f"user_{uuid.uuid4().hex[:12]}"
@@ -351,7 +1678,7 @@ async def exchange_session(request: SessionExchangeRequest, response: Response):
         session_doc = {
             "user_id": user_id,
             "session_token": session_token,
-            "expires_at": (datetime.now(timezone.utc) + timedelta(days=7)).isoformat(),
+            "expires_at": datetime.now(timezone.utc) + timedelta(days=7),
             "created_at": datetime.now(timezone.utc).isoformat()
         }
         await db.user_sessions.insert_one(session_doc.copy())
@@ -368,7 +1695,7 @@ async def exchange_session(request: SessionExchangeRequest, response: Response):
         )
         
         # Get fresh user data
-        user = await db.users.find_one({"user_id": user_id}, {"_id": 0})
+        user = await db.users.find_one({"user_id": user_id}, {"_id": 0, "applied_orders": 0})
         
         return user
     
@@ -382,109 +1709,858 @@ async def get_me(request: Request, session_token: Optional[str] = Cookie(None)):
     user = await get_current_user(request, session_token)
     if not user:
         raise HTTPException(status_code=401, detail="Not authenticated")
-    return user
+    return ORJSONResponse(user)
 
 @api_router.post("/auth/logout")
 async def logout(request: Request, response: Response, session_token: Optional[str] = Cookie(None)):
     """Logout user"""
     if session_token:
         await db.user_sessions.delete_one({"session_token": session_token})
+        invalidate_session_cache(session_token)
     response.delete_cookie(key="session_token", path="/")
     return {"message": "Logged out"}
 
 # Analysis Routes
+class CreditReservation:
+    """A credit taken atomically before an analysis; refunded if the analysis fails"""
+
+    def __init__(self, remaining_credits: int, user_id: Optional[str] = None, ip_hash: Optional[str] = None):
+        self.remaining_credits = remaining_credits
+        self.user_id = user_id
+        self.ip_hash = ip_hash
+        self.settled = False
+
+    async def refund(self):
+        if self.settled:
+            return
+        self.settled = True
+        
+        if self.user_id:
+            await db.users.update_one({"user_id": self.user_id}, {"$inc": {"credits": 1}})
+            invalidate_user_cache(self.user_id)
+        else:
+            await db.anonymous_sessions.update_one(
+                {"ip_hash": self.ip_hash, "credits_used": {"$gt": 0}},
+                {"$inc": {"credits_used": -1}}
+            )
+        self.remaining_credits += 1
+        logging.info(f"Refunded analysis credit ({self.user_id or 'anonymous'})")
+
+    async def commit(self, result: dict, analysis_id: Optional[str] = None):
+        """Keep the credit and record the analysis"""
+        self.settled = True
+        
+        # Legacy cache entries have no parcel; cached zoning may predate the current extraction rules
+        parcel = result.get("parcel") or parse_property_info(result["property_info"])
+        zoning = None if result["cached"] else result.get("zoning")
+        if zoning is None:
+            zoning = extract_zoning_attributes(result["analysis"])
+        analysis_hash = await store_analysis_body(result["analysis"])
+        if parcel and not result["cached"]:
+            await record_parcel_zoning(parcel, zoning, analysis_hash)
+        
+        if self.user_id:
+            try:
+                await db.analyses.insert_one({
+                    "analysis_id": analysis_id or f"analysis_{uuid.uuid4().hex}",
+                    "user_id": self.user_id,
+                    "parcel": parcel,
+                    "zoning": zoning,
+                    "zoning_version": ZONING_EXTRACTION_VERSION,
+                    "property_info": result["property_info"],
+                    "search_query": result["search_query"],
+                    "analysis_hash": analysis_hash,
+                    "cached": result["cached"],
+                    # A cache hit sent nothing to Gemini
+                    "prompt_tokens": None if result["cached"] else result.get("prompt_tokens"),
+                    "timestamp": datetime.now(timezone.utc).isoformat()
+                })
+            except DuplicateKeyError:
+                # A retried job that already recorded its analysis
+                logging.info(f"Analysis {analysis_id} already recorded")
+        else:
+            await db.anonymous_analyses.insert_one({
+                "ip_hash": self.ip_hash,
+                "parcel": parcel,
+                "zoning": zoning,
+                "property_info": result["property_info"],
+                "search_query": result["search_query"],
+                "timestamp": datetime.now(timezone.utc)
+            })
+
+async def reserve_credit(request: Request, user: Optional[dict]) -> CreditReservation:
+    """Atomically take one credit from the user or the anonymous session (403 if none left)"""
+    # The balances are read before the decrement: the updated document may no longer match the filter
+    if user:
+        before = await db.users.find_one_and_update(
+            {"user_id": user['user_id'], "credits": {"$gt": 0}},
+            {"$inc": {"credits": -1}},
+            projection={"_id": 0, "credits": 1},
+            return_document=ReturnDocument.BEFORE
+        )
+        invalidate_user_cache(user['user_id'])
+        
+        if not before:
+            raise HTTPException(
+                status_code=403,
+                detail="Krediniz bitti. Lütfen kredi satın alın."
+            )
+        return CreditReservation(before['credits'] - 1, user_id=user['user_id'])
+    
+    ip_hash = hash_ip(get_client_ip(request))
+    now = datetime.now(timezone.utc)
+    
+    async def take_free_credit() -> Optional[dict]:
+        return await db.anonymous_sessions.find_one_and_update(
+            {"ip_hash": ip_hash, "credits_used": {"$lt": ANONYMOUS_CREDIT_LIMIT}},
+            {"$inc": {"credits_used": 1}, "$set": {"last_used": now}},
+            projection={"_id": 0, "credits_used": 1},
+            return_document=ReturnDocument.BEFORE
+        )
+    
+    # No upsert: a filter miss must not create a fresh session for an IP that used up its credits
+    before = await take_free_credit()
+    if not before and not await db.anonymous_sessions.find_one({"ip_hash": ip_hash}, {"_id": 1}):
+        try:
+            await db.anonymous_sessions.insert_one({"ip_hash": ip_hash, "credits_used": 1, "created_at": now, "last_used": now})
+            before = {"credits_used": 0}
+        except DuplicateKeyError:
+            # A concurrent first request created the session
+            before = await take_free_credit()
+    
+    if not before:
+        raise HTTPException(
+            status_code=403,
+            detail="Ücretsiz kullanım hakkınız dolmuştur. Lütfen giriş yapınız."
+        )
+    return CreditReservation(ANONYMOUS_CREDIT_LIMIT - before['credits_used'] - 1, ip_hash=ip_hash)
+
 @api_router.post("/analyze-property", response_model=PropertyAnalysisResponse)
 async def analyze_property(request_data: PropertyAnalysisRequest, request: Request, session_token: Optional[str] = Cookie(None)):
     """Analyze property with Brave Search and Gemini AI"""
     try:
-        user = await get_current_user(request, session_token)
-        
-        if user:
-            # Authenticated user
-            if user['credits'] <= 0:
-                raise HTTPException(
-                    status_code=403,
-                    detail="Krediniz bitti. Lütfen kredi satın alın."
-                )
-            
-            # Create search query
-            search_query = f"{request_data.il} {request_data.ilce} {request_data.mahalle} ada {request_data.ada} parsel {request_data.parsel} imar durumu KAK TAKS emsal yapılaşma koşulları"
+        with STAGE_LATENCY.labels("auth").time():
+            user = await get_current_user(request, session_token)
+        await enforce_rate_limit(request, user)
+        with STAGE_LATENCY.labels("credit_reservation").time():
+            reservation = await reserve_credit(request, user)
+        
+        try:
+            # Search and analyze (served from cache when fresh)
+            with STAGE_LATENCY.labels("analysis").time():
+                result = await get_property_analysis(request_data)
+        except BaseException:
+            await asyncio.shield(reservation.refund())
+            raise
+        
+        with STAGE_LATENCY.labels("record").time():
+            await reservation.commit(result)
+        
+        # Returned as-is: response_model only documents the shape, skipping re-validation of the analysis text
+        return ORJSONResponse({
+            "analysis": result["analysis"],
+            "remaining_credits": reservation.remaining_credits,
+            "search_query": result["search_query"]
+        })
+    
+    except HTTPException:
+        raise
+    except AnalysisError as e:
+        logging.error(f"Analysis failed: {str(e)}")
+        raise HTTPException(status_code=502, detail=str(e))
+    except Exception as e:
+        logging.error(f"Analysis error: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Analiz hatası: {str(e)}")
+
+def sse_event(event: str, data: dict) -> str:
+    """Format a server-sent event"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@api_router.post("/analyze-property/stream")
+async def analyze_property_stream(request_data: PropertyAnalysisRequest, request: Request, session_token: Optional[str] = Cookie(None)):
+    """Analyze property and stream the result as server-sent events.
+
+    Events: `search` once Brave Search is done, `token` for each chunk of
+    analysis text, then `done` with the remaining credits (or `error`).
+    The credit is reserved up front and refunded unless the analysis completes.
+    """
+    user = await get_current_user(request, session_token)
+    await enforce_rate_limit(request, user)
+    reservation = await reserve_credit(request, user)
+    
+    async def event_stream():
+        try:
+            cache_key = parcel_cache_key(request_data)
+            cached = None if request_data.force_refresh else await get_cached_analysis(cache_key)
             
-            # Search and analyze
-            search_results = await search_brave(search_query)
-            property_info = f"İl: {request_data.il}, İlçe: {request_data.ilce}, Mahalle: {request_data.mahalle}, Ada: {request_data.ada}, Parsel: {request_data.parsel}"
-            analysis = await analyze_with_gemini(property_info, search_results)
+            if cached:
+                result = {**cached, "cached": True}
+                yield sse_event("search", {"search_query": result["search_query"], "cached": True})
+                yield sse_event("token", {"text": result["analysis"]})
+            elif cache_key in analysis_inflight:
+                # Another request is already analyzing this parcel: share its result instead of
+                # running Brave and Gemini again, then send the text in one piece
+                logging.info(f"Joining in-flight analysis: {cache_key}")
+                result = {**await asyncio.shield(analysis_inflight[cache_key]), "cached": False}
+                yield sse_event("search", {"search_query": result["search_query"], "cached": False})
+                yield sse_event("token", {"text": result["analysis"]})
+            else:
+                # Concurrent requests for the parcel (streamed or not) join this stream's result
+                inflight = track_inflight(cache_key, asyncio.get_running_loop().create_future())
+                try:
+                    prepared = await prepare_analysis(request_data)
+                    yield sse_event("search", {"search_query": prepared["search_query"], "cached": False})
+                
+                    cleaner = MarkdownStreamCleaner()
+                    parts = []
+                    usage = {}
+                    async for chunk in stream_gemini(prepared["prompt"], usage):
+                        text = cleaner.feed(chunk)
+                        if text:
+                            parts.append(text)
+                            yield sse_event("token", {"text": text})
+                    tail = cleaner.flush()
+                    if tail:
+                        parts.append(tail)
+                        yield sse_event("token", {"text": tail})
+                
+                    result = {
+                        "parcel": prepared["parcel"],
+                        "property_info": prepared["property_info"],
+                        "search_query": prepared["search_query"],
+                        "prompt_tokens": usage.get("prompt_tokens"),
+                        "analysis": "".join(parts),
+                        "cached": False
+                    }
+                    result["zoning"] = extract_zoning_attributes(result["analysis"])
+                    if not prepared["search_failed"]:
+                        await store_cached_analysis(cache_key, result)
+                except BaseException as e:
+                    inflight.set_exception(e if isinstance(e, Exception) else AnalysisError("Analiz yarıda kesildi"))
+                    raise
+                inflight.set_result({field: value for field, value in result.items() if field != "cached"})
             
-            # Update user credits
-            new_credits = user['credits'] - 1
-            await db.users.update_one(
-                {"user_id": user['user_id']},
-                {"$set": {"credits": new_credits}}
-            )
+            await reservation.commit(result)
             
-            # Save analysis
-            await db.analyses.insert_one({
-                "user_id": user['user_id'],
-                "property_info": property_info,
-                "search_query": search_query,
-                "analysis": analysis,
-                "timestamp": datetime.now(timezone.utc).isoformat()
+            yield sse_event("done", {
+                "remaining_credits": reservation.remaining_credits,
+                "search_query": result["search_query"]
             })
-            
-            return PropertyAnalysisResponse(
-                analysis=analysis,
-                remaining_credits=new_credits,
-                search_query=search_query
-            )
-        else:
-            # Anonymous user
-            ip = get_client_ip(request)
-            session = await get_or_create_anonymous_session(ip)
-            
-            if session['credits_used'] >= 5:
-                raise HTTPException(
-                    status_code=403,
-                    detail="Ücretsiz kullanım hakkınız dolmuştur. Lütfen giriş yapınız."
+        
+        except AnalysisError as e:
+            logging.error(f"Streaming analysis failed: {str(e)}")
+            yield sse_event("error", {"detail": str(e)})
+        except Exception as e:
+            logging.error(f"Streaming analysis error: {str(e)}")
+            yield sse_event("error", {"detail": f"Analiz hatası: {str(e)}"})
+        finally:
+            # Failed or abandoned streams (client disconnect) give the credit back
+            if not reservation.settled:
+                await asyncio.shield(reservation.refund())
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+# Rate limiting
+def parse_rate_limit(spec: str) -> tuple:
+    requests_allowed, _, seconds = spec.partition("/")
+    return int(requests_allowed), float(seconds or 60)
+
+class SlidingWindowLimiter:
+    """Sliding-window counter limiter.
+
+    Keeps per-key counts for the current and previous fixed window and
+    estimates the sliding count as current + previous * (unused part of the
+    previous window). Constant memory per key, no timestamp logs.
+    """
+
+    def __init__(self, spec: str, clock: Callable[[], float] = time.time):
+        self.limit, self.window = parse_rate_limit(spec)
+        self.clock = clock
+        # key -> [window index, current count, previous count]
+        self._counters = TTLCache(maxsize=100000, ttl=self.window * 2)
+
+    def _retry_after(self, now: float, current: int, previous: int, cost: int = 1) -> float:
+        """Seconds until `cost` more requests fit in the window"""
+        into_window = now % self.window
+        if current + cost > self.limit or previous == 0:
+            return self.window - into_window
+        # previous * (1 - t / window) + current + cost <= limit
+        needed_fraction = 1 - (self.limit - current - cost) / previous
+        return max(0.0, needed_fraction * self.window - into_window)
+
+    def _estimate(self, now: float, current: int, previous: int) -> float:
+        return previous * (1 - (now % self.window) / self.window) + current
+
+    async def hit(self, key: str, cost: int = 1) -> float:
+        """Count `cost` requests if they fit; returns 0 if allowed, else the seconds to wait (rejections are not counted)"""
+        now = self.clock()
+        index = int(now // self.window)
+        entry = self._counters.get(key)
+        
+        if entry is None or entry[0] < index - 1:
+            entry = [index, 0, 0]
+        elif entry[0] == index - 1:
+            entry = [index, 0, entry[1]]
+        
+        if self._estimate(now, entry[1], entry[2]) + cost > self.limit:
+            self._counters[key] = entry
+            return self._retry_after(now, entry[1], entry[2], cost)
+        
+        entry[1] += cost
+        self._counters[key] = entry
+        return 0.0
+
+class MongoSlidingWindowLimiter(SlidingWindowLimiter):
+    """Same algorithm with per-window counters in the rate_limits collection (shared by all workers)"""
+
+    async def hit(self, key: str, cost: int = 1) -> float:
+        now = self.clock()
+        index = int(now // self.window)
+        expires_at = datetime.fromtimestamp((index + 2) * self.window, tz=timezone.utc)
+        
+        previous_doc = await db.rate_limits.find_one({"_id": f"{key}:{index - 1}"})
+        previous = previous_doc["count"] if previous_doc else 0
+        
+        # Highest current-window count that still leaves room; the conditional $inc
+        # only counts accepted requests, like the in-memory limiter
+        room = self.limit - self._estimate(now, 0, previous) - cost
+        if room >= 0:
+            try:
+                await db.rate_limits.update_one(
+                    {"_id": f"{key}:{index}", "count": {"$lte": int(room)}},
+                    {"$inc": {"count": cost}, "$setOnInsert": {"expires_at": expires_at}},
+                    upsert=True
                 )
+                return 0.0
+            except DuplicateKeyError:
+                pass  # the window's counter exists and is already full
+        
+        current_doc = await db.rate_limits.find_one({"_id": f"{key}:{index}"})
+        current = current_doc["count"] if current_doc else 0
+        return self._retry_after(now, current, previous, cost)
+
+RateLimiter = MongoSlidingWindowLimiter if RATE_LIMIT_BACKEND == "mongo" else SlidingWindowLimiter
+anonymous_rate_limiter = RateLimiter(RATE_LIMIT_ANONYMOUS)
+authenticated_rate_limiter = RateLimiter(RATE_LIMIT_AUTHENTICATED)
+bulk_rate_limiter = RateLimiter(RATE_LIMIT_BULK)
+
+def rate_limited(kind: str, retry_after: float) -> HTTPException:
+    RATE_LIMITED.labels(kind).inc()
+    seconds = max(1, int(retry_after + 0.999))
+    return HTTPException(
+        status_code=429,
+        detail=f"Çok fazla istek gönderdiniz. Lütfen {seconds} saniye sonra tekrar deneyin.",
+        headers={"Retry-After": str(seconds)}
+    )
+
+async def enforce_rate_limit(request: Request, user: Optional[dict]):
+    """Reject the request with 429 + Retry-After before it spends any upstream quota"""
+    if user:
+        kind, retry_after = "user", await authenticated_rate_limiter.hit(f"user:{user['user_id']}")
+    else:
+        kind, retry_after = "ip", await anonymous_rate_limiter.hit(f"ip:{hash_ip(get_client_ip(request))}")
+    
+    if retry_after:
+        raise rate_limited(kind, retry_after)
+
+async def enforce_bulk_rate_limit(user: dict, parcels: int):
+    """Charge a bulk batch one unit per unique parcel against the user's bulk budget"""
+    if parcels > bulk_rate_limiter.limit:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Tek seferde en fazla {bulk_rate_limiter.limit} parsel analiz edilebilir."
+        )
+    retry_after = await bulk_rate_limiter.hit(f"bulk:{user['user_id']}", cost=parcels)
+    if retry_after:
+        raise rate_limited("bulk", retry_after)
+
+# Bulk analysis
+async def parse_bulk_rows(request: Request) -> List[PropertyAnalysisRequest]:
+    """Parse a CSV (text/csv) or JSON list body into analysis requests"""
+    body = await request.body()
+    content_type = request.headers.get("content-type", "")
+    
+    try:
+        if "csv" in content_type:
+            rows = list(csv.DictReader(io.StringIO(body.decode("utf-8-sig"))))
+        else:
+            rows = json.loads(body)
+            if isinstance(rows, dict):
+                rows = rows.get("rows")
+    except (UnicodeDecodeError, ValueError, csv.Error) as e:
+        raise HTTPException(status_code=400, detail=f"Geçersiz dosya: {str(e)}")
+    
+    if not isinstance(rows, list) or not rows:
+        raise HTTPException(status_code=400, detail="En az bir parsel gönderilmelidir")
+    if len(rows) > BULK_MAX_ROWS:
+        raise HTTPException(status_code=400, detail=f"En fazla {BULK_MAX_ROWS} parsel gönderilebilir")
+    
+    requests_data = []
+    for index, row in enumerate(rows):
+        try:
+            requests_data.append(PropertyAnalysisRequest.model_validate(row))
+        except ValidationError as e:
+            raise HTTPException(status_code=422, detail={"row": index, "errors": e.errors(include_url=False)})
+    return requests_data
+
+@api_router.post("/analyze-property/bulk")
+async def analyze_property_bulk(request: Request, session_token: Optional[str] = Cookie(None)):
+    """Analyze many parcels at once, streaming one NDJSON line per unique parcel as it finishes"""
+    user = await get_current_user(request, session_token)
+    if not user:
+        raise HTTPException(status_code=401, detail="Giriş yapmalısınız")
+    await enforce_rate_limit(request, user)
+    
+    requests_data = await parse_bulk_rows(request)
+    
+    # Duplicate parcels are analyzed (and charged) once
+    parcels: Dict[str, dict] = {}
+    for index, request_data in enumerate(requests_data):
+        parcel = parcels.setdefault(parcel_cache_key(request_data), {"request": request_data, "rows": []})
+        parcel["rows"].append(index)
+    
+    await enforce_bulk_rate_limit(user, len(parcels))
+    
+    # Reserve credits for the whole batch up front
+    needed = len(parcels)
+    before = await db.users.find_one_and_update(
+        {"user_id": user['user_id'], "credits": {"$gte": needed}},
+        {"$inc": {"credits": -needed}},
+        projection={"_id": 0, "credits": 1},
+        return_document=ReturnDocument.BEFORE
+    )
+    invalidate_user_cache(user['user_id'])
+    if not before:
+        raise HTTPException(
+            status_code=403,
+            detail=f"Bu işlem için {needed} kredi gerekiyor. Lütfen kredi satın alın."
+        )
+    remaining_credits = before['credits'] - needed
+    
+    semaphore = asyncio.Semaphore(BULK_CONCURRENCY)
+    
+    async def analyze_parcel(parcel: dict) -> dict:
+        async with semaphore:
+            request_data = parcel["request"]
+            line = {"rows": parcel["rows"], **request_data.model_dump(exclude={"force_refresh"})}
+            try:
+                result = await get_property_analysis(request_data)
+                await CreditReservation(remaining_credits, user_id=user['user_id']).commit(result)
+                return {**line, "status": "ok", "analysis": result["analysis"], "search_query": result["search_query"], "cached": result["cached"]}
+            except AnalysisError as e:
+                return {**line, "status": "error", "detail": str(e)}
+            except Exception as e:
+                logging.error(f"Bulk analysis error: {str(e)}")
+                return {**line, "status": "error", "detail": f"Analiz hatası: {str(e)}"}
+    
+    async def ndjson_stream():
+        tasks = [asyncio.ensure_future(analyze_parcel(parcel)) for parcel in parcels.values()]
+        succeeded = 0
+        try:
+            for finished in asyncio.as_completed(tasks):
+                yield json.dumps(await finished, ensure_ascii=False) + "\n"
+        finally:
+            for task in tasks:
+                task.cancel()
             
-            # Create search query
-            search_query = f"{request_data.il} {request_data.ilce} {request_data.mahalle} ada {request_data.ada} parsel {request_data.parsel} imar durumu KAK TAKS emsal yapılaşma koşulları"
-            
-            # Search and analyze
-            search_results = await search_brave(search_query)
-            property_info = f"İl: {request_data.il}, İlçe: {request_data.ilce}, Mahalle: {request_data.mahalle}, Ada: {request_data.ada}, Parsel: {request_data.parsel}"
-            analysis = await analyze_with_gemini(property_info, search_results)
-            
-            # Update anonymous session
-            new_credits_used = session['credits_used'] + 1
-            await db.anonymous_sessions.update_one(
-                {"ip_hash": session['ip_hash']},
-                {
-                    "$set": {
-                        "credits_used": new_credits_used,
-                        "last_used": datetime.now(timezone.utc).isoformat()
-                    },
-                    "$push": {
-                        "analyses": {
-                            "property_info": property_info,
-                            "search_query": search_query,
-                            "timestamp": datetime.now(timezone.utc).isoformat()
-                        }
-                    }
-                }
+            # Give back credits of failed (or, if the client went away, unfinished) parcels
+            succeeded = sum(
+                1 for task in tasks
+                if task.done() and not task.cancelled() and task.result()["status"] == "ok"
             )
-            
-            return PropertyAnalysisResponse(
-                analysis=analysis,
-                remaining_credits=5 - new_credits_used,
-                search_query=search_query
+            refund = needed - succeeded
+            if refund:
+                await asyncio.shield(db.users.update_one({"user_id": user['user_id']}, {"$inc": {"credits": refund}}))
+                invalidate_user_cache(user['user_id'])
+        
+        yield json.dumps({
+            "status": "summary",
+            "parcels": needed,
+            "succeeded": succeeded,
+            "failed": needed - succeeded,
+            "remaining_credits": remaining_credits + needed - succeeded
+        }, ensure_ascii=False) + "\n"
+    
+    return StreamingResponse(ndjson_stream(), media_type="application/x-ndjson")
+
+# Background analysis jobs
+def job_owner(reservation: CreditReservation) -> dict:
+    return {"user_id": reservation.user_id} if reservation.user_id else {"ip_hash": reservation.ip_hash}
+
+async def claim_job() -> Optional[dict]:
+    """Lease the next runnable job (queued, or running with an expired lease)"""
+    now = datetime.now(timezone.utc)
+    return await db.analysis_jobs.find_one_and_update(
+        {"$or": [
+            {"status": "queued", "available_at": {"$lte": now}},
+            {"status": "running", "lease_until": {"$lt": now}}
+        ]},
+        {
+            "$set": {
+                "status": "running",
+                "lease_id": uuid.uuid4().hex,
+                "lease_until": now + timedelta(seconds=JOB_LEASE_SECONDS),
+                "updated_at": now
+            },
+            "$inc": {"attempts": 1}
+        },
+        sort=[("available_at", 1)],
+        return_document=ReturnDocument.AFTER
+    )
+
+async def renew_job_lease(job: dict):
+    """Keep extending the lease while the job is being processed"""
+    while True:
+        await asyncio.sleep(JOB_LEASE_SECONDS / 3)
+        try:
+            await db.analysis_jobs.update_one(
+                {"job_id": job["job_id"], "lease_id": job["lease_id"]},
+                {"$set": {"lease_until": datetime.now(timezone.utc) + timedelta(seconds=JOB_LEASE_SECONDS)}}
             )
+        except Exception as e:
+            # Two more renewals are due before the lease runs out
+            logging.warning(f"Lease renewal for job {job['job_id']} failed: {str(e)}")
+
+async def process_job(job: dict):
+    """Run one leased job, then mark it done, re-queue it for retry or fail it"""
+    owner = job["owner"]
+    reservation = CreditReservation(job["remaining_credits"], user_id=owner.get("user_id"), ip_hash=owner.get("ip_hash"))
+    lease_filter = {"job_id": job["job_id"], "lease_id": job["lease_id"]}
+    heartbeat = asyncio.create_task(renew_job_lease(job))
+    
+    try:
+        if job["attempts"] > JOB_MAX_ATTEMPTS:
+            raise AnalysisError("Analiz yapılamadı. Lütfen tekrar deneyin.")
+        
+        result = await get_property_analysis(PropertyAnalysisRequest(**job["request"]))
+        await reservation.commit(result, analysis_id=job["job_id"])
+        
+        now = datetime.now(timezone.utc)
+        await db.analysis_jobs.update_one(lease_filter, {"$set": {
+            "status": "done",
+            "result": {
+                "analysis": result["analysis"],
+                "search_query": result["search_query"],
+                "remaining_credits": reservation.remaining_credits
+            },
+            "error": None,
+            "updated_at": now,
+            "finished_at": now
+        }})
+        logging.info(f"✓ Analysis job {job['job_id']} done (attempt {job['attempts']})")
     
-    except HTTPException:
-        raise
     except Exception as e:
-        logging.error(f"Analysis error: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Analiz hatası: {str(e)}")
+        now = datetime.now(timezone.utc)
+        error = str(e) if isinstance(e, AnalysisError) else f"Analiz hatası: {str(e)}"
+        
+        if job["attempts"] < JOB_MAX_ATTEMPTS:
+            delay = JOB_RETRY_BACKOFF_SECONDS * 2 ** (job["attempts"] - 1)
+            logging.warning(f"⚠ Analysis job {job['job_id']} attempt {job['attempts']} failed: {error}. Retrying in {delay:.0f}s")
+            await db.analysis_jobs.update_one(lease_filter, {"$set": {
+                "status": "queued",
+                "available_at": now + timedelta(seconds=delay),
+                "error": error,
+                "updated_at": now
+            }})
+        else:
+            logging.error(f"❌ Analysis job {job['job_id']} failed: {error}")
+            updated = await db.analysis_jobs.update_one(lease_filter, {"$set": {
+                "status": "failed",
+                "error": error,
+                "updated_at": now,
+                "finished_at": now
+            }})
+            if updated.modified_count:
+                await reservation.refund()
+    
+    finally:
+        heartbeat.cancel()
+
+async def analysis_worker(worker_id: int):
+    """Drain the analysis job queue until cancelled"""
+    logging.info(f"Analysis worker {worker_id} started")
+    while True:
+        try:
+            job = await claim_job()
+        except Exception as e:
+            logging.error(f"Analysis worker {worker_id} could not claim a job: {str(e)}")
+            job = None
+        
+        if job is None:
+            job_wakeup.clear()
+            try:
+                await asyncio.wait_for(job_wakeup.wait(), timeout=JOB_POLL_INTERVAL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            continue
+        
+        try:
+            await process_job(job)
+        except Exception as e:
+            # The job is retried by another worker once its lease expires
+            logging.error(f"❌ Analysis worker {worker_id} failed on job {job['job_id']}: {str(e)}", exc_info=True)
+
+@api_router.post("/analyses", status_code=202)
+async def create_analysis_job(request_data: PropertyAnalysisRequest, request: Request, session_token: Optional[str] = Cookie(None)):
+    """Queue a property analysis and return its job id immediately"""
+    user = await get_current_user(request, session_token)
+    await enforce_rate_limit(request, user)
+    reservation = await reserve_credit(request, user)
+    
+    now = datetime.now(timezone.utc)
+    job_id = f"job_{uuid.uuid4().hex}"
+    try:
+        await db.analysis_jobs.insert_one({
+            "job_id": job_id,
+            "status": "queued",
+            "request": request_data.model_dump(),
+            "owner": job_owner(reservation),
+            "remaining_credits": reservation.remaining_credits,
+            "attempts": 0,
+            "available_at": now,
+            "created_at": now,
+            "updated_at": now
+        })
+    except Exception:
+        await reservation.refund()
+        raise
+    
+    job_wakeup.set()
+    return {
+        "job_id": job_id,
+        "status": "queued",
+        "status_url": f"/api/analyses/jobs/{job_id}",
+        "remaining_credits": reservation.remaining_credits
+    }
+
+# Analysis history
+def encode_history_cursor(doc: dict) -> str:
+    raw = json.dumps({"t": doc["timestamp"], "id": str(doc["_id"])})
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_history_cursor(cursor: str) -> dict:
+    try:
+        raw = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return {"timestamp": raw["t"], "_id": ObjectId(raw["id"])}
+    except Exception:
+        raise HTTPException(status_code=400, detail="Geçersiz sayfa imleci")
+
+def analysis_summary(doc: dict) -> dict:
+    return {
+        "analysis_id": doc.get("analysis_id") or str(doc["_id"]),
+        "property_info": doc.get("property_info"),
+        "search_query": doc.get("search_query"),
+        "cached": doc.get("cached", False),
+        "timestamp": doc.get("timestamp")
+    }
+
+@api_router.get("/analyses")
+async def list_analyses(request: Request, cursor: Optional[str] = None, limit: int = HISTORY_DEFAULT_LIMIT, session_token: Optional[str] = Cookie(None)):
+    """List the user's past analyses, newest first (keyset pagination, summaries only)"""
+    user = await get_current_user(request, session_token)
+    if not user:
+        raise HTTPException(status_code=401, detail="Giriş yapmalısınız")
+    
+    limit = max(1, min(limit, HISTORY_MAX_LIMIT))
+    query = {"user_id": user['user_id']}
+    if cursor:
+        after = decode_history_cursor(cursor)
+        query["$or"] = [
+            {"timestamp": {"$lt": after["timestamp"]}},
+            {"timestamp": after["timestamp"], "_id": {"$lt": after["_id"]}}
+        ]
+    
+    # Fetch one extra document to know whether another page exists
+    docs = await db.analyses.find(query, HISTORY_SUMMARY_FIELDS).sort(
+        [("timestamp", -1), ("_id", -1)]
+    ).limit(limit + 1).to_list(limit + 1)
+    
+    has_more = len(docs) > limit
+    docs = docs[:limit]
+    return ORJSONResponse({
+        "items": [analysis_summary(doc) for doc in docs],
+        "next_cursor": encode_history_cursor(docs[-1]) if has_more else None
+    })
+
+@api_router.get("/analyses/jobs/{job_id}")
+async def get_analysis_job(job_id: str, request: Request, session_token: Optional[str] = Cookie(None)):
+    """Status of a queued analysis job; the same fields in every state, `result` is set once done"""
+    user = await get_current_user(request, session_token)
+    owner = {"user_id": user['user_id']} if user else {"ip_hash": hash_ip(get_client_ip(request))}
+    
+    job = await db.analysis_jobs.find_one({"job_id": job_id, "owner": owner}, {"_id": 0, **JOB_STATUS_FIELDS})
+    if not job:
+        raise HTTPException(status_code=404, detail="Analiz bulunamadı")
+    return ORJSONResponse({field: job.get(field) for field in JOB_STATUS_FIELDS})
+
+@api_router.get("/analyses/{analysis_id}")
+async def get_analysis(analysis_id: str, request: Request, session_token: Optional[str] = Cookie(None)):
+    """Get a past analysis from the user's history with its full text"""
+    user = await get_current_user(request, session_token)
+    if not user:
+        raise HTTPException(status_code=401, detail="Giriş yapmalısınız")
+    
+    id_filter = {"analysis_id": analysis_id}
+    if ObjectId.is_valid(analysis_id):
+        # Older records have no analysis_id and are listed by their _id
+        id_filter = {"$or": [id_filter, {"_id": ObjectId(analysis_id)}]}
+    
+    doc = await db.analyses.find_one({"user_id": user['user_id'], **id_filter})
+    if not doc:
+        raise HTTPException(status_code=404, detail="Analiz bulunamadı")
+    
+    analysis = doc.get("analysis")
+    if analysis is None and doc.get("analysis_hash"):
+        analysis = await load_analysis_body(doc["analysis_hash"])
+    return ORJSONResponse({**analysis_summary(doc), "analysis": analysis, "zoning": doc.get("zoning")})
+
+def zoning_scope(il: Optional[str], ilce: Optional[str], mahalle: Optional[str]) -> dict:
+    """Filter on the canonical location; the parcel_zoning index needs il before ilce before mahalle"""
+    if (ilce and not il) or (mahalle and not ilce):
+        raise HTTPException(status_code=400, detail="İlçe için il, mahalle için ilçe belirtilmelidir")
+    location = canonical_parcel(il or "", ilce or "", mahalle or "", "", "")
+    return {f"parcel.{field}": location[field] for field in ("il", "ilce", "mahalle") if location[field]}
+
+def zoning_range_filter(query_params) -> dict:
+    """`<attribute>_min` / `<attribute>_max` query parameters as Mongo range conditions"""
+    conditions = {}
+    for field in ZONING_FIELDS:
+        bounds = {}
+        for suffix, operator in (("min", "$gte"), ("max", "$lte")):
+            raw = query_params.get(f"{field}_{suffix}")
+            if raw is None:
+                continue
+            try:
+                bounds[operator] = float(raw.replace(",", "."))
+            except ValueError:
+                raise HTTPException(status_code=400, detail=f"Geçersiz değer: {field}_{suffix}")
+        if bounds:
+            conditions[f"zoning.{field}"] = bounds
+    return conditions
+
+mongo_server_version: Optional[tuple] = None
+
+async def mongo_supports_median() -> bool:
+    """$median/$percentile accumulators exist from MongoDB 7.0"""
+    global mongo_server_version
+    if mongo_server_version is None:
+        try:
+            mongo_server_version = tuple((await db.command("buildInfo"))["versionArray"][:2])
+        except Exception:
+            mongo_server_version = (0, 0)
+    return mongo_server_version >= (7, 0)
+
+def zoning_summary(stats: Optional[dict]) -> dict:
+    if not stats or not stats.get("count"):
+        return {"count": 0}
+    return {
+        "count": stats["count"],
+        "min": stats["min"],
+        "median": stats["median"],
+        "mean": round(stats["mean"], 3),
+        "max": stats["max"]
+    }
+
+async def zoning_stats_with_median(scope: dict) -> tuple:
+    """One $group over the area; $median is approximate (t-digest) but needs no sort"""
+    group = {"_id": None, "parcels": {"$sum": 1}}
+    for field in ZONING_FIELDS:
+        value = f"$zoning.{field}"
+        group[f"{field}__count"] = {"$sum": {"$cond": [{"$isNumber": value}, 1, 0]}}
+        group[f"{field}__min"] = {"$min": value}
+        group[f"{field}__max"] = {"$max": value}
+        group[f"{field}__mean"] = {"$avg": value}
+        group[f"{field}__median"] = {"$median": {"input": value, "method": "approximate"}}
+    
+    docs = await db.parcel_zoning.aggregate([{"$match": scope}, {"$group": group}]).to_list(1)
+    totals = docs[0] if docs else {"parcels": 0}
+    attributes = {
+        field: {stat: totals.get(f"{field}__{stat}") for stat in ("count", "min", "max", "mean", "median")}
+        for field in ZONING_FIELDS
+    }
+    return totals["parcels"], attributes
+
+async def zoning_attribute_stats_sorted(scope: dict, field: str) -> Optional[dict]:
+    """Exact median before MongoDB 7: index-ordered values grouped into one array, middle element(s) averaged"""
+    values = "$values"
+    last = {"$subtract": [{"$size": values}, 1]}
+    docs = await db.parcel_zoning.aggregate([
+        {"$match": {**scope, f"zoning.{field}": {"$type": "number"}}},
+        {"$sort": {f"zoning.{field}": 1}},
+        {"$group": {"_id": None, "values": {"$push": f"$zoning.{field}"}, "mean": {"$avg": f"$zoning.{field}"}}},
+        {"$project": {
+            "_id": 0,
+            "count": {"$size": values},
+            "min": {"$arrayElemAt": [values, 0]},
+            "max": {"$arrayElemAt": [values, -1]},
+            "mean": 1,
+            "median": {"$avg": [
+                {"$arrayElemAt": [values, {"$floor": {"$divide": [last, 2]}}]},
+                {"$arrayElemAt": [values, {"$ceil": {"$divide": [last, 2]}}]}
+            ]}
+        }}
+    ], allowDiskUse=True).to_list(1)
+    return docs[0] if docs else None
+
+@api_router.get("/zoning/parcels")
+async def list_parcel_zoning(
+    request: Request,
+    il: Optional[str] = None,
+    ilce: Optional[str] = None,
+    mahalle: Optional[str] = None,
+    limit: int = ZONING_DEFAULT_LIMIT,
+    session_token: Optional[str] = Cookie(None)
+):
+    """Analyzed parcels with their extracted zoning values, filtered by location and
+    attribute ranges (e.g. `?il=İstanbul&ilce=Kadıköy&emsal_min=1.5&taks_max=0.4`).
+
+    Staff only: exact ada/parsel numbers show what other customers are researching.
+    """
+    user = await get_current_user(request, session_token)
+    if not user:
+        raise HTTPException(status_code=401, detail="Giriş yapmalısınız")
+    if (user.get("email") or "").lower() not in STAFF_EMAILS:
+        raise HTTPException(status_code=403, detail="Bu işlem için yetkiniz yok")
+    
+    query = {**zoning_scope(il, ilce, mahalle), **zoning_range_filter(request.query_params)}
+    limit = max(1, min(limit, ZONING_MAX_LIMIT))
+    docs = await db.parcel_zoning.find(query, {"_id": 0, "parcel": 1, "zoning": 1, "updated_at": 1}).sort(
+        [("parcel.il", 1), ("parcel.ilce", 1), ("parcel.mahalle", 1)]
+    ).limit(limit).to_list(limit)
+    return {"items": docs}
+
+@api_router.get("/zoning/stats")
+async def zoning_stats(
+    request: Request,
+    il: Optional[str] = None,
+    ilce: Optional[str] = None,
+    mahalle: Optional[str] = None,
+    session_token: Optional[str] = Cookie(None)
+):
+    """Count, min, median, mean and max of each zoning attribute over the analyzed parcels of an area"""
+    user = await get_current_user(request, session_token)
+    if not user:
+        raise HTTPException(status_code=401, detail="Giriş yapmalısınız")
+    
+    scope = zoning_scope(il, ilce, mahalle)
+    if await mongo_supports_median():
+        parcels, attributes = await zoning_stats_with_median(scope)
+    else:
+        parcels, *stats = await asyncio.gather(
+            db.parcel_zoning.count_documents(scope),
+            *(zoning_attribute_stats_sorted(scope, field) for field in ZONING_FIELDS)
+        )
+        attributes = dict(zip(ZONING_FIELDS, stats))
+    
+    return {
+        "scope": {key.removeprefix("parcel."): value for key, value in scope.items()},
+        "parcels": parcels,
+        "attributes": {field: zoning_summary(attributes[field]) for field in ZONING_FIELDS}
+    }
 
 @api_router.get("/credits")
 async def get_credits(request: Request, session_token: Optional[str] = Cookie(None)):
@@ -492,47 +2568,23 @@ async def get_credits(request: Request, session_token: Optional[str] = Cookie(No
     user = await get_current_user(request, session_token)
     
     if user:
-        return {
+        return ORJSONResponse({
             "remaining_credits": user['credits'],
             "is_authenticated": True
-        }
+        })
     else:
         ip = get_client_ip(request)
-        session = await get_or_create_anonymous_session(ip)
-        return {
-            "remaining_credits": 5 - session['credits_used'],
+        session = await get_anonymous_session(ip)
+        return ORJSONResponse({
+            "remaining_credits": ANONYMOUS_CREDIT_LIMIT - session['credits_used'],
             "is_authenticated": False
-        }
+        })
 
 # Payment Routes
 @api_router.get("/payment/packages")
 async def get_payment_packages():
     """Get available payment packages"""
-    packages = [
-        {
-            "id": "package_20",
-            "name": "Standart Plan",
-            "credits": 20,
-            "price": 50.0,
-            "description": "Küçük projeler için"
-        },
-        {
-            "id": "package_50",
-            "name": "Pro Plan",
-            "credits": 50,
-            "price": 75.0,
-            "description": "Orta ölçekli projeler için",
-            "popular": True
-        },
-        {
-            "id": "package_100",
-            "name": "Uzman Plan",
-            "credits": 100,
-            "price": 100.0,
-            "description": "Büyük projeler için"
-        }
-    ]
-    return packages
+    return Response(content=PAYMENT_PACKAGES_JSON, media_type="application/json")
 
 @api_router.post("/payment/create")
 async def create_payment(package_id: str, request: Request, session_token: Optional[str] = Cookie(None)):
@@ -542,8 +2594,7 @@ async def create_payment(package_id: str, request: Request, session_token: Optio
         raise HTTPException(status_code=401, detail="Giriş yapmalısınız")
     
     # Get package details
-    packages_response = await get_payment_packages()
-    package = next((p for p in packages_response if p['id'] == package_id), None)
+    package = next((p for p in PAYMENT_PACKAGES if p['id'] == package_id), None)
     
     if not package:
         raise HTTPException(status_code=404, detail="Paket bulunamadı")
@@ -557,19 +2608,77 @@ async def create_payment(package_id: str, request: Request, session_token: Optio
         "package": package
     }
 
+def package_for_price(price: float) -> tuple:
+    """Determine package and credits from the paid amount"""
+    if 48 <= price <= 52:  # 50 TL
+        return "package_20", 20
+    if 73 <= price <= 77:  # 75 TL
+        return "package_50", 50
+    if 98 <= price <= 102:  # 100 TL
+        return "package_100", 100
+    return None, 0
+
+async def apply_payment(order_id: str):
+    """Grant the credits of a claimed (pending) payment.
+
+    The user update only applies if the order isn't in the user's
+    applied_orders yet, so running this twice for an order (background
+    task racing the sweeper, or a crash between the two writes) is harmless.
+    """
+    payment = await db.payments.find_one({"order_id": order_id, "status": "pending"}, {"_id": 0})
+    if not payment:
+        return
+    
+    user_doc = await db.users.find_one({"email": payment["buyer_email"]}, {"_id": 0, "user_id": 1})
+    if not user_doc:
+        logging.warning(f"User not found with email: {payment['buyer_email']}")
+        await db.payments.update_one({"order_id": order_id}, {"$set": {"status": "unmatched"}})
+        return
+    
+    user_id = user_doc['user_id']
+    result = await db.users.update_one(
+        {"user_id": user_id, "applied_orders": {"$ne": order_id}},
+        {
+            "$inc": {"credits": payment["credits"]},
+            "$push": {"applied_orders": {"$each": [order_id], "$slice": -PAYMENT_APPLIED_ORDERS_KEPT}}
+        }
+    )
+    invalidate_user_cache(user_id)
+    
+    await db.payments.update_one(
+        {"order_id": order_id},
+        {"$set": {"status": "completed", "user_id": user_id, "completed_at": datetime.now(timezone.utc)}}
+    )
+    
+    if result.modified_count:
+        logging.info(f"✓✓✓ SUCCESS! User {user_id} ({payment['buyer_email']}) received {payment['credits']} credits for order {order_id}")
+    else:
+        logging.info(f"Order {order_id} credits were already applied to {user_id}")
+
+async def sweep_pending_payments():
+    """Apply payments whose background task never ran (e.g. the worker restarted)"""
+    while True:
+        try:
+            stale = datetime.now(timezone.utc) - timedelta(seconds=PAYMENT_SWEEP_INTERVAL_SECONDS)
+            async for payment in db.payments.find({"status": "pending", "created_at": {"$lt": stale}}, {"order_id": 1}):
+                await apply_payment(payment["order_id"])
+        except Exception as e:
+            logging.error(f"❌ Pending payment sweep failed: {str(e)}")
+        await asyncio.sleep(PAYMENT_SWEEP_INTERVAL_SECONDS)
+
 @api_router.post("/payment/webhook")
-async def payment_webhook(request: Request):
-    """Handle Shopier OSB (Otomatik Sipariş Bildirimi) webhook"""
+async def payment_webhook(request: Request, background_tasks: BackgroundTasks):
+    """Handle Shopier OSB (Otomatik Sipariş Bildirimi) webhook.
+
+    The order is claimed with a single insert on the unique order_id (so
+    retried deliveries are no-ops), Shopier gets its "success" right away
+    and the credits are granted after the response by apply_payment.
+    """
     try:
-        # Shopier OSB credentials
-        OSB_USERNAME = "778002c5c84cec73b28e5dc61252b7c7"
-        OSB_KEY = "8464992188fb72b30d314d7087bf1538"
-        
         # Get form data (Shopier sends as form-encoded)
         form_data = await request.form()
         
         logging.info(f"=== SHOPIER OSB WEBHOOK RECEIVED ===")
-        logging.info(f"Form data keys: {list(form_data.keys())}")
         
         # Check required parameters
         if 'res' not in form_data or 'hash' not in form_data:
@@ -580,106 +2689,58 @@ async def payment_webhook(request: Request):
         received_hash = form_data['hash']
         
         # Verify hash (HMAC-SHA256)
-        import base64
         calculated_hash = hmac.new(
-            OSB_KEY.encode(),
-            (res + OSB_USERNAME).encode(),
+            SHOPIER_OSB_KEY.encode(),
+            (res + SHOPIER_OSB_USERNAME).encode(),
             hashlib.sha256
         ).hexdigest()
         
-        if calculated_hash != received_hash:
+        if not hmac.compare_digest(calculated_hash, received_hash):
             logging.error(f"Hash mismatch! Calculated: {calculated_hash}, Received: {received_hash}")
             return {"status": "error", "message": "invalid hash"}
         
         # Decode base64 JSON
-        json_data = base64.b64decode(res).decode('utf-8')
-        data = json.loads(json_data)
-        
-        logging.info(f"Decoded order data: {json.dumps(data, indent=2, ensure_ascii=False)}")
+        data = json.loads(base64.b64decode(res).decode('utf-8'))
         
         # Extract order information
         email = data.get('email')
         orderid = data.get('orderid')
         price = float(data.get('price', 0))
-        buyername = data.get('buyername')
-        buyersurname = data.get('buyersurname')
         istest = data.get('istest', 0)
-        currency = data.get('currency', 0)  # 0=TL, 1=USD, 2=EUR
         
         logging.info(f"Order: {orderid}, Email: {email}, Price: {price} TL, Test: {istest}")
         
-        # Skip test orders in production
-        if istest == 1:
-            logging.info("Test order - processing anyway for development")
-        
-        # Check if order already processed
-        existing_payment = await db.payments.find_one({"order_id": orderid}, {"_id": 0})
-        if existing_payment:
-            logging.warning(f"Order already processed: {orderid}")
-            return Response(content="success", media_type="text/plain")
-        
-        # Find user by email
         if not email:
             logging.error("No email in order data")
             return Response(content="success", media_type="text/plain")
         
-        user_doc = await db.users.find_one({"email": email}, {"_id": 0})
-        if not user_doc:
-            logging.warning(f"User not found with email: {email}")
+        package_id, credits_to_add = package_for_price(price)
+        if not credits_to_add:
+            logging.warning(f"Unknown package amount: {price}")
             return Response(content="success", media_type="text/plain")
         
-        user_id = user_doc['user_id']
-        logging.info(f"Found user: {user_id}")
-        
-        # Determine package and credits from price
-        credits_to_add = 0
-        package_id = None
-        
-        if 48 <= price <= 52:  # 50 TL
-            credits_to_add = 20
-            package_id = "package_20"
-        elif 73 <= price <= 77:  # 75 TL
-            credits_to_add = 50
-            package_id = "package_50"
-        elif 98 <= price <= 102:  # 100 TL
-            credits_to_add = 100
-            package_id = "package_100"
-        
-        logging.info(f"Package: {package_id}, Credits to add: {credits_to_add}")
-        
-        if credits_to_add > 0:
-            # Add credits to user
-            result = await db.users.update_one(
-                {"user_id": user_id},
-                {"$inc": {"credits": credits_to_add}}
-            )
-            
-            logging.info(f"Credits update: {result.modified_count} user(s) updated")
-            
-            # Save payment record
+        # Claim the order; a duplicate key means it was already received
+        try:
             await db.payments.insert_one({
-                "user_id": user_id,
                 "package_id": package_id,
                 "credits": credits_to_add,
                 "amount": price,
-                "status": "completed",
+                "status": "pending",
                 "order_id": orderid,
                 "buyer_email": email,
-                "buyer_name": f"{buyername} {buyersurname}",
+                "buyer_name": f"{data.get('buyername')} {data.get('buyersurname')}",
                 "is_test": istest,
                 "shopier_data": data,
-                "created_at": datetime.now(timezone.utc).isoformat()
+                "created_at": datetime.now(timezone.utc)
             })
-            
-            # Verify credits
-            updated_user = await db.users.find_one({"user_id": user_id}, {"_id": 0, "credits": 1})
-            logging.info(f"✓✓✓ SUCCESS! User {user_id} ({email}) now has {updated_user.get('credits', 0)} credits")
-            
-            # Shopier expects "success" response
-            return Response(content="success", media_type="text/plain")
-        else:
-            logging.warning(f"Unknown package amount: {price}")
+        except DuplicateKeyError:
+            logging.warning(f"Order already processed: {orderid}")
             return Response(content="success", media_type="text/plain")
+        
+        background_tasks.add_task(apply_payment, orderid)
+        
+        # Shopier expects "success" response
+        return Response(content="success", media_type="text/plain")
     
     except Exception as e:
         logging.error(f"❌ SHOPIER OSB ERROR: {str(e)}", exc_info=True)
@@ -689,9 +2750,335 @@ async def payment_webhook(request: Request):
 async def root():
     return {"message": "parseldeğer.com API"}
 
+@api_router.get("/ready")
+async def ready(request: Request):
+    """Readiness probe: 200 once the credit indexes exist and Mongo and the upstream pools are warm, 503 before"""
+    resources = request.app.state.resources
+    return JSONResponse(
+        status_code=200 if resources.ready else 503,
+        content={"ready": resources.ready, "resources": resources.status}
+    )
+
+class ResourceRegistry:
+    """Process-wide resources owned by the app lifespan.
+
+    Tracks the warm-up state of each resource for /api/ready. On shutdown
+    background tasks are cancelled first, then close callbacks run in
+    reverse registration order.
+    """
+
+    def __init__(self):
+        self.status: Dict[str, str] = {}
+        self.required = set()
+        self._tasks: List[asyncio.Task] = []
+        self._closers: List[tuple] = []
+
+    @property
+    def ready(self) -> bool:
+        """Every required resource is warm and no warm-up is still running"""
+        return (all(self.status[name] == "ready" for name in self.required)
+                and "pending" not in self.status.values())
+
+    def spawn(self, coro: Awaitable) -> asyncio.Task:
+        task = asyncio.create_task(coro)
+        self._tasks.append(task)
+        return task
+
+    def on_close(self, name: str, close: Callable[[], Awaitable]):
+        self._closers.append((name, close))
+
+    def warm(self, name: str, warmup: Callable[[], Awaitable], required: bool = False,
+             timeout: Optional[float] = WARMUP_TIMEOUT_SECONDS):
+        """Run a warm-up in the background; required ones are retried until they succeed"""
+        self.status[name] = "pending"
+        if required:
+            self.required.add(name)
+        self.spawn(self._warm(name, warmup, required, timeout))
+
+    async def _warm(self, name: str, warmup: Callable[[], Awaitable], required: bool, timeout: Optional[float]):
+        attempt = 0
+        while True:
+            started = time.perf_counter()
+            try:
+                await asyncio.wait_for(warmup(), timeout)
+                self.status[name] = "ready"
+                logging.info(f"🔥 {name} warmed up in {time.perf_counter() - started:.2f}s")
+                return
+            except Exception as e:
+                logging.warning(f"⚠ {name} warm-up failed: {str(e) or type(e).__name__}")
+                if not required:
+                    # Optional upstreams degrade gracefully (circuit breakers, retries)
+                    self.status[name] = "failed"
+                    return
+                attempt += 1
+                await asyncio.sleep(min(2 ** attempt, 30))
+
+    async def aclose(self):
+        for task in self._tasks:
+            task.cancel()
+        # Interrupted jobs are picked up again once their lease expires
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        for name, close in reversed(self._closers):
+            try:
+                await close()
+            except Exception as e:
+                logging.warning(f"Closing {name} failed: {str(e)}")
+
+async def warm_imports():
+    """Import lazily loaded modules (and google-genai) in parallel threads"""
+    await asyncio.gather(
+        *(asyncio.to_thread(importlib.import_module, module) for module in WARMUP_IMPORTS),
+        asyncio.to_thread(load_genai),
+        asyncio.to_thread(gemini_generate_config)
+    )
+
+async def warm_mongo():
+    """Open MONGO_MIN_POOL_SIZE connections (DNS, TLS and auth) with concurrent pings"""
+    await asyncio.gather(*(client.admin.command("ping") for _ in range(max(1, MONGO_MIN_POOL_SIZE))))
+
+async def warm_http():
+    """Open pooled HTTP/2 connections to the upstreams; any response status will do"""
+    await asyncio.gather(*(http_client.head(url) for url in WARMUP_HTTP_URLS))
+
+async def warm_gemini():
+    """Build every key's client and open its connection with a cheap model lookup"""
+    await asyncio.gather(*(state.client.aio.models.get(model=GEMINI_MODEL) for state in gemini_key_pool.keys))
+
+async def monitor_event_loop_lag():
+    """Measure how late the event loop wakes up from a fixed sleep"""
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(EVENT_LOOP_LAG_INTERVAL_SECONDS)
+        EVENT_LOOP_LAG.set(max(0.0, loop.time() - started - EVENT_LOOP_LAG_INTERVAL_SECONDS))
+
+async def close_mongo():
+    client.close()
+
+async def close_http_client():
+    if http_client is not None:
+        await http_client.aclose()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global http_client
+    resources = app.state.resources = ResourceRegistry()
+    
+    http_client = create_http_client()
+    resources.on_close("mongo", close_mongo)
+    resources.on_close("http", close_http_client)
+    resources.on_close("gemini", gemini_key_pool.aclose)
+    
+    # Unique indexes back the credit checks; not ready until they exist
+    resources.warm("indexes", lambda: prepare_credit_indexes(db), required=True, timeout=None)
+    resources.spawn(prepare_secondary_indexes(db, resources.status))
+    if WARMUP_ENABLED:
+        resources.warm("imports", warm_imports)
+        resources.warm("mongo", warm_mongo, required=True)
+        resources.warm("http", warm_http)
+        if GEMINI_API_KEYS:
+            resources.warm("gemini", warm_gemini)
+    
+    # Data migrations can take a while on big collections; don't block serving
+    resources.spawn(bootstrap_database(db))
+    resources.spawn(monitor_event_loop_lag())
+    resources.spawn(sweep_pending_payments())
+    for worker_id in range(ANALYSIS_WORKERS):
+        resources.spawn(analysis_worker(worker_id))
+    
+    try:
+        yield
+    finally:
+        await resources.aclose()
+
+# Create the main app without a prefix
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
+
 # Include router
 app.include_router(api_router)
 
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus metrics"""
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+class RequestMetricsMiddleware:
+    """Tracks in-flight requests and latency per route (pure ASGI, safe for streaming responses)"""
+
+    def __init__(self, app):
+        self.app = app
+        self.route_paths = None
+
+    def route_label(self, path: str) -> str:
+        # Route templates keep label cardinality bounded (no ids in labels)
+        if self.route_paths is None:
+            self.route_paths = {getattr(route, "path", None) for route in app.routes}
+        if path in self.route_paths:
+            return path
+        if path.startswith("/api/analyses/jobs/"):
+            return "/api/analyses/jobs/{id}"
+        if path.startswith("/api/analyses/"):
+            return "/api/analyses/{id}"
+        return "other"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        route = self.route_label(scope["path"])
+        status = {"code": 500}
+        
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+        
+        started = time.perf_counter()
+        HTTP_IN_FLIGHT.labels(route).inc()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            HTTP_IN_FLIGHT.labels(route).dec()
+            HTTP_LATENCY.labels(route, scope["method"], str(status["code"])).observe(time.perf_counter() - started)
+
+def http_cache_policy(path: str) -> Optional[str]:
+    policy = HTTP_CACHE_POLICIES.get(path)
+    if policy is None:
+        prefix = path[:path.rfind("/") + 1]
+        policy = HTTP_CACHE_POLICIES.get(prefix) if prefix != path else None
+    return policy
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """Weak If-None-Match comparison (RFC 9110 13.1.2)"""
+    opaque = etag.removeprefix("W/")
+    return any(
+        candidate == "*" or candidate.removeprefix("W/") == opaque
+        for candidate in (value.strip() for value in if_none_match.split(","))
+    )
+
+class HTTPCacheMiddleware:
+    """ETag, Cache-Control and conditional GET for the routes in HTTP_CACHE_POLICIES.
+
+    Pure ASGI: the JSON body is buffered, hashed into a weak ETag (weak so it
+    survives response compression) and replaced by an empty 304 when the
+    client already has that representation.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        policy = http_cache_policy(scope["path"]) if scope["type"] == "http" and scope["method"] == "GET" else None
+        if policy is None:
+            await self.app(scope, receive, send)
+            return
+        
+        start = {}
+        chunks = []
+        
+        async def buffer(message):
+            if message["type"] == "http.response.start":
+                start.update(message)
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+        
+        await self.app(scope, receive, buffer)
+        body = b"".join(chunks)
+        headers = MutableHeaders(scope=start)
+        
+        if start["status"] == 200 and headers.get("content-type", "").startswith("application/json"):
+            etag = f'W/"{hashlib.sha1(body).hexdigest()[:20]}"'
+            headers["ETag"] = etag
+            headers["Cache-Control"] = policy
+            if policy.startswith("private"):
+                headers.append("Vary", "Cookie")
+            
+            if_none_match = Headers(scope=scope).get("if-none-match")
+            if if_none_match and etag_matches(if_none_match, etag):
+                start["status"] = 304
+                del headers["content-length"]
+                del headers["content-type"]
+                body = b""
+        
+        await send(start)
+        await send({"type": "http.response.body", "body": body})
+
+def negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    """Pick br over gzip from an Accept-Encoding header (q=0 excludes a coding)"""
+    accepted = set()
+    for item in accept_encoding.lower().split(","):
+        coding, _, params = item.strip().partition(";")
+        if params.strip().replace(" ", "") not in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            accepted.add(coding.strip())
+    for coding in ("br", "gzip"):
+        if coding in accepted:
+            return coding
+    return None
+
+def compress_body(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, mode=brotli.MODE_TEXT, quality=COMPRESSION_BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=COMPRESSION_GZIP_LEVEL)
+
+class CompressionMiddleware:
+    """Brotli/gzip compression of complete response bodies of at least COMPRESSION_MIN_SIZE bytes.
+
+    Pure ASGI like the other middlewares; SSE and NDJSON streams pass
+    through untouched so each event still reaches the client immediately.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        encoding = None
+        if scope["type"] == "http":
+            encoding = negotiate_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        
+        start = {}
+        chunks = []
+        passthrough = False
+        
+        async def compress_response(message):
+            nonlocal passthrough
+            if message["type"] == "http.response.start":
+                headers = Headers(raw=message["headers"])
+                media_type = headers.get("content-type", "").split(";")[0].strip()
+                if media_type in UNCOMPRESSED_MEDIA_TYPES or "content-encoding" in headers:
+                    passthrough = True
+                    await send(message)
+                else:
+                    start.update(message)
+                return
+            
+            if passthrough or message["type"] != "http.response.body":
+                await send(message)
+                return
+            
+            chunks.append(message.get("body", b""))
+            if message.get("more_body", False):
+                return
+            
+            body = b"".join(chunks)
+            headers = MutableHeaders(scope=start)
+            if len(body) >= COMPRESSION_MIN_SIZE:
+                body = compress_body(body, encoding)
+                headers["Content-Encoding"] = encoding
+                headers["Content-Length"] = str(len(body))
+            headers.add_vary_header("Accept-Encoding")
+            await send(start)
+            await send({"type": "http.response.body", "body": body})
+        
+        await self.app(scope, receive, compress_response)
+
+app.add_middleware(HTTPCacheMiddleware)
+app.add_middleware(CompressionMiddleware)
+app.add_middleware(RequestMetricsMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -706,6 +3093,25 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+async def run_index_cli(report: bool):
+    print(json.dumps({"migrated": await migrate_datetime_fields(db)}, indent=2))
+    print(json.dumps({"anonymous_analyses_moved": await migrate_anonymous_analyses(db)}, indent=2))
+    print(json.dumps({"analysis_bodies_moved": await migrate_analysis_bodies(db)}, indent=2))
+    print(json.dumps({"parcels_rekeyed": await migrate_parcel_identity(db)}, indent=2))
+    print(json.dumps({"zoning_extracted": await migrate_zoning_attributes(db)}, indent=2))
+    print(json.dumps({"duplicate_anonymous_sessions_removed": await dedupe_anonymous_sessions(db)}, indent=2))
+    print(json.dumps({"indexes": await ensure_indexes(db)}, indent=2, default=str))
+    if report:
+        print(json.dumps({"usage": await index_usage_report(db)}, indent=2))
+    client.close()
+
+if __name__ == "__main__":
+    # python server.py indexes [--report]
+    parser = argparse.ArgumentParser(description="parseldeğer.com backend maintenance")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    indexes_parser = subcommands.add_parser("indexes", help="Migrate TTL fields and create Mongo indexes")
+    indexes_parser.add_argument("--report", action="store_true", help="Also print index usage statistics")
+    args = parser.parse_args()
+    
+    if args.command == "indexes":
+        asyncio.run(run_index_cli(args.report))
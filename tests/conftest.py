@@ -0,0 +1,45 @@
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+# server.py reads its configuration at import time; the Mongo client connects lazily,
+# so the pure helpers can be tested without a database
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "parseldeger_test")
+os.environ.setdefault("WARMUP_ENABLED", "false")
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+
+class FakeClock:
+    """Stands in for time.time / time.monotonic"""
+
+    def __init__(self, now: float):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock():
+    """Injected into the limiters and circuit breakers; starts at the beginning of a 60s window"""
+    return FakeClock(60_000.0)
+
+
+@pytest.fixture
+def mongo(monkeypatch):
+    """server.db backed by mongomock-motor, with the in-memory caches of it emptied"""
+    import server
+    from mongomock_motor import AsyncMongoMockClient
+
+    database = AsyncMongoMockClient()["parseldeger_test"]
+    monkeypatch.setattr(server, "db", database)
+    server.analysis_memory_cache.clear()
+    server.analysis_body_cache.clear()
+    return database
@@ -0,0 +1,100 @@
+import asyncio
+import json
+
+import pytest
+
+import server
+from server import AnalysisError
+
+ROWS = [
+    {"il": "İstanbul", "ilce": "Kadıköy", "mahalle": "Moda", "ada": "101", "parsel": "7"},
+    {"il": "İSTANBUL", "ilce": "KADIKÖY", "mahalle": "Moda Mah.", "ada": "101", "parsel": "007"},
+    {"il": "İstanbul", "ilce": "Kadıköy", "mahalle": "Moda", "ada": "101", "parsel": "8"},
+    {"il": "İstanbul", "ilce": "Kadıköy", "mahalle": "Moda", "ada": "102", "parsel": "1"},
+]
+
+
+@pytest.fixture
+def bulk(monkeypatch, mongo):
+    """A user with 5 credits; parcel 8 fails and parcels listed in `slow` never finish"""
+    slow = set()
+
+    async def get_property_analysis(request_data):
+        if request_data.parsel in slow:
+            await asyncio.Event().wait()
+        if request_data.parsel == "8":
+            raise AnalysisError("Gemini hatası")
+        return {
+            "parcel": server.request_parcel(request_data),
+            "property_info": server.build_property_info(request_data),
+            "search_query": f"parsel {request_data.parsel}",
+            "analysis": "KAK: 1.50",
+            "prompt_tokens": 42,
+            "zoning": {"kak": 1.5},
+            "cached": False
+        }
+
+    async def current_user(request, session_token=None):
+        return {"user_id": "u1"}
+
+    async def no_rate_limit(request, user):
+        return None
+
+    monkeypatch.setattr(server, "get_property_analysis", get_property_analysis)
+    monkeypatch.setattr(server, "get_current_user", current_user)
+    monkeypatch.setattr(server, "enforce_rate_limit", no_rate_limit)
+    asyncio.run(mongo.users.insert_one({"user_id": "u1", "email": "a@example.com", "credits": 5}))
+    return slow
+
+
+def bulk_request(rows):
+    body = json.dumps(rows).encode()
+
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    scope = {"type": "http", "method": "POST", "query_string": b"", "headers": [(b"content-type", b"application/json")]}
+    return server.Request(scope, receive)
+
+
+async def credits():
+    return (await server.db.users.find_one({"user_id": "u1"}))["credits"]
+
+
+def test_failed_parcels_are_refunded(bulk):
+    async def run():
+        response = await server.analyze_property_bulk(bulk_request(ROWS))
+        lines = [json.loads(line) async for line in response.body_iterator]
+        return lines, await credits()
+
+    lines, balance = asyncio.run(run())
+    summary = lines.pop()
+    assert summary == {"status": "summary", "parcels": 3, "succeeded": 2, "failed": 1, "remaining_credits": 3}
+    assert sorted((line["parsel"], line["status"]) for line in lines) == [("1", "ok"), ("7", "ok"), ("8", "error")]
+    assert next(line["rows"] for line in lines if line["parsel"] == "7") == [0, 1]
+    assert balance == 3
+
+
+def test_unfinished_parcels_are_refunded_on_disconnect(bulk):
+    bulk.add("1")
+
+    async def run():
+        response = await server.analyze_property_bulk(bulk_request(ROWS))
+        stream = response.body_iterator
+        first = [await stream.__anext__(), await stream.__anext__()]
+        during = await credits()
+        await stream.aclose()  # the client went away
+        return first, during, await credits()
+
+    first, during, after = asyncio.run(run())
+    assert {json.loads(line)["parsel"] for line in first} == {"7", "8"}
+    assert during == 2
+    assert after == 4
+
+
+def test_batch_without_enough_credits_charges_nothing(bulk):
+    rows = [{**ROWS[0], "parsel": str(parsel)} for parsel in range(10, 16)]
+    with pytest.raises(server.HTTPException) as rejected:
+        asyncio.run(server.analyze_property_bulk(bulk_request(rows)))
+    assert rejected.value.status_code == 403
+    assert asyncio.run(credits()) == 5
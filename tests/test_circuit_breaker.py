@@ -0,0 +1,108 @@
+import asyncio
+
+import httpx
+import pytest
+
+import server
+from server import CircuitBreaker, LatencyTracker
+
+
+def test_circuit_opens_after_consecutive_failures(clock):
+    breaker = CircuitBreaker("test", clock=clock)
+    for _ in range(server.CIRCUIT_FAILURE_THRESHOLD - 1):
+        assert breaker.allow()
+        breaker.record(True)
+    assert breaker.state == "closed"
+
+    breaker.record(True)
+    assert breaker.state == "open"
+    assert not breaker.allow()
+
+
+def test_circuit_success_resets_the_failure_count(clock):
+    breaker = CircuitBreaker("test", clock=clock)
+    for _ in range(server.CIRCUIT_FAILURE_THRESHOLD - 1):
+        breaker.record(True)
+    breaker.record(False)
+    breaker.record(True)
+    assert breaker.state == "closed"
+
+
+def test_circuit_ignores_outcomes_without_health_signal(clock):
+    breaker = CircuitBreaker("test", clock=clock)
+    for _ in range(server.CIRCUIT_FAILURE_THRESHOLD * 2):
+        breaker.record(None)
+    assert breaker.state == "closed"
+
+
+def test_circuit_half_open_lets_one_probe_through(clock):
+    breaker = CircuitBreaker("test", clock=clock)
+    for _ in range(server.CIRCUIT_FAILURE_THRESHOLD):
+        breaker.record(True)
+
+    clock.advance(server.CIRCUIT_RECOVERY_SECONDS)
+    assert breaker.allow()
+    assert breaker.state == "half_open"
+    assert not breaker.allow()
+
+    breaker.record(False)
+    assert breaker.state == "closed"
+    assert breaker.allow()
+
+
+def test_circuit_failed_probe_reopens(clock):
+    breaker = CircuitBreaker("test", clock=clock)
+    for _ in range(server.CIRCUIT_FAILURE_THRESHOLD):
+        breaker.record(True)
+
+    clock.advance(server.CIRCUIT_RECOVERY_SECONDS)
+    assert breaker.allow()
+    breaker.record(True)
+    assert breaker.state == "open"
+    assert not breaker.allow()
+
+    clock.advance(server.CIRCUIT_RECOVERY_SECONDS)
+    assert breaker.allow()
+
+
+def test_circuit_check_raises_when_open(clock):
+    breaker = CircuitBreaker("test", clock=clock)
+    for _ in range(server.CIRCUIT_FAILURE_THRESHOLD):
+        breaker.record(True)
+    with pytest.raises(server.CircuitOpenError):
+        breaker.check()
+
+
+def test_brave_timeout_recovers_when_brave_settles_above_it(monkeypatch, clock):
+    """Timeouts count as samples and the half-open probe gets the full timeout"""
+    brave_latency = LatencyTracker()
+    for _ in range(200):
+        brave_latency.observe(0.3)
+    monkeypatch.setattr(server, "brave_latency", brave_latency)
+    monkeypatch.setattr(server, "brave_breaker", CircuitBreaker("brave", clock=clock))
+    assert server.brave_timeout() == server.BRAVE_TIMEOUT_MIN_SECONDS
+
+    # Brave now answers in 2.5s: any shorter timeout expires first
+    def brave(request):
+        if request.extensions["timeout"]["read"] < 2.5:
+            raise httpx.ReadTimeout("timed out", request=request)
+        return httpx.Response(200, json={"web": {"results": [{"url": "https://x.example"}]}})
+
+    async def run():
+        server.http_client = httpx.AsyncClient(transport=httpx.MockTransport(brave))
+        outcomes = []
+        for _ in range(server.CIRCUIT_FAILURE_THRESHOLD + 2):
+            try:
+                outcomes.append(len(await server.brave_request({"q": "moda"})))
+            except Exception as e:
+                outcomes.append(type(e).__name__)
+            clock.advance(server.CIRCUIT_RECOVERY_SECONDS)
+        await server.http_client.aclose()
+        return outcomes
+
+    monkeypatch.setattr(server, "http_client", None)
+    monkeypatch.setattr(server, "BRAVE_API_KEY", "test")
+    outcomes = asyncio.run(run())
+    assert outcomes[-1] == 1
+    assert server.brave_breaker.state == "closed"
+    assert server.brave_timeout() >= 2.5
@@ -0,0 +1,30 @@
+import gzip
+
+import brotli
+import pytest
+
+from server import compress_body, negotiate_encoding
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("gzip, deflate, br", "br"),
+    ("gzip", "gzip"),
+    ("GZIP", "gzip"),
+    ("br;q=0, gzip", "gzip"),
+    ("br; q=0.0, gzip;q=0.5", "gzip"),
+    ("br;q=0.1", "br"),
+    ("gzip;q=0, br;q=0", None),
+    ("identity", None),
+    ("", None),
+    ("*", None),
+])
+def test_negotiate_encoding(header, expected):
+    assert negotiate_encoding(header) == expected
+
+
+@pytest.mark.parametrize("encoding", ["br", "gzip"])
+def test_compress_body_round_trips(encoding):
+    body = ('{"analysis": "' + "İmar durumu konut alanı, KAK 1.50. " * 50 + '"}').encode()
+    compressed = compress_body(body, encoding)
+    assert len(compressed) < len(body)
+    assert (brotli.decompress if encoding == "br" else gzip.decompress)(compressed) == body
@@ -0,0 +1,95 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+import server
+
+RESULT = {
+    "parcel": {"il": "istanbul", "ilce": "kadiköy", "mahalle": "moda", "ada": "101", "parsel": "7"},
+    "property_info": "İl: İstanbul, İlçe: Kadıköy, Mahalle: Moda, Ada: 101, Parsel: 7",
+    "search_query": "moda 101 7",
+    "analysis": "KAK: 1.50",
+    "prompt_tokens": 1200,
+    "cached": False
+}
+
+
+def client_request(ip="203.0.113.7"):
+    return server.Request({"type": "http", "query_string": b"", "headers": [], "client": (ip, 443)})
+
+
+async def credits(mongo, user_id="u1"):
+    return (await mongo.users.find_one({"user_id": user_id}))["credits"]
+
+
+@pytest.fixture
+def user(mongo):
+    asyncio.run(mongo.users.insert_one({"user_id": "u1", "email": "a@example.com", "credits": 3}))
+    return {"user_id": "u1"}
+
+
+def test_reserve_then_commit_keeps_the_credit(mongo, user):
+    async def run():
+        reservation = await server.reserve_credit(client_request(), user)
+        await reservation.commit(RESULT)
+        await reservation.refund()  # settled: no-op
+        return reservation, await credits(mongo), await mongo.analyses.count_documents({"user_id": "u1"})
+
+    reservation, balance, recorded = asyncio.run(run())
+    assert reservation.remaining_credits == 2
+    assert (balance, recorded) == (2, 1)
+
+
+def test_refund_gives_the_credit_back_once(mongo, user):
+    async def run():
+        reservation = await server.reserve_credit(client_request(), user)
+        await reservation.refund()
+        await reservation.refund()
+        return reservation, await credits(mongo)
+
+    reservation, balance = asyncio.run(run())
+    assert (reservation.remaining_credits, balance) == (3, 3)
+
+
+def test_concurrent_reservations_never_overdraw(mongo, user):
+    async def run():
+        return await asyncio.gather(
+            *(server.reserve_credit(client_request(), user) for _ in range(10)),
+            return_exceptions=True
+        )
+
+    outcomes = asyncio.run(run())
+    reservations = [outcome for outcome in outcomes if isinstance(outcome, server.CreditReservation)]
+    rejected = [outcome for outcome in outcomes if isinstance(outcome, HTTPException)]
+    assert sorted(r.remaining_credits for r in reservations) == [0, 1, 2]
+    assert len(rejected) == 7 and {e.status_code for e in rejected} == {403}
+    assert asyncio.run(credits(mongo)) == 0
+
+
+def test_anonymous_sessions_stop_at_the_free_limit(mongo):
+    async def run():
+        outcomes = await asyncio.gather(
+            *(server.reserve_credit(client_request(), None) for _ in range(server.ANONYMOUS_CREDIT_LIMIT + 2)),
+            return_exceptions=True
+        )
+        sessions = await mongo.anonymous_sessions.find({}, {"_id": 0, "credits_used": 1}).to_list(None)
+        return outcomes, sessions
+
+    outcomes, sessions = asyncio.run(run())
+    assert sum(isinstance(outcome, server.CreditReservation) for outcome in outcomes) == server.ANONYMOUS_CREDIT_LIMIT
+    assert sessions == [{"credits_used": server.ANONYMOUS_CREDIT_LIMIT}]
+
+
+def test_anonymous_refund_frees_a_credit(mongo):
+    async def run():
+        for _ in range(server.ANONYMOUS_CREDIT_LIMIT):
+            last = await server.reserve_credit(client_request(), None)
+        await last.refund()
+        again = await server.reserve_credit(client_request(), None)
+        other_ip = await server.reserve_credit(client_request("198.51.100.1"), None)
+        return again, other_ip
+
+    again, other_ip = asyncio.run(run())
+    assert again.remaining_credits == 0
+    assert other_ip.remaining_credits == server.ANONYMOUS_CREDIT_LIMIT - 1
@@ -0,0 +1,85 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import server
+from server import AnalysisError, GeminiKeyPool, TokenBucket
+
+
+class FakeModels:
+    def __init__(self, error=None):
+        self.error = error
+
+    async def generate_content(self, model, contents, config=None):
+        if self.error:
+            raise self.error
+        return SimpleNamespace(text="İMAR DURUMU\nKAK: 1.50", usage_metadata=SimpleNamespace(prompt_token_count=42))
+
+
+@pytest.fixture
+def gemini(monkeypatch):
+    """A one-key pool whose clients are fakes; returns a function that rebuilds it with budgets"""
+    models = FakeModels()
+
+    def configure(rpm=0, tpm=0):
+        monkeypatch.setattr(server, "GEMINI_API_KEYS", ["key-1"])
+        monkeypatch.setattr(server, "GEMINI_KEY_RPM", rpm)
+        monkeypatch.setattr(server, "GEMINI_KEY_TPM", tpm)
+        monkeypatch.setattr(server, "GEMINI_KEY_MAX_WAIT_SECONDS", 0)
+        monkeypatch.setattr(server, "gemini_breaker", server.CircuitBreaker("gemini"))
+        pool = GeminiKeyPool(["key-1"])
+        for state in pool.keys:
+            state._client = SimpleNamespace(aio=SimpleNamespace(models=models))
+        monkeypatch.setattr(server, "gemini_key_pool", pool)
+        monkeypatch.setattr(server, "gemini_generate_config", lambda: None)
+        return models
+
+    return configure
+
+
+def test_unlimited_bucket_never_waits():
+    bucket = TokenBucket(0)
+    for _ in range(1000):
+        bucket.consume(10_000, 0.0)
+    assert bucket.wait_time(10_000, 0.0) == 0.0
+
+
+def test_bucket_refills_over_time():
+    bucket = TokenBucket(60)
+    bucket.consume(60, bucket.updated)
+    assert bucket.wait_time(1, bucket.updated) == pytest.approx(1.0)
+    assert bucket.wait_time(1, bucket.updated + 1) == 0.0
+
+
+def test_pool_is_unthrottled_by_default(gemini):
+    gemini()
+
+    async def run():
+        return [await server.analyze_with_gemini("prompt") for _ in range(50)]
+
+    assert asyncio.run(run())[-1] == ("İMAR DURUMU\nKAK: 1.50", 42)
+
+
+def test_local_budget_miss_is_not_reported_as_quota(gemini):
+    gemini(rpm=1)
+    asyncio.run(server.analyze_with_gemini("prompt"))
+
+    with pytest.raises(AnalysisError) as busy:
+        asyncio.run(server.analyze_with_gemini("prompt"))
+    assert "yoğun" in str(busy.value)
+    assert "kota" not in str(busy.value)
+
+
+def test_quota_errors_are_reported_as_quota(gemini):
+    models = gemini()
+    models.error = Exception("429 RESOURCE_EXHAUSTED: quota exceeded")
+
+    with pytest.raises(AnalysisError) as quota:
+        asyncio.run(server.analyze_with_gemini("prompt"))
+    assert "kotası doldu" in str(quota.value)
+
+    # The key is now cooling down: still a quota problem, not a local budget miss
+    with pytest.raises(AnalysisError) as cooling:
+        asyncio.run(server.analyze_with_gemini("prompt"))
+    assert "kotası doldu" in str(cooling.value)
@@ -0,0 +1,29 @@
+import pytest
+
+from server import etag_matches, http_cache_policy
+
+
+ETAG = 'W/"abc123"'
+
+
+@pytest.mark.parametrize("if_none_match, expected", [
+    ('W/"abc123"', True),
+    ('"abc123"', True),
+    ('"other", W/"abc123"', True),
+    ("*", True),
+    ('"other"', False),
+    ('W/"abc12"', False),
+    ("", False),
+])
+def test_etag_matches_weak_comparison(if_none_match, expected):
+    assert etag_matches(if_none_match, ETAG) is expected
+
+
+def test_etag_matches_strong_etag():
+    assert etag_matches('W/"abc123"', '"abc123"')
+
+
+def test_http_cache_policy_matches_exact_paths_and_id_prefixes():
+    assert http_cache_policy("/api/payment/packages").startswith("public, max-age=")
+    assert http_cache_policy("/api/analyses/jobs/job_123") == "private, no-cache"
+    assert http_cache_policy("/api/unknown") is None
@@ -0,0 +1,38 @@
+import asyncio
+
+import server
+
+
+def test_duplicate_payments_degrade_instead_of_blocking_readiness(mongo):
+    async def run():
+        # Left by the old check-then-insert webhook and session exchange
+        await mongo.payments.insert_many([{"order_id": "o1"}, {"order_id": "o1"}])
+        await mongo.users.insert_many([
+            {"user_id": "u1", "email": "a@example.com"},
+            {"user_id": "u2", "email": "a@example.com"}
+        ])
+        await mongo.anonymous_sessions.insert_many([
+            {"ip_hash": "h", "credits_used": 3},
+            {"ip_hash": "h", "credits_used": 4}
+        ])
+
+        resources = server.ResourceRegistry()
+        resources.warm("indexes", lambda: server.prepare_credit_indexes(mongo), required=True, timeout=None)
+        await server.prepare_secondary_indexes(mongo, resources.status)
+        await asyncio.gather(*resources._tasks)
+        return resources
+
+    resources = asyncio.run(run())
+    assert resources.status == {"indexes": "ready", "secondary_indexes": "degraded"}
+    assert resources.ready
+
+    sessions = asyncio.run(mongo.anonymous_sessions.find({}, {"_id": 0}).to_list(None))
+    assert sessions == [{"ip_hash": "h", "credits_used": server.ANONYMOUS_CREDIT_LIMIT}]
+    unique = asyncio.run(mongo.anonymous_sessions.index_information())
+    assert any(info["key"] == [("ip_hash", 1)] and info.get("unique") for info in unique.values())
+
+
+def test_all_indexes_ready_on_clean_data(mongo):
+    status = {}
+    asyncio.run(server.prepare_secondary_indexes(mongo, status))
+    assert status == {"secondary_indexes": "ready"}
@@ -0,0 +1,109 @@
+import asyncio
+
+import pytest
+
+import server
+from server import AnalysisError, PropertyAnalysisRequest
+
+REQUEST = PropertyAnalysisRequest(il="İstanbul", ilce="Kadıköy", mahalle="Moda", ada="101", parsel="7")
+
+
+@pytest.fixture
+def queue(monkeypatch, mongo):
+    """A user with 3 credits, retries due immediately and an analysis that fails the first `failures` times"""
+    calls = {"count": 0, "failures": 0}
+
+    async def get_property_analysis(request_data):
+        calls["count"] += 1
+        if calls["count"] <= calls["failures"]:
+            raise AnalysisError("Gemini hatası")
+        return {
+            "parcel": server.request_parcel(request_data),
+            "property_info": server.build_property_info(request_data),
+            "search_query": "moda 101 7",
+            "analysis": "KAK: 1.50",
+            "prompt_tokens": 42,
+            "zoning": {"kak": 1.5},
+            "cached": False
+        }
+
+    async def current_user(request, session_token=None):
+        return {"user_id": "u1"}
+
+    async def no_rate_limit(request, user):
+        return None
+
+    monkeypatch.setattr(server, "get_property_analysis", get_property_analysis)
+    monkeypatch.setattr(server, "get_current_user", current_user)
+    monkeypatch.setattr(server, "enforce_rate_limit", no_rate_limit)
+    monkeypatch.setattr(server, "JOB_RETRY_BACKOFF_SECONDS", 0)
+    asyncio.run(mongo.users.insert_one({"user_id": "u1", "email": "a@example.com", "credits": 3}))
+    return calls
+
+
+async def run_job():
+    """Queue a job and process it until it is done or failed"""
+    request = server.Request({"type": "http", "query_string": b"", "headers": []})
+    created = await server.create_analysis_job(REQUEST, request)
+    while (job := await server.claim_job()) is not None:
+        await server.process_job(job)
+    return created, await server.db.analysis_jobs.find_one({"job_id": created["job_id"]})
+
+
+async def credits():
+    return (await server.db.users.find_one({"user_id": "u1"}))["credits"]
+
+
+def test_job_keeps_the_credit_when_done(queue):
+    async def run():
+        created, job = await run_job()
+        return created, job, await credits()
+
+    created, job, balance = asyncio.run(run())
+    assert created["remaining_credits"] == 2
+    assert job["status"] == "done" and job["result"]["analysis"] == "KAK: 1.50"
+    assert balance == 2
+
+
+def test_retried_job_is_charged_and_recorded_once(queue, mongo):
+    queue["failures"] = server.JOB_MAX_ATTEMPTS - 1
+
+    async def run():
+        _, job = await run_job()
+        return job, await credits(), await mongo.analyses.count_documents({"analysis_id": job["job_id"]})
+
+    job, balance, recorded = asyncio.run(run())
+    assert (job["status"], job["attempts"]) == ("done", server.JOB_MAX_ATTEMPTS)
+    assert (balance, recorded) == (2, 1)
+
+
+def test_final_failure_refunds_the_credit(queue, mongo):
+    queue["failures"] = server.JOB_MAX_ATTEMPTS
+
+    async def run():
+        _, job = await run_job()
+        return job, await credits(), await mongo.analyses.count_documents({})
+
+    job, balance, recorded = asyncio.run(run())
+    assert (job["status"], job["attempts"], job["error"]) == ("failed", server.JOB_MAX_ATTEMPTS, "Gemini hatası")
+    assert (balance, recorded) == (3, 0)
+    assert queue["count"] == server.JOB_MAX_ATTEMPTS
+
+
+def test_stale_lease_holder_does_not_refund(queue, mongo):
+    queue["failures"] = server.JOB_MAX_ATTEMPTS
+
+    async def run():
+        request = server.Request({"type": "http", "query_string": b"", "headers": []})
+        await server.create_analysis_job(REQUEST, request)
+        await mongo.analysis_jobs.update_one({}, {"$set": {"attempts": server.JOB_MAX_ATTEMPTS - 1}})
+        stale = await server.claim_job()
+        # The lease expires and another worker takes the job over
+        await mongo.analysis_jobs.update_one({}, {"$set": {"lease_until": stale["available_at"]}})
+        await server.claim_job()
+        await server.process_job(stale)
+        return await credits(), await mongo.analysis_jobs.find_one({})
+
+    balance, job = asyncio.run(run())
+    assert balance == 2
+    assert job["status"] == "running"
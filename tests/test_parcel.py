@@ -0,0 +1,64 @@
+import unicodedata
+
+import pytest
+
+from server import PropertyAnalysisRequest, canonical_parcel, parcel_cache_key, parse_property_info
+
+
+def parcel(il="İstanbul", ilce="Kadıköy", mahalle="Moda", ada="101", parsel="7"):
+    return canonical_parcel(il, ilce, mahalle, ada, parsel)
+
+
+def test_canonical_parcel_lowercases_turkish_letters():
+    assert parcel() == {"il": "istanbul", "ilce": "kadiköy", "mahalle": "moda", "ada": "101", "parsel": "7"}
+    assert parcel(il="İZMİR")["il"] == "izmir"
+    assert parcel(ilce="ÜSKÜDAR")["ilce"] == "üsküdar"
+
+
+@pytest.mark.parametrize("il", ["Istanbul", "İstanbul", "ISTANBUL", "İSTANBUL", "istanbul", "ıstanbul"])
+def test_canonical_parcel_folds_dotted_and_dotless_i(il):
+    assert parcel(il=il)["il"] == "istanbul"
+
+
+def test_canonical_parcel_matches_ascii_typed_names():
+    assert parcel(ilce="KADIKÖY") == parcel(ilce="Kadıköy") == parcel(ilce="Kadiköy")
+    assert parcel(mahalle="MODA MAHALLESI") == parcel(mahalle="Moda Mahallesi")
+
+
+@pytest.mark.parametrize("mahalle", ["Moda", "Moda Mah.", "Moda mah", "MODA MAHALLESİ", "moda mahalle", "Moda Mh."])
+def test_canonical_parcel_strips_mahalle_suffixes(mahalle):
+    assert parcel(mahalle=mahalle)["mahalle"] == "moda"
+
+
+def test_canonical_parcel_keeps_suffix_words_inside_the_name():
+    assert parcel(mahalle="Mahmutbey")["mahalle"] == "mahmutbey"
+
+
+@pytest.mark.parametrize("raw, expected", [("007", "7"), ("7", "7"), (" 1 01 ", "101"), ("0", "0"), ("000", "0")])
+def test_canonical_parcel_normalizes_numbers(raw, expected):
+    assert parcel(ada=raw)["ada"] == expected
+    assert parcel(parsel=raw)["parsel"] == expected
+
+
+def test_canonical_parcel_keeps_non_numeric_parcel_numbers():
+    assert parcel(parsel="12A")["parsel"] == "12a"
+    assert parcel(ada="0A")["ada"] == "0a"
+
+
+def test_canonical_parcel_collapses_whitespace_and_unicode_forms():
+    decomposed = unicodedata.normalize("NFD", "Kadıköy")
+    assert parcel(ilce=f"  {decomposed} ") == parcel()
+    assert parcel(ilce="Kadı köy")["ilce"] == "kadi köy"
+    assert parcel(mahalle="Caferağa   Mahallesi")["mahalle"] == "caferağa"
+
+
+def test_parcel_cache_key_matches_for_spelling_variants():
+    a = PropertyAnalysisRequest(il="İstanbul", ilce="Kadıköy", mahalle="Moda Mah.", ada="101", parsel="007")
+    b = PropertyAnalysisRequest(il="İSTANBUL", ilce="KADIKÖY", mahalle="MODA MAHALLESİ", ada="101", parsel="7")
+    assert parcel_cache_key(a) == parcel_cache_key(b) == "istanbul|kadiköy|moda|101|7"
+
+
+def test_parse_property_info():
+    info = "İl: İstanbul, İlçe: Kadıköy, Mahalle: Moda Mah., Ada: 101, Parsel: 007"
+    assert parse_property_info(info) == parcel()
+    assert parse_property_info("Kadıköy 101/7") is None
@@ -0,0 +1,80 @@
+import asyncio
+import base64
+import hashlib
+import hmac
+import json
+
+import httpx
+import pytest
+
+import server
+
+
+@pytest.fixture
+def shop(mongo):
+    """A user and the unique order index the webhook claims orders with"""
+    async def setup():
+        await server.ensure_indexes(mongo)
+        await mongo.users.insert_one({"user_id": "u1", "email": "a@example.com", "credits": 0})
+
+    asyncio.run(setup())
+    return mongo
+
+
+def notification(order_id="1001", price="75.00", email="a@example.com"):
+    res = base64.b64encode(json.dumps({
+        "email": email, "orderid": order_id, "price": price, "istest": 1,
+        "buyername": "Ayşe", "buyersurname": "Yılmaz"
+    }).encode()).decode()
+    digest = hmac.new(server.SHOPIER_OSB_KEY.encode(), (res + server.SHOPIER_OSB_USERNAME).encode(), hashlib.sha256).hexdigest()
+    return {"res": res, "hash": digest}
+
+
+async def deliver(*forms):
+    transport = httpx.ASGITransport(app=server.app, client=("198.51.100.1", 443))
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        return [await client.post("/api/payment/webhook", data=form) for form in forms]
+
+
+async def balance(mongo):
+    return (await mongo.users.find_one({"user_id": "u1"}))["credits"]
+
+
+def test_duplicate_deliveries_grant_credits_once(shop):
+    async def run():
+        responses = await deliver(notification(), notification())
+        concurrent = await asyncio.gather(deliver(notification("1002")), deliver(notification("1002")))
+        return responses + [r for batch in concurrent for r in batch], await balance(shop)
+
+    responses, credits = asyncio.run(run())
+    assert [r.text for r in responses] == ["success"] * 4
+    assert credits == 100
+    assert asyncio.run(shop.payments.count_documents({"status": "completed"})) == 2
+
+
+def test_apply_payment_twice_is_harmless(shop):
+    async def run():
+        await deliver(notification())
+        # A crash after the credit grant leaves the payment pending for the sweeper
+        await shop.payments.update_one({"order_id": "1001"}, {"$set": {"status": "pending"}})
+        await server.apply_payment("1001")
+        await server.apply_payment("1001")
+        return await balance(shop), await shop.users.find_one({"user_id": "u1"})
+
+    credits, user = asyncio.run(run())
+    assert credits == 50
+    assert user["applied_orders"] == ["1001"]
+
+
+def test_invalid_hash_grants_nothing(shop):
+    form = {**notification(), "hash": "0" * 64}
+    response, = asyncio.run(deliver(form))
+    assert response.json() == {"status": "error", "message": "invalid hash"}
+    assert asyncio.run(balance(shop)) == 0
+
+
+def test_unknown_buyer_is_kept_as_unmatched(shop):
+    asyncio.run(deliver(notification(email="b@example.com")))
+    payment = asyncio.run(shop.payments.find_one({"order_id": "1001"}))
+    assert payment["status"] == "unmatched"
+    assert asyncio.run(balance(shop)) == 0
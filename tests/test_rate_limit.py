@@ -0,0 +1,98 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+import server
+from server import MongoSlidingWindowLimiter, SlidingWindowLimiter
+
+
+def hits(limiter, key="k", times=1, cost=1):
+    async def run():
+        return [await limiter.hit(key, cost=cost) for _ in range(times)]
+    return asyncio.run(run())
+
+
+def test_limiter_allows_up_to_the_limit(clock):
+    limiter = SlidingWindowLimiter("10/60", clock=clock)
+    assert hits(limiter, times=10) == [0.0] * 10
+    assert hits(limiter) == [60.0]
+    # Keys are independent
+    assert hits(limiter, key="other") == [0.0]
+
+
+def test_limiter_does_not_count_rejected_requests(clock):
+    limiter = SlidingWindowLimiter("10/60", clock=clock)
+    hits(limiter, times=15)  # 10 accepted, 5 rejected
+
+    # Half-way through the next window half of the previous count still applies
+    clock.advance(90)
+    results = hits(limiter, times=6)
+    assert results[:5] == [0.0] * 5
+    assert results[5] > 0
+
+
+def test_limiter_forgets_windows_older_than_the_previous_one(clock):
+    limiter = SlidingWindowLimiter("10/60", clock=clock)
+    hits(limiter, times=10)
+    clock.advance(120)
+    assert hits(limiter, times=10) == [0.0] * 10
+
+
+def test_limiter_retry_after_waits_for_the_previous_window_to_slide(clock):
+    limiter = SlidingWindowLimiter("10/60", clock=clock)
+    hits(limiter, times=10)
+    clock.advance(60)
+    retry_after = hits(limiter)[0]
+    assert 0 < retry_after < 60
+    clock.advance(retry_after + 0.001)
+    assert hits(limiter) == [0.0]
+
+
+def test_limiter_charges_cost(clock):
+    limiter = SlidingWindowLimiter("10/60", clock=clock)
+    assert hits(limiter, cost=8) == [0.0]
+    assert hits(limiter, cost=3)[0] > 0
+    assert hits(limiter, cost=2) == [0.0]
+    assert hits(limiter)[0] > 0
+
+
+def test_limiter_rejects_cost_above_the_limit(clock):
+    limiter = SlidingWindowLimiter("10/60", clock=clock)
+    assert hits(limiter, cost=11) == [60.0]
+    assert hits(limiter, cost=10) == [0.0]
+
+
+@pytest.mark.parametrize("limiter_class", [SlidingWindowLimiter, MongoSlidingWindowLimiter])
+def test_limiters_agree(limiter_class, clock, mongo):
+    limiter = limiter_class("5/60", clock=clock)
+    assert hits(limiter, times=7)[5:] == [60.0, 60.0]
+    assert hits(limiter, key="bulk", cost=4) == [0.0]
+    assert hits(limiter, key="bulk", cost=2)[0] > 0
+    assert hits(limiter, key="bulk") == [0.0]
+
+    clock.advance(90)
+    results = hits(limiter, times=3)
+    assert results[:2] == [0.0, 0.0] and results[2] > 0
+
+
+def test_mongo_limiter_counts_only_accepted_requests(clock, mongo):
+    limiter = MongoSlidingWindowLimiter("5/60", clock=clock)
+    hits(limiter, times=8)
+    counters = asyncio.run(mongo.rate_limits.find({}, {"_id": 0, "count": 1}).to_list(None))
+    assert counters == [{"count": 5}]
+
+
+def test_bulk_batches_are_charged_per_parcel(monkeypatch, clock):
+    monkeypatch.setattr(server, "bulk_rate_limiter", SlidingWindowLimiter("10/3600", clock=clock))
+    user = {"user_id": "user_1"}
+
+    with pytest.raises(HTTPException) as too_big:
+        asyncio.run(server.enforce_bulk_rate_limit(user, 11))
+    assert too_big.value.status_code == 400
+
+    asyncio.run(server.enforce_bulk_rate_limit(user, 10))
+    with pytest.raises(HTTPException) as limited:
+        asyncio.run(server.enforce_bulk_rate_limit(user, 1))
+    assert limited.value.status_code == 429
+    assert int(limited.value.headers["Retry-After"]) > 0
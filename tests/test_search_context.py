@@ -0,0 +1,80 @@
+import asyncio
+
+import server
+from server import (
+    BRAVE_NO_RESULTS_TEXT,
+    PropertyAnalysisRequest,
+    build_search_context,
+)
+
+REQUEST = PropertyAnalysisRequest(il="İstanbul", ilce="Kadıköy", mahalle="Moda", ada="101", parsel="7")
+
+
+def result(title, description, url):
+    return {"title": title, "description": description, "url": url}
+
+
+def test_search_context_without_results():
+    assert build_search_context([], REQUEST) == BRAVE_NO_RESULTS_TEXT
+
+
+def test_search_context_drops_duplicate_urls_and_near_duplicate_snippets():
+    snippet = "Kadıköy Moda mahallesi imar planı değişikliği askıya çıktı, konut alanlarında emsal 1.50"
+    context = build_search_context([
+        result("Moda imar planı", snippet, "https://a.example/1"),
+        result("Moda imar planı (kopya)", "farklı bir açıklama", "https://a.example/1"),
+        result("Moda imar planı", snippet + " haberi", "https://b.example/2"),
+    ], REQUEST)
+    assert context.count("URL:") == 1
+    assert "https://a.example/1" in context
+    assert "kopya" not in context
+
+
+def test_search_context_ranks_parcel_matches_first():
+    context = build_search_context([
+        result("Kadıköy'de kiralık daire", "Moda sahiline yakın 2+1 daire", "https://ilan.example/1"),
+        result("Moda 101 ada 7 parsel", "İmar durumu: konut, KAK 1.50, TAKS 0.30", "https://imar.example/7"),
+    ], REQUEST)
+    assert context.index("https://imar.example/7") < context.index("https://ilan.example/1")
+
+
+def test_search_context_keeps_ties_in_search_order():
+    context = build_search_context([
+        result("Birinci", "aaa bbb", "https://x.example/1"),
+        result("İkinci", "ccc ddd", "https://x.example/2"),
+    ], REQUEST)
+    assert context.index("x.example/1") < context.index("x.example/2")
+
+
+def test_search_context_packs_within_the_token_budget():
+    results = [
+        result(f"Moda imar {i}", f"{'uzun açıklama ' * 40}{i}", f"https://x.example/{i}")
+        for i in range(10)
+    ]
+    context = build_search_context(results, REQUEST, token_budget=400)
+    assert 0 < context.count("URL:") < 10
+    assert len(context) // 4 <= 400
+
+
+def test_search_context_skips_entries_over_the_budget():
+    results = [result("Kısa", "imar", "https://x.example/short"), result("Uzun", "x" * 4000, "https://x.example/long")]
+    context = build_search_context(results, REQUEST, token_budget=100)
+    assert "x.example/short" in context
+    assert "x.example/long" not in context
+
+
+def test_cache_hits_record_no_prompt_tokens(mongo):
+    analysis = {
+        "parcel": {"il": "istanbul", "ilce": "kadiköy", "mahalle": "moda", "ada": "101", "parsel": "7"},
+        "property_info": "İl: İstanbul, İlçe: Kadıköy, Mahalle: Moda, Ada: 101, Parsel: 7",
+        "search_query": "moda 101 7",
+        "analysis": "KAK: 1.50",
+        "prompt_tokens": 1200
+    }
+
+    async def run():
+        await server.CreditReservation(4, user_id="u1").commit({**analysis, "cached": False})
+        await server.CreditReservation(3, user_id="u1").commit({**analysis, "cached": True})
+        return await mongo.analyses.find({}, {"_id": 0, "cached": 1, "prompt_tokens": 1}).to_list(None)
+
+    assert asyncio.run(run()) == [{"cached": False, "prompt_tokens": 1200}, {"cached": True, "prompt_tokens": None}]
@@ -0,0 +1,130 @@
+import asyncio
+
+import pytest
+
+import server
+from server import MarkdownStreamCleaner, PropertyAnalysisRequest, clean_markdown
+
+
+def stream(chunks):
+    cleaner = MarkdownStreamCleaner()
+    return "".join(cleaner.feed(chunk) for chunk in chunks) + cleaner.flush()
+
+
+TEXT = "**İMAR DURUMU**\n## Yapılaşma\nKAK: **1.50** ve TAKS *0.30* ### Not\n#"
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 5, 8, len(TEXT)])
+def test_stream_cleaner_matches_clean_markdown_for_any_split(size):
+    chunks = [TEXT[i:i + size] for i in range(0, len(TEXT), size)]
+    assert stream(chunks) == clean_markdown(TEXT)
+
+
+def test_stream_cleaner_holds_back_a_trailing_marker():
+    cleaner = MarkdownStreamCleaner()
+    assert cleaner.feed("Önemli *") == "Önemli "
+    assert cleaner.feed("*bilgi**") == "bilgi"
+    assert cleaner.flush() == ""
+
+
+def test_stream_cleaner_flushes_a_lone_marker():
+    cleaner = MarkdownStreamCleaner()
+    assert cleaner.feed("5 yıldız *") == "5 yıldız "
+    assert cleaner.flush() == "*"
+
+
+@pytest.fixture
+def pipeline(monkeypatch, mongo):
+    """Anonymous requests with a fake Brave + Gemini pipeline that runs once the gate opens"""
+    calls = {"prepare": 0, "gemini": 0}
+    gate = asyncio.Event()
+
+    async def prepare_analysis(request_data):
+        calls["prepare"] += 1
+        await gate.wait()
+        return {
+            "parcel": server.request_parcel(request_data),
+            "property_info": server.build_property_info(request_data),
+            "search_query": "moda 101 7",
+            "prompt": "prompt",
+            "search_failed": False
+        }
+
+    async def stream_gemini(prompt, usage=None):
+        calls["gemini"] += 1
+        usage["prompt_tokens"] = 42
+        for chunk in ["**KAK", "**: 1.50"]:
+            yield chunk
+
+    async def analyze_with_gemini(prompt):
+        calls["gemini"] += 1
+        return "KAK: 1.50", 42
+
+    async def current_user(request, session_token=None):
+        return None
+
+    async def no_rate_limit(request, user):
+        return None
+
+    async def reserve_credit(request, user):
+        return server.CreditReservation(2, ip_hash="ip")
+
+    monkeypatch.setattr(server, "prepare_analysis", prepare_analysis)
+    monkeypatch.setattr(server, "stream_gemini", stream_gemini)
+    monkeypatch.setattr(server, "analyze_with_gemini", analyze_with_gemini)
+    monkeypatch.setattr(server, "get_current_user", current_user)
+    monkeypatch.setattr(server, "enforce_rate_limit", no_rate_limit)
+    monkeypatch.setattr(server, "reserve_credit", reserve_credit)
+    return calls, gate
+
+
+async def collect_stream():
+    request_data = PropertyAnalysisRequest(il="İstanbul", ilce="Kadıköy", mahalle="Moda", ada="101", parsel="7")
+    request = server.Request({"type": "http", "query_string": b"", "headers": []})
+    response = await server.analyze_property_stream(request_data, request)
+    return "".join([chunk async for chunk in response.body_iterator])
+
+
+def test_concurrent_streams_share_one_analysis(pipeline):
+    calls, gate = pipeline
+
+    async def run():
+        first = asyncio.create_task(collect_stream())
+        await asyncio.sleep(0)
+        second = asyncio.create_task(collect_stream())
+        joined = asyncio.create_task(server.get_property_analysis(
+            PropertyAnalysisRequest(il="İSTANBUL", ilce="Kadıköy", mahalle="Moda Mah.", ada="101", parsel="007")
+        ))
+        await asyncio.sleep(0)
+        gate.set()
+        return await asyncio.gather(first, second, joined)
+
+    first, second, joined = asyncio.run(run())
+    assert calls == {"prepare": 1, "gemini": 1}
+    assert 'data: {"text": "KAK: 1.50"}' in second
+    assert "event: done" in first and "event: done" in second
+    assert joined["analysis"] == "KAK: 1.50" and joined["cached"] is False
+    assert server.analysis_inflight == {}
+
+
+def test_failed_stream_fails_its_joiners(pipeline, monkeypatch):
+    calls, gate = pipeline
+
+    async def failing_gemini(prompt, usage=None):
+        raise server.AnalysisError("Gemini hatası")
+        yield
+
+    monkeypatch.setattr(server, "stream_gemini", failing_gemini)
+
+    async def run():
+        first = asyncio.create_task(collect_stream())
+        await asyncio.sleep(0)
+        second = asyncio.create_task(collect_stream())
+        await asyncio.sleep(0)
+        gate.set()
+        return await asyncio.gather(first, second)
+
+    first, second = asyncio.run(run())
+    assert calls["prepare"] == 1
+    assert "event: error" in first and "event: error" in second
+    assert server.analysis_inflight == {}
@@ -0,0 +1,148 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+import server
+from server import ZONING_FIELDS, extract_zoning_attributes, zoning_range_filter, zoning_scope
+
+
+def extract(text):
+    return {field: value for field, value in extract_zoning_attributes(text).items() if value is not None}
+
+
+def test_extracts_every_attribute():
+    text = (
+        "YAPILAŞMA KOŞULLARI\n"
+        "KAK (Kat Alanı Katsayısı): 1.50\n"
+        "TAKS (Taban Alanı Katsayısı): 0.30\n"
+        "Emsal: 1,50\n"
+        "Maksimum Kat Sayısı: 5\n"
+        "Yapı Yüksekliği: 15.50 m\n"
+    )
+    assert extract_zoning_attributes(text) == {"kak": 1.5, "taks": 0.3, "emsal": 1.5, "max_floors": 5, "height_m": 15.5}
+    assert list(extract_zoning_attributes(text)) == ZONING_FIELDS
+
+
+def test_missing_attributes_are_none():
+    assert extract_zoning_attributes("İmar durumu bilinmiyor.") == dict.fromkeys(ZONING_FIELDS)
+
+
+def test_labels_listed_together_get_no_value():
+    assert extract("KAK ve TAKS değerleri 0.40 ile 1.20 arasında") == {}
+    assert extract("KAK, TAKS: 0.40") == {"taks": 0.4}
+
+
+def test_number_is_not_taken_across_another_label():
+    assert extract("KAK belirtilmemiş, TAKS 0.35") == {"taks": 0.35}
+    assert extract("Taks değeri 0,35 olup KAK 1.20") == {"taks": 0.35, "kak": 1.2}
+
+
+def test_kak_and_emsal_are_synonyms():
+    assert extract("Emsal (KAK): 1.50") == {"kak": 1.5, "emsal": 1.5}
+
+
+@pytest.mark.parametrize("text", ["TAKS 0.30-0.40", "TAKS 0,30 – 0,40", "TAKS %30 ile %40", "TAKS 0.30 ile 0.40 arasında"])
+def test_ranges_are_not_single_values(text):
+    assert extract(text) == {}
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("TAKS: %30", 0.3),
+    ("TAKS: % 35", 0.35),
+    ("TAKS: 0,35", 0.35),
+    ("taks=0.4", 0.4),
+    ("TAKS: %0.4", 0.4),
+])
+def test_taks_formats(text, expected):
+    assert extract(text) == {"taks": expected}
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("Emsal değeri 1/1000 ölçekli planda 1.50", {"emsal": 1.5}),
+    ("KAK: 1/5000 ölçekli nazım imar planına göre belirlenecektir", {}),
+    ("TAKS 1 / 1000 ölçekli uygulama imar planında 0.30", {"taks": 0.3}),
+])
+def test_plan_scales_are_not_values(text, expected):
+    assert extract(text) == expected
+
+
+def test_turkish_casing_and_alternative_labels():
+    assert extract("BİNA YÜKSEKLİĞİ: 12.50 m\nKAT ADEDİ: 4") == {"height_m": 12.5, "max_floors": 4}
+    assert extract("Hmax = 9.50 m") == {"height_m": 9.5}
+    assert extract("h max: 21") == {"height_m": 21.0}
+
+
+def test_implausible_values_are_skipped():
+    assert extract("TAKS: 30 (m²)") == {}
+    assert extract("Kat sayısı: 0") == {}
+    assert extract("Yapı yüksekliği: 2024 yılında belirlendi, yapı yüksekliği 15 m") == {"height_m": 15.0}
+
+
+def test_value_must_be_on_the_label_line():
+    assert extract("KAK:\n1.50") == {}
+
+
+def test_value_must_be_near_the_label():
+    assert extract("KAK " + "x" * 50 + " 1.50") == {}
+
+
+def test_zoning_scope_requires_the_location_prefix():
+    assert zoning_scope("İstanbul", "Kadıköy", "Moda Mah.") == {
+        "parcel.il": "istanbul", "parcel.ilce": "kadiköy", "parcel.mahalle": "moda"
+    }
+    assert zoning_scope(None, None, None) == {}
+    with pytest.raises(HTTPException):
+        zoning_scope(None, "Kadıköy", None)
+    with pytest.raises(HTTPException):
+        zoning_scope("İstanbul", None, "Moda")
+
+
+def test_zoning_range_filter():
+    assert zoning_range_filter({"kak_min": "1.5", "taks_max": "0.3", "other": "1"}) == {
+        "zoning.kak": {"$gte": 1.5}, "zoning.taks": {"$lte": 0.3}
+    }
+    assert zoning_range_filter({"max_floors_min": "2", "max_floors_max": "5"}) == {"zoning.max_floors": {"$gte": 2.0, "$lte": 5.0}}
+    with pytest.raises(HTTPException):
+        zoning_range_filter({"kak_min": "bir"})
+
+
+def test_migration_re_extracts_older_analyses(mongo):
+    text = "Emsal değeri 1/1000 ölçekli planda 1.50"
+    parcel = {"il": "istanbul", "ilce": "kadiköy", "mahalle": "moda", "ada": "101", "parsel": "7"}
+    key = "istanbul|kadiköy|moda|101|7"
+
+    async def run():
+        digest = await server.store_analysis_body(text, mongo)
+        await mongo.analyses.insert_one({"parcel": parcel, "analysis_hash": digest, "zoning": {"emsal": 1.0}, "timestamp": "2026-01-01"})
+        await mongo.parcel_zoning.insert_one({"_id": key, "parcel": parcel, "zoning": {"emsal": 1.0}, "analysis_hash": digest})
+        migrated = await server.migrate_zoning_attributes(mongo)
+        again = await server.migrate_zoning_attributes(mongo)
+        return migrated, again, await mongo.analyses.find_one({}), await mongo.parcel_zoning.find_one({"_id": key})
+
+    migrated, again, analysis, row = asyncio.run(run())
+    assert (migrated, again) == (1, 0)
+    assert analysis["zoning"]["emsal"] == 1.5
+    assert analysis["zoning_version"] == server.ZONING_EXTRACTION_VERSION
+    assert row["zoning"]["emsal"] == 1.5
+
+
+def test_parcel_listing_is_staff_only(monkeypatch, mongo):
+    monkeypatch.setattr(server, "STAFF_EMAILS", {"staff@parseldeger.com"})
+    asyncio.run(mongo.parcel_zoning.insert_one({
+        "_id": "istanbul|kadiköy|moda|101|7",
+        "parcel": {"il": "istanbul", "ilce": "kadiköy", "mahalle": "moda", "ada": "101", "parsel": "7"},
+        "zoning": {"kak": 1.5}
+    }))
+
+    def list_as(email):
+        async def current_user(request, session_token=None):
+            return {"user_id": "u", "email": email}
+        monkeypatch.setattr(server, "get_current_user", current_user)
+        request = server.Request({"type": "http", "query_string": b"", "headers": []})
+        return asyncio.run(server.list_parcel_zoning(request, limit=10))
+
+    with pytest.raises(HTTPException) as forbidden:
+        list_as("customer@example.com")
+    assert forbidden.value.status_code == 403
+    assert [item["parcel"]["parsel"] for item in list_as("Staff@parseldeger.com")["items"]] == ["7"]